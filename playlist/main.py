@@ -1,6 +1,9 @@
 from __future__ import generator_stop
 
 import asyncio
+import collections
+import concurrent.futures
+import copy
 import functools
 import pprint
 import typing
@@ -8,23 +11,65 @@ import typing
 import arrow
 import gmusicapi
 
-from playlist.core import lib as corelib
-from playlist.sql import lib as sqllib
+from playlist.core import config, lib as corelib
+from playlist.sql import conn, lib as sqllib, maintenance_lib, snapshot_lib
 from playlist.crypt import sync_lib as cryptlib
 from playlist.pd import lib as pdlib
 
-USERNAME = 'chill@darkhelm.org'
+ACCOUNT_DEFAULTS = {
+    'parallelism': 2,
+}
 
-loop = asyncio.get_event_loop()
+DIFF_DEFAULTS = {
+    'engine': 'fused',
+    'partitions': 0,
+    'workers': 1,
+    'batch_size': 5000,
+}
 
-api = gmusicapi.Mobileclient()
-print('Logging in with mobile client...')
-logged_in = api.login(
-    'chill@darkhelm.org',
-    cryptlib.decrypt(sqllib.get_password(username=USERNAME)),
-    gmusicapi.Mobileclient.FROM_MAC_ADDRESS
-)
-print('Logged in.')
+# The diff categories the import needs the rows of; only updates feed the
+# play history, every other category is only counted.
+DIFF_WANT = ('updates',)
+
+# Counts in the account reports that are added up in the run report.
+TOTALS = ('tracks', 'inserts', 'updates', 'deletes', 'plays', 'promoted')
+
+
+def _settings(
+    name: str,
+    defaults: typing.Mapping[str, typing.Any]
+) -> typing.Dict[str, typing.Any]:
+    section = dict(defaults)
+    with config.settings as settings:
+        section.update(copy.deepcopy(settings.get(name)) or {})
+    return section
+
+
+def login(username: str, password: str) -> gmusicapi.Mobileclient:
+    """
+    Log an account in with the mobile client.
+
+    Args:
+        username (str): The account's username.
+        password (str): The account's encrypted password.
+
+    Returns:
+        gmusicapi.Mobileclient: The logged in client.
+
+    Raises:
+        RuntimeError: If the account could not log in.
+    """
+    api = gmusicapi.Mobileclient()
+    print(f'Logging in {username} with mobile client...')
+    logged_in = api.login(
+        username,
+        cryptlib.decrypt(password),
+        gmusicapi.Mobileclient.FROM_MAC_ADDRESS
+    )
+    if not logged_in:
+        raise RuntimeError(f'Could not log in {username}.')
+    print(f'Logged in {username}.')
+    return api
 
 
 @corelib.inject_loop
@@ -46,7 +91,7 @@ async def load_batch(
             if key in {
                 'creationTimestamp',
                 'lastModifiedTimestamp',
-                'recentTimestamp',
+                'lastRatingChangeTimestamp',
                 'recentTimestamp'
             }
             else value
@@ -62,25 +107,267 @@ async def load_batch(
 
 
 @corelib.inject_loop
-async def import_from_gpm(*, loop: asyncio.AbstractEventLoop) -> None:
+async def import_from_gpm(
+    api: gmusicapi.Mobileclient,
+    *,
+    loop: asyncio.AbstractEventLoop
+) -> typing.Dict[str, typing.Any]:
+    """
+    Import an account's library, and diff it against the last import.
+
+    Args:
+        api (gmusicapi.Mobileclient): The logged in client of the account.
+
+    Returns:
+        Dict[str, Any]: The counts of what was imported and changed.
+    """
     batch_iter = corelib.AsyncIterator(
         await loop.run_in_executor(
             None,
             functools.partial(api.get_all_songs, incremental=True)
         )
     )
+    await loop.run_in_executor(None, sqllib.migrate_track_keys)
     print('Clearing SQL table.')
     await loop.run_in_executor(None, sqllib.erase_new_tracks)
-    tasks = [
-        asyncio.ensure_future(load_batch(batch))
-        async for batch in batch_iter
-    ]
+    loaded = 0
+    tasks = []
+    async for batch in batch_iter:
+        loaded += len(batch)
+        tasks.append(asyncio.ensure_future(load_batch(batch)))
     for task in asyncio.as_completed(tasks):
         print(await task)
 
-    curr_coro = loop.run_in_executor(None, sqllib.get_current_tracks)
-    prev_coro = loop.run_in_executor(None, sqllib.get_previous_tracks)
-    results = await pdlib.get_ins_upd_del('Tracks', curr_coro, prev_coro, 'id')
-    pprint.pprint(results)
+    counts, plays = await diff_tracks()
+
+    promoted = await loop.run_in_executor(None, sqllib.promote_new_tracks)
+    await sqllib.compact_tombstones()
+    await loop.run_in_executor(None, maintenance_lib.incremental_vacuum)
+    backup = await loop.run_in_executor(
+        None,
+        maintenance_lib.scheduled_backup
+    )
+
+    # The promoted table has typed columns, which the snapshot stores
+    # fixed-width; the staged ones are mostly strings.
+    snapshot = await loop.run_in_executor(
+        None,
+        snapshot_lib.write_snapshot,
+        'Tracks'
+    )
+
+    return {
+        'tracks': loaded,
+        'inserts': counts['inserts'],
+        'updates': counts['updates'],
+        'deletes': counts['deletes'],
+        'plays': plays,
+        'promoted': promoted,
+        'backup': str(backup) if backup else None,
+        'snapshot': str(snapshot),
+    }
+
+
+@corelib.inject_loop
+async def record_plays(
+    results: pdlib.DiffResult,
+    batch_size: int,
+    *,
+    loop: asyncio.AbstractEventLoop
+) -> int:
+    """Record the updates of a diff in the play history, by batch."""
+    plays = 0
+    async for batch in results.batches('updates', batch_size):
+        plays += await loop.run_in_executor(
+            None,
+            sqllib.record_play_history,
+            batch
+        )
+    return plays
+
+
+@corelib.inject_loop
+async def diff_tracks(
+    *,
+    loop: asyncio.AbstractEventLoop
+) -> typing.Tuple[typing.Dict[str, int], int]:
+    """
+    Diff the imported tracks against the previous ones.
+
+    Updates are recorded in the play history a batch at a time. With
+    ``diff.partitions`` set, the tracks are streamed out of the database
+    and diffed a partition at a time, so the library never has to fit in
+    memory.
+
+    Returns:
+        Tuple[Dict[str, int], int]: The number of inserts, updates, deletes
+        and skips, and the number of play events recorded.
+    """
+    diff_settings = _settings('diff', DIFF_DEFAULTS)
+    schema = sqllib.table_schema('Tracks')
+    compare = sqllib.table_compare('Tracks')
+
+    if not diff_settings['partitions']:
+        curr_coro = loop.run_in_executor(None, sqllib.get_current_columns)
+        prev_coro = loop.run_in_executor(None, sqllib.get_previous_columns)
+        results = await pdlib.get_ins_upd_del(
+            'Tracks',
+            curr_coro,
+            prev_coro,
+            'trackKey',
+            engine=diff_settings['engine'],
+            schema=schema,
+            want=DIFF_WANT,
+            compare=compare
+        )
+        counts = results.counts
+        plays = await record_plays(results, diff_settings['batch_size'])
+
+    else:
+        counts = collections.Counter()
+        plays = 0
+        async for part in pdlib.get_ins_upd_del_partitioned(
+            'Tracks',
+            sqllib.iter_current_columns(diff_settings['batch_size']),
+            sqllib.iter_previous_columns(diff_settings['batch_size']),
+            'trackKey',
+            partitions=diff_settings['partitions'],
+            workers=diff_settings['workers'],
+            schema=schema,
+            want=DIFF_WANT,
+            compare=compare
+        ):
+            counts.update(part.counts)
+            plays += await record_plays(part, diff_settings['batch_size'])
+
+    print(f'Recorded {plays} play events.')
+    return counts, plays
+
+
+def run_account(
+    account: typing.Mapping[str, typing.Any]
+) -> typing.Dict[str, typing.Any]:
+    """
+    Run the daily import of one account.
+
+    This is run in a worker process of its own: the account's database
+    replaces the default trackdb file for the rest of the process.
+
+    Args:
+        account (Mapping[str, Any]): The account, as returned by
+            :py:func:`playlist.sql.lib.list_accounts`.
+
+    Returns:
+        Dict[str, Any]: The report of the account's import.
+    """
+    if account['database']:
+        conn.trackdb.configure(file=account['database'])
+    # A forked worker starts with the supervisor's metrics.
+    conn.trackdb.metrics.reset()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    started = arrow.utcnow()
+    try:
+        api = login(account['username'], account['password'])
+        with sqllib.staging():
+            report = loop.run_until_complete(import_from_gpm(api))
+    finally:
+        loop.close()
+
+    report.update(
+        username=account['username'],
+        database=str(conn.trackdb.path),
+        started=started.isoformat(),
+        seconds=(arrow.utcnow() - started).total_seconds(),
+        metrics=conn.trackdb.metrics.snapshot(),
+        error=None,
+    )
+    return report
+
+
+def run_accounts(
+    parallelism: typing.Optional[int]=None
+) -> typing.Dict[str, typing.Any]:
+    """
+    Run the daily import of every account, concurrently.
+
+    Each account is imported in its own worker process, at most
+    ``parallelism`` at a time. An account failing doesn't stop the others;
+    its error is recorded in its report instead.
+
+    Args:
+        parallelism (Optional[int]): The most accounts imported at the same
+            time. Defaults to the ``accounts.parallelism`` setting.
+
+    Returns:
+        Dict[str, Any]: The combined report, with the report of each
+        account under ``accounts``, and their counts added up under
+        ``totals``.
+
+    Raises:
+        ValueError: If accounts share a database file.
+    """
+    if parallelism is None:
+        parallelism = _settings('accounts', ACCOUNT_DEFAULTS)['parallelism']
+
+    accounts = sqllib.list_accounts()
+    shared = [
+        database or 'default'
+        for database, count in collections.Counter(
+            account['database'] for account in accounts
+        ).items()
+        if count > 1
+    ]
+    if shared:
+        raise ValueError(
+            f'Accounts share the database file(s): {", ".join(shared)}'
+        )
+
+    started = arrow.utcnow()
+    reports = []
+    if accounts:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max(1, min(parallelism, len(accounts)))
+        ) as executor:
+            futures = {
+                executor.submit(run_account, account): account
+                for account in accounts
+            }
+            for future in concurrent.futures.as_completed(futures):
+                account = futures[future]
+                try:
+                    report = future.result()
+                except Exception as exc:
+                    report = {
+                        'username': account['username'],
+                        'database': account['database'],
+                        'error': f'{type(exc).__name__}: {exc}',
+                    }
+                    print(f"Import of {account['username']} failed: {exc}")
+                else:
+                    print(
+                        f"Imported {account['username']} in "
+                        f"{report['seconds']:.1f} seconds."
+                    )
+                reports.append(report)
+
+    reports.sort(key=lambda report: report['username'])
+    return {
+        'started': started.isoformat(),
+        'seconds': (arrow.utcnow() - started).total_seconds(),
+        'parallelism': parallelism,
+        'accounts': reports,
+        'failed': [
+            report['username'] for report in reports if report['error']
+        ],
+        'totals': {
+            key: sum(report.get(key) or 0 for report in reports)
+            for key in TOTALS
+        },
+    }
+
 
-loop.run_until_complete(import_from_gpm())
+if __name__ == '__main__':
+    print('Run report:')
+    pprint.pprint(run_accounts())
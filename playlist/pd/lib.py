@@ -1,35 +1,142 @@
 """Module containing the pandas code for gpm-playlist."""
 __all__ = (
+    'DiffResult',
     'get_ins_upd_del',
+    'get_ins_upd_del_partitioned',
 )
 
 import asyncio
+import collections.abc
+import concurrent.futures
+import contextlib
 import functools
+import inspect
+import pathlib
+import pickle
+import shutil
+import tempfile
+import time
 import typing
 
+import arrow
 import numpy
 import pandas
 
-from playlist.core import lib as corelib
+from playlist.core import const, lib as corelib
+
+# The ways get_ins_upd_del can compare the current and previous data.
+ENGINES = ('fused', 'merge', 'hash', 'sorted')
+
+# The suffixes telling the current and previous columns apart once merged.
+SUFFIXES = ('_x', '_y')
+
+# The categories of rows a diff sorts the data into.
+CATEGORIES = ('inserts', 'updates', 'deletes', 'skips')
+
+# The number of partitions a partitioned diff spills its inputs into.
+PARTITIONS = 16
+
+# The number of records in each batch a diff result yields.
+BATCH_SIZE = 5_000
+
+# The field of each update listing the names of the fields that changed.
+CHANGED = '_changed'
+
+# The field of each update holding the previous values of the fields that
+# changed, by field name.
+PREVIOUS = '_previous'
+
+# String columns with at most this many distinct values per row are made
+# categorical.
+CATEGORY_RATIO = 0.5
+
+# The settings of a column's compare policy, see compare_policies.
+POLICY_KEYS = ('abs_tol', 'rel_tol', 'granularity', 'null_values')
+
+# A column's compare policy, by setting.
+Policy = typing.Mapping[str, typing.Any]
+
+# An odd 64 bit multiplier for combining column hashes into row hashes.
+HASH_MULTIPLIER = numpy.uint64(0x9E3779B97F4A7C15)
+
+
+# The kinds of data the diff accepts for the current and previous data.
+DiffData = typing.Union[
+    typing.List[dict],
+    typing.Mapping[str, typing.Sequence],
+    numpy.ndarray,
+    pandas.DataFrame,
+    'pyarrow.Table',
+    'pyarrow.RecordBatch',
+    'pyarrow.RecordBatchReader',
+]
+
+
+def to_frame(data: DiffData) -> pandas.DataFrame:
+    """
+    Convert data in any of the forms the diff accepts into a dataframe.
+
+    The data can be a list of records, a mapping of column names to
+    sequences of values (as returned by
+    :py:func:`playlist.sql.lib.get_current_columns`), a NumPy structured
+    array, a pandas DataFrame, or an Arrow table, record batch or record
+    batch reader. All but the records are converted column by column,
+    without building a dict per row. Arrow data is recognized by its
+    methods, so pyarrow is only needed by the callers passing it.
+
+    Args:
+        data (DiffData): The data.
+
+    Returns:
+        pandas.DataFrame: The data. DataFrames are returned as they are.
+    """
+    if isinstance(data, pandas.DataFrame):
+        return data
+    if hasattr(data, 'read_all'):
+        # An Arrow record batch reader, read into a table.
+        data = data.read_all()
+    if hasattr(data, 'to_pandas'):
+        # An Arrow table or record batch; columns become separate blocks,
+        # so numeric columns without nulls are not copied.
+        return data.to_pandas(split_blocks=True)
+    if isinstance(data, numpy.ndarray):
+        if data.dtype.names is None:
+            raise TypeError('Only structured NumPy arrays can be diffed.')
+        return pandas.DataFrame(data)
+    if isinstance(data, collections.abc.Mapping):
+        return pandas.DataFrame(dict(data))
+    return pandas.DataFrame.from_records(data)
 
 
 def dict_to_df(
-    data: typing.List[dict],
+    data: DiffData,
     index: typing.Union[str, typing.List[str]],
-    type_: str
-) -> typing.Tuple[
-    str,
-    typing.Dict[str, typing.Union[pandas.DataFrame, numpy.ndarray]]
-]:
-    """Convert intial list of dicts into a dataframe for current/previous."""
-    try:
-        df = pandas.DataFrame.from_records(data, index=index)
-    except KeyError:
-        if isinstance(index, str):
-            index = pandas.Index(data=[], name=index)
+    type_: str,
+    schema: typing.Optional[typing.Mapping[str, str]]=None
+) -> pandas.DataFrame:
+    """
+    Convert the initial data into a dataframe for current/previous.
 
-        df = pandas.DataFrame(index=index)
-    df = df.sort_index()
+    The data can be in any of the forms :py:func:`to_frame` accepts. The
+    index is made from the key field(s), unless a DataFrame is already
+    indexed by them, and is only sorted when it isn't already.
+    """
+    df = to_frame(data)
+    keys = [index] if isinstance(index, str) else list(index)
+    if set(keys).issubset(df.columns):
+        df = df.set_index(index)
+    elif list(df.index.names) != keys:
+        if not df.empty:
+            raise KeyError(f'The {type_} data has no {index!r} field.')
+        if isinstance(index, str):
+            df = pandas.DataFrame(index=pandas.Index([], name=index))
+        else:
+            df = pandas.DataFrame(
+                index=pandas.MultiIndex.from_tuples([], names=index)
+            )
+    df = compact_frame(df, schema)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
     print(f'Converted {type_} to DataFrame of size {df.size}')
     return df
 
@@ -72,72 +179,597 @@ def merge_entries(
     return merged, ret_cols
 
 
-def df_to_dict(data: pandas.DataFrame) -> typing.List[dict]:
+def _column_type(series: pandas.Series) -> str:
+    """Get the YAML column type matching a column's dtype."""
+    if pandas.api.types.is_bool_dtype(series.dtype):
+        return 'Boolean'
+    if pandas.api.types.is_integer_dtype(series.dtype):
+        return 'Integer'
+    if pandas.api.types.is_float_dtype(series.dtype):
+        return 'Float'
+    return 'Object'
+
+
+def _to_numeric(series: pandas.Series) -> pandas.Series:
+    """
+    Convert a column to numbers.
+
+    Raises:
+        ValueError: If a value that isn't null isn't a number either, rather
+            than make it null.
+    """
+    if pandas.api.types.is_numeric_dtype(series.dtype):
+        return series
+    numbers = pandas.to_numeric(series, errors='coerce')
+    lost = numbers.isna().values & series.notna().values
+    if lost.any():
+        raise ValueError(
+            f'The {series.name} column has values that are not numbers, '
+            f'such as {series[lost].iloc[0]!r}.'
+        )
+    return numbers
+
+
+def _cast_column(series: pandas.Series, type_: str) -> typing.List:
+    """Cast a column to Python values of a YAML column type, nulls to None."""
+    if type_ in {'Integer', 'Float'}:
+        series = _to_numeric(series)
+        if type_ == 'Integer' and series.dtype.kind == 'f':
+            series = series.astype('Int64')
+
+    mask = series.isna().values
+    if type_ == 'Integer':
+        values = series.to_numpy(dtype=numpy.int64, na_value=0).tolist()
+    elif type_ == 'Float':
+        values = series.to_numpy(
+            dtype=numpy.float64,
+            na_value=numpy.nan
+        ).tolist()
+    elif type_ == 'Boolean' and series.dtype.kind == 'b':
+        values = series.to_numpy(dtype=bool, na_value=False).tolist()
+    else:
+        values = series.astype(object).values.tolist()
+
+    if mask.any():
+        for row in numpy.flatnonzero(mask).tolist():
+            values[row] = None
+    return values
+
+
+def df_to_columns(
+    data: pandas.DataFrame,
+    schema: typing.Optional[typing.Mapping[str, str]]=None
+) -> typing.Dict[str, typing.List]:
+    """
+    Convert a dataframe into lists of Python values, by column.
+
+    Each column is cast as a whole, to the type the schema gives it, or to
+    the type its dtype implies otherwise, and nulls become None.
+
+    Args:
+        data (pandas.DataFrame): The data, whose index becomes columns too.
+        schema (Optional[Mapping[str, str]]): The YAML column types, by
+            column name, see :py:func:`playlist.sql.lib.table_schema`.
+
+    Returns:
+        Dict[str, List]: The values of each column.
+    """
     data = data.reset_index(level=data.index.names)
-    ret_data = [
-        {
-            key: (
-                value
-                if not isinstance(value, str)
-                else (
-                    None
-                    if value == 'None'
-                    else int(value)
-                    if corelib.is_int(value)
-                    else float(value)
-                    if corelib.is_number(value)
-                    else bool(value)
-                    if value in {'True', 'False'}
-                    else value
+    schema = schema or {}
+    return {
+        col: _cast_column(
+            data[col],
+            schema.get(col) or _column_type(data[col])
+        )
+        for col in data.columns
+    }
+
+
+def df_to_dict(
+    data: pandas.DataFrame,
+    schema: typing.Optional[typing.Mapping[str, str]]=None
+) -> typing.List[dict]:
+    """
+    Convert a dataframe into a list of records.
+
+    See :py:func:`df_to_columns` for how the values are cast.
+    """
+    columns = df_to_columns(data, schema)
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def _wanted(want: typing.Optional[typing.Iterable[str]]) -> typing.Set[str]:
+    """Check the categories a diff is asked to keep, all of them by default."""
+    if want is None:
+        return set(CATEGORIES)
+    if isinstance(want, str):
+        want = (want,)
+    want = set(want)
+    unknown = want.difference(CATEGORIES)
+    if unknown:
+        raise ValueError(
+            f'Unknown categories {sorted(unknown)}, expected some of '
+            f'{CATEGORIES}.'
+        )
+    return want
+
+
+class DiffResult(collections.abc.Mapping):
+    """
+    The inserts/updates/deletes/skips of a diff.
+
+    The rows of each category are kept as a dataframe, and only converted to
+    records when they are asked for, either all at once by indexing the
+    result like a dict, or a batch at a time with :py:meth:`batches`. The
+    number of rows in every category is known up front, even for the
+    categories the diff was not asked to keep.
+
+    Example:
+        Applying the updates of a diff a batch at a time::
+
+            results = await get_ins_upd_del(
+                'Tracks', curr_coro, prev_coro, 'trackKey',
+                want=('inserts', 'updates')
+            )
+            print(results.counts['deletes'])
+            async for batch in results.batches('updates'):
+                apply_updates(batch)
+    """
+
+    def __init__(
+        self,
+        frames: typing.Mapping[str, pandas.DataFrame],
+        counts: typing.Mapping[str, int],
+        schema: typing.Optional[typing.Mapping[str, str]]=None,
+        batch_size: int=BATCH_SIZE,
+        timings: typing.Optional[typing.Mapping[str, float]]=None,
+    ) -> None:
+        """
+        Set up the result of a diff.
+
+        Args:
+            frames (Mapping[str, pandas.DataFrame]): The rows of each of the
+                categories kept, indexed by key.
+            counts (Mapping[str, int]): The number of rows in every
+                category.
+            schema (Optional[Mapping[str, str]]): The column types the
+                records are cast to, see :py:func:`df_to_columns`.
+            batch_size (int): The default number of records in a batch.
+            timings (Optional[Mapping[str, float]]): The seconds spent in
+                each step of the diff, where the engine measures them.
+        """
+        self._frames = dict(frames)
+        self._counts = dict.fromkeys(CATEGORIES, 0)
+        self._counts.update(counts)
+        self._records: typing.Dict[str, typing.List[dict]] = {}
+        self.schema = schema
+        self.batch_size = batch_size
+        self.timings = dict(timings or {})
+
+    @property
+    def counts(self) -> typing.Dict[str, int]:
+        """The number of rows in each category."""
+        return dict(self._counts)
+
+    def frame(self, category: str) -> pandas.DataFrame:
+        """Get the rows of a category as a dataframe, indexed by key."""
+        try:
+            return self._frames[category]
+        except KeyError:
+            raise KeyError(
+                f'{category!r} was not kept by the diff, only '
+                f'{tuple(self._frames)}.'
+            ) from None
+
+    def iter_batches(
+        self,
+        category: str,
+        batch_size: typing.Optional[int]=None
+    ) -> typing.Iterator[typing.List[dict]]:
+        """
+        Convert the rows of a category to records, a batch at a time.
+
+        Args:
+            category (str): The category.
+            batch_size (Optional[int]): The most records in each batch.
+                Defaults to :py:attr:`batch_size`.
+
+        Yields:
+            List[dict]: The next batch of records.
+        """
+        data = self.frame(category)
+        batch_size = batch_size or self.batch_size
+        for start in range(0, len(data), batch_size):
+            yield df_to_dict(data.iloc[start:start + batch_size], self.schema)
+
+    @corelib.inject_loop
+    async def batches(
+        self,
+        category: str,
+        batch_size: typing.Optional[int]=None,
+        *,
+        loop: asyncio.AbstractEventLoop,
+    ) -> typing.AsyncIterator[typing.List[dict]]:
+        """
+        Asynchronous form of :py:meth:`iter_batches`.
+
+        Each batch is converted in the loop's executor when it is asked for.
+        """
+        batches = self.iter_batches(category, batch_size)
+        done = object()
+        try:
+            while True:
+                batch = await loop.run_in_executor(  # type: ignore
+                    None,
+                    next,
+                    batches,
+                    done
                 )
+                if batch is done:
+                    break
+                yield batch
+        finally:
+            batches.close()
+
+    def __getitem__(self, category: str) -> typing.List[dict]:
+        """Get all the records of a category, converting them once."""
+        with contextlib.suppress(KeyError):
+            return self._records[category]
+
+        records = df_to_dict(self.frame(category), self.schema)
+        self._records[category] = records
+        return records
+
+    def __iter__(self) -> typing.Iterator[str]:
+        """Iterate over the categories kept."""
+        return iter(self._frames)
+
+    def __len__(self) -> int:
+        """Get the number of categories kept."""
+        return len(self._frames)
+
+    def __repr__(self) -> str:
+        """String representation of the DiffResult object."""
+        counts = ', '.join(
+            f'{category}={count}' for category, count in self._counts.items()
+        )
+        return f'<DiffResult({counts}), kept={tuple(self._frames)}>'
+
+
+def _timestamps(series: pandas.Series) -> pandas.Series:
+    """Convert a column of datetimes or Arrow objects to UTC timestamps."""
+    try:
+        return pandas.to_datetime(series, utc=True)
+    except TypeError:
+        return pandas.to_datetime(
+            series.map(
+                lambda value: (
+                    value.datetime
+                    if isinstance(value, arrow.Arrow)
+                    else value
+                ),
+                na_action='ignore'
+            ),
+            utc=True
+        )
+
+
+def compact_frame(
+    data: pandas.DataFrame,
+    schema: typing.Optional[typing.Mapping[str, str]]=None
+) -> pandas.DataFrame:
+    """
+    Give the columns of a dataframe compact dtypes, following a schema.
+
+    Integer and Boolean columns become nullable extension types rather than
+    floats or objects, DateTime columns become 64 bit UTC timestamps, and
+    String columns with few distinct values, such as ``kind``, become
+    categoricals. Columns the schema doesn't cover are left alone.
+
+    Args:
+        data (pandas.DataFrame): The data.
+        schema (Optional[Mapping[str, str]]): The YAML column types, by
+            column name, see :py:func:`playlist.sql.lib.table_schema`.
+
+    Returns:
+        pandas.DataFrame: The data, with compact columns.
+
+    Raises:
+        ValueError: If an Integer or Float column has values that are not
+            numbers.
+    """
+    if not schema:
+        return data
+
+    columns = {}
+    for col in data.columns:
+        series = data[col]
+        type_ = schema.get(col)
+        if type_ in {'Integer', 'Float'}:
+            series = _to_numeric(series).astype(
+                'Int64' if type_ == 'Integer' else numpy.float64
             )
-            for key, value in row.items()
-        }
-        for row in data.to_dict('records')
+        elif type_ == 'Boolean':
+            series = series.astype('boolean')
+        elif type_ == 'DateTime':
+            series = _timestamps(series)
+        elif (
+            type_ == 'String' and
+            not isinstance(series.dtype, pandas.CategoricalDtype) and
+            series.nunique() <= len(series) * CATEGORY_RATIO
+        ):
+            series = series.astype('category')
+        columns[col] = series
+    return pandas.DataFrame(columns, index=data.index)
+
+
+def compare_policies(
+    compare: typing.Optional[typing.Mapping[str, Policy]]
+) -> typing.Dict[str, Policy]:
+    """
+    Check the compare policies of the columns of a diff.
+
+    A policy relaxes what counts as a change of a column:
+
+    * **abs_tol** and **rel_tol**: floats within these absolute and
+      relative tolerances of each other are equal, as with
+      :py:func:`numpy.isclose` (relative to the previous value). Integer
+      columns have no noise to absorb, so they are always compared exactly.
+    * **granularity**: timestamps less than this period apart are equal,
+      such as ``'s'`` or ``'min'``, or a number of seconds.
+    * **null_values**: values, such as ``''``, that are equal to a null.
+
+    Args:
+        compare (Optional[Mapping[str, Policy]]): The policies, by column.
+
+    Returns:
+        Dict[str, Policy]: The policies.
+
+    Raises:
+        ValueError: If a policy has settings other than
+            :py:data:`POLICY_KEYS`, or a granularity that isn't a fixed
+            period.
+    """
+    policies = {}
+    for col, policy in (compare or {}).items():
+        unknown = set(policy).difference(POLICY_KEYS)
+        if unknown:
+            raise ValueError(
+                f'Unknown compare settings {sorted(unknown)} for {col}, '
+                f'expected some of {POLICY_KEYS}.'
+            )
+        policy = dict(policy)
+        granularity = policy.get('granularity')
+        if isinstance(granularity, (int, float)):
+            granularity = f'{granularity}s'
+        if granularity and not isinstance(granularity, pandas.Timedelta):
+            policy['granularity'] = pandas.Timedelta(
+                pandas.tseries.frequencies.to_offset(granularity)
+            )
+        if policy.get('null_values') is not None:
+            policy['null_values'] = list(policy['null_values'])
+        policies[col] = policy
+    return policies
+
+
+def _tolerant(policy: typing.Optional[Policy]) -> bool:
+    """Whether a policy compares values with a tolerance."""
+    return bool(policy and (
+        policy.get('abs_tol') or
+        policy.get('rel_tol') or
+        policy.get('granularity')
+    ))
+
+
+def _normalize(
+    series: pandas.Series,
+    policy: typing.Optional[Policy]
+) -> pandas.Series:
+    """Make the values a policy deems null nulls."""
+    if policy and policy.get('null_values'):
+        series = series.mask(series.isin(policy['null_values']))
+    return series
+
+
+def _column_changes(
+    current: pandas.Series,
+    previous: pandas.Series,
+    policy: typing.Optional[Policy]=None
+) -> numpy.ndarray:
+    """
+    Get the rows where a column differs; nulls only equal nulls.
+
+    The column's compare policy, if it has one, relaxes what differs.
+    """
+    current = _normalize(current, policy)
+    previous = _normalize(previous, policy)
+    if (
+        isinstance(current.dtype, pandas.CategoricalDtype) and
+        isinstance(previous.dtype, pandas.CategoricalDtype) and
+        current.dtype != previous.dtype
+    ):
+        # Empty categories of different dtypes are equal as indexes, but
+        # still can't be compared, so the whole dtypes are checked.
+        categories = current.cat.categories.union(previous.cat.categories)
+        current = current.cat.set_categories(categories)
+        previous = previous.cat.set_categories(categories)
+
+    curr_null = current.isna().values
+    prev_null = previous.isna().values
+    if (
+        policy and
+        (policy.get('abs_tol') or policy.get('rel_tol')) and
+        'f' in {current.dtype.kind, previous.dtype.kind} and
+        pandas.api.types.is_numeric_dtype(current.dtype) and
+        pandas.api.types.is_numeric_dtype(previous.dtype)
+    ):
+        differs = ~numpy.isclose(
+            current.to_numpy(dtype=numpy.float64, na_value=numpy.nan),
+            previous.to_numpy(dtype=numpy.float64, na_value=numpy.nan),
+            rtol=policy.get('rel_tol') or 0,
+            atol=policy.get('abs_tol') or 0,
+        )
+    elif (
+        policy and
+        policy.get('granularity') and
+        current.dtype.kind == 'M' and
+        previous.dtype.kind == 'M'
+    ):
+        # Flooring both sides would still tell apart timestamps either side
+        # of a period boundary, so their distance is compared instead.
+        differs = ~(
+            numpy.abs(current.values - previous.values) <
+            policy['granularity'].to_timedelta64()
+        )
+    else:
+        differs = (current.values != previous.values)
+        if not isinstance(differs, numpy.ndarray):
+            differs = differs.to_numpy(dtype=bool, na_value=True)
+    return (curr_null != prev_null) | (differs & ~curr_null & ~prev_null)
+
+
+def _change_matrix(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None
+) -> numpy.ndarray:
+    """Get which columns differ in each row of two aligned frames."""
+    compare = compare or {}
+    matrix = numpy.zeros((len(current), len(current.columns)), dtype=bool)
+    for position, col in enumerate(current.columns):
+        matrix[:, position] = _column_changes(
+            current[col],
+            previous[col],
+            compare.get(col)
+        )
+    return matrix
+
+
+def _row_changes(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None
+) -> pandas.Series:
+    """Get the rows where any column differs between two aligned frames."""
+    return pandas.Series(
+        _change_matrix(current, previous, compare).any(axis=1),
+        index=current.index
+    )
+
+
+def changed_columns(
+    matrix: numpy.ndarray,
+    columns: typing.Sequence[str]
+) -> typing.List[typing.Tuple[str, ...]]:
+    """
+    Get the names of the changed columns in each row of a change matrix.
+
+    Rows are grouped by their pattern of changes first, so the names are
+    only worked out once for each distinct pattern.
+
+    Args:
+        matrix (numpy.ndarray): A boolean array with a row per record and a
+            column per field, set where the field changed.
+        columns (Sequence[str]): The field of each column of the matrix.
+
+    Returns:
+        List[Tuple[str, ...]]: The changed fields of each record.
+    """
+    if not len(matrix):
+        return []
+    if matrix.shape[1] < 64:
+        # Packing each row's flags into the bits of one integer makes the
+        # patterns far cheaper to tell apart than comparing rows.
+        bits = numpy.left_shift(1, numpy.arange(matrix.shape[1]))
+        keys, inverse = numpy.unique(
+            matrix.astype(numpy.int64) @ bits,
+            return_inverse=True
+        )
+        patterns = (keys[:, None] & bits).astype(bool)
+    else:
+        patterns, inverse = numpy.unique(
+            matrix,
+            axis=0,
+            return_inverse=True
+        )
+    names = [
+        tuple(col for col, flag in zip(columns, pattern) if flag)
+        for pattern in patterns.tolist()
+    ]
+    return [names[row] for row in inverse.ravel().tolist()]
+
+
+def previous_values(
+    previous: pandas.DataFrame,
+    changes: typing.Sequence[typing.Tuple[str, ...]]
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Get the previous values of the changed fields of each update.
+
+    Args:
+        previous (pandas.DataFrame): The previous rows of the updates.
+        changes (Sequence[Tuple[str, ...]]): The changed fields of each
+            update, see :py:func:`changed_columns`.
+
+    Returns:
+        List[Dict[str, Any]]: The previous values of each update, by field.
+    """
+    fields = set().union(*changes)
+    columns = df_to_columns(
+        previous[[col for col in previous.columns if col in fields]]
+    )
+    return [
+        {col: columns[col][row] for col in changed}
+        for row, changed in enumerate(changes)
     ]
-    return ret_data
 
 
 def get_inserts(
     merged: pandas.DataFrame,
     curr_cols: numpy.ndarray,
     prev_cols: numpy.ndarray,
-) -> typing.Tuple[str, typing.List[dict]]:
+) -> typing.Tuple[str, pandas.DataFrame]:
     """Get the inserts (rows with current but no previous data)."""
     inserts = merged[~merged[prev_cols].notnull().T.any()]
     inserts = inserts[curr_cols]
     print(f'Found {inserts.size} rows to insert.')
-    if not inserts.empty:
-        inserts = inserts.rename(
-            columns=dict(zip(
-                inserts.columns,
-                inserts.columns.str.rstrip('x').str.rstrip('_').values
-            ))
-        )
-        return 'inserts', df_to_dict(inserts)
-    else:
-        return 'inserts', []
+    inserts = inserts.rename(
+        columns=dict(zip(
+            inserts.columns,
+            inserts.columns.str.rstrip('x').str.rstrip('_').values
+        ))
+    )
+    return 'inserts', inserts
 
 
 def get_deletes(
     merged: pandas.DataFrame,
     curr_cols: numpy.ndarray,
     prev_cols: numpy.ndarray,
-) -> typing.Tuple[str, typing.List[dict]]:
+) -> typing.Tuple[str, pandas.DataFrame]:
     """Get the deletes (rows with previous but no current data)."""
     deletes = merged[~merged[curr_cols].notnull().T.any()]
     deletes = deletes[prev_cols]
     print(f'Found {deletes.size} rows to delete.')
-    if not deletes.empty:
-        deletes = deletes.rename(
-            columns=dict(zip(
-                deletes.columns,
-                deletes.columns.str.rstrip('x').str.rstrip('_').values
-            ))
-        )
-        return 'deletes', df_to_dict(deletes)
-    else:
-        return 'deletes', []
+    deletes = deletes.rename(
+        columns=dict(zip(
+            deletes.columns,
+            deletes.columns.str.rstrip('y').str.rstrip('_').values
+        ))
+    )
+    return 'deletes', deletes
+
+
+def count_sides(
+    merged: pandas.DataFrame,
+    curr_cols: numpy.ndarray,
+    prev_cols: numpy.ndarray,
+) -> typing.Dict[str, int]:
+    """Count the inserts and deletes of a merge without collecting them."""
+    return {
+        'inserts': int((~merged[prev_cols].notnull().T.any()).sum()),
+        'deletes': int((~merged[curr_cols].notnull().T.any()).sum()),
+    }
 
 
 def get_checks(
@@ -177,10 +809,17 @@ def split_checks(
 def get_updates(
     splits: typing.Dict[str, pandas.DataFrame],
     ignored: typing.Optional[typing.List[str]]=None,
-) -> typing.Tuple[str, typing.List[dict]]:
-    """Get the updates (rows where data changed between current/previous)."""
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> typing.Tuple[str, pandas.DataFrame]:
+    """
+    Get the updates (rows where data changed between current/previous).
+
+    Each update lists the fields that changed under :py:data:`CHANGED`, as
+    told by the ``compare`` policies of the fields, and their previous values
+    under :py:data:`PREVIOUS`.
+    """
     if splits['current'].empty:
-        return 'updates', []
+        return 'updates', splits['current']
     if ignored:
         cols = [
             col
@@ -188,21 +827,18 @@ def get_updates(
             if col not in ignored
         ]
         if not cols:
-            return 'updates', []
+            return 'updates', splits['current'].iloc[0:0]
         current_checks = splits['current'][cols]
         previous_checks = splits['previous'][cols]
     else:
         current_checks = splits['current']
         previous_checks = splits['previous']
 
-    current_checks = current_checks.fillna('')
-    previous_checks = previous_checks.fillna('')
-
-    updates = current_checks != previous_checks
-    updates = updates.T.any()
+    matrix = _change_matrix(current_checks, previous_checks, compare)
+    changed = matrix.any(axis=1)
 
     if ignored:
-        updates = current_checks[updates]
+        updates = current_checks[changed]
         updates = updates.merge(
             splits['previous'][ignored],
             how='inner',
@@ -210,18 +846,32 @@ def get_updates(
             right_index=True
         )
     else:
-        updates = splits['current'][updates]
+        updates = splits['current'][changed]
+    changes = changed_columns(matrix[changed], current_checks.columns)
+    updates = updates.assign(**{
+        CHANGED: pandas.Series(
+            changes,
+            index=current_checks.index[changed],
+            dtype=object
+        ),
+        PREVIOUS: pandas.Series(
+            previous_values(previous_checks[changed], changes),
+            index=current_checks.index[changed],
+            dtype=object
+        ),
+    })
     print(f'Found {updates.size} rows to update.')
-    return 'updates', df_to_dict(updates)
+    return 'updates', updates
 
 
 def get_skips(
     splits: typing.Dict[str, pandas.DataFrame],
     ignored: typing.Optional[typing.List[str]]=None,
-) -> typing.Tuple[str, typing.List[dict]]:
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> typing.Tuple[str, pandas.DataFrame]:
     """Get the skips (rows where data did not change."""
     if splits['current'].empty:
-        return 'skips', []
+        return 'skips', splits['previous']
     if ignored:
         cols = [
             col
@@ -229,21 +879,848 @@ def get_skips(
             if col not in ignored
         ]
         if not cols:
-            return 'skips', df_to_dict(splits['previous'])
+            return 'skips', splits['previous']
         current_checks = splits['current'][cols]
         previous_checks = splits['previous'][cols]
     else:
         current_checks = splits['current']
         previous_checks = splits['previous']
 
-    current_checks = current_checks.fillna('')
-    previous_checks = previous_checks.fillna('')
-
-    skips = current_checks == previous_checks
-    skips = skips.T.all()
+    skips = ~_row_changes(current_checks, previous_checks, compare)
     skips = splits['previous'][skips]
     print(f'Found {skips.size} rows to skip.')
-    return 'skips', df_to_dict(skips)
+    return 'skips', skips
+
+
+def _suffixed(
+    data: pandas.DataFrame,
+    columns: typing.Sequence[str],
+    suffix: str
+) -> pandas.DataFrame:
+    """Take one side's columns out of a merged frame, unsuffixed."""
+    return data[[col + suffix for col in columns]].set_axis(
+        list(columns),
+        axis=1
+    )
+
+
+def fused_diff(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame,
+    ignored: typing.Optional[typing.List[str]]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> DiffResult:
+    """
+    Get the inserts/updates/deletes/skips in a single pass.
+
+    The current and previous data are merged once, with an indicator of the
+    side(s) each key came from: keys only in ``current`` are inserts, keys
+    only in ``previous`` are deletes, and the shared keys are compared
+    column by column once, which tells the updates from the skips and which
+    fields changed at the same time. The merge engine gets the same results
+    by filtering and copying the merged frame once per category, in
+    separate executor jobs.
+
+    The seconds spent merging, comparing and collecting the rows are
+    printed, and kept under :py:attr:`DiffResult.timings`.
+
+    Args:
+        current (pandas.DataFrame): The current data, indexed by key.
+        previous (pandas.DataFrame): The previous data, indexed by key.
+        ignored (Optional[List[str]]): Columns left out of the comparison;
+            updates take their values from ``previous``.
+        schema (Optional[Mapping[str, str]]): The column types the results
+            are cast to, see :py:func:`df_to_columns`.
+        want (Optional[Iterable[str]]): The categories to keep the rows of.
+            Defaults to all of them; the others are only counted.
+        compare (Optional[Mapping[str, Policy]]): The compare policies of
+            the columns, see :py:func:`compare_policies`.
+
+    Returns:
+        DiffResult: The ``inserts``, ``updates``, ``deletes`` and ``skips``.
+    """
+    want = _wanted(want)
+    timings = {}
+    started = time.perf_counter()
+
+    current, previous = _fill_columns(current, previous)
+
+    cols = [
+        col
+        for col in current.columns
+        if not ignored or col not in ignored
+    ]
+    curr_suffix, prev_suffix = SUFFIXES
+    merged = current.add_suffix(curr_suffix).merge(
+        previous.add_suffix(prev_suffix),
+        how='outer',
+        left_index=True,
+        right_index=True,
+        indicator=True
+    )
+    timings['merge'] = time.perf_counter() - started
+
+    side = merged['_merge'].values
+    inserted = side == 'left_only'
+    deleted = side == 'right_only'
+    shared = merged[side == 'both']
+    matrix = _change_matrix(
+        _suffixed(shared, cols, curr_suffix),
+        _suffixed(shared, cols, prev_suffix),
+        compare_policies(compare)
+    )
+    changed = matrix.any(axis=1)
+    timings['compare'] = time.perf_counter() - started - timings['merge']
+
+    counts = {
+        'inserts': int(inserted.sum()),
+        'updates': int(changed.sum()),
+        'deletes': int(deleted.sum()),
+        'skips': int(len(changed) - changed.sum()),
+    }
+    frames = {}
+    if 'inserts' in want:
+        frames['inserts'] = _suffixed(
+            merged[inserted],
+            current.columns,
+            curr_suffix
+        )
+    if 'deletes' in want:
+        frames['deletes'] = _suffixed(
+            merged[deleted],
+            previous.columns,
+            prev_suffix
+        )
+    if 'skips' in want:
+        frames['skips'] = _suffixed(
+            shared[~changed],
+            previous.columns,
+            prev_suffix
+        )
+    if 'updates' in want:
+        updates = _suffixed(shared[changed], cols, curr_suffix)
+        if ignored:
+            updates = updates.join(
+                _suffixed(shared[changed], ignored, prev_suffix)
+            )
+        changes = changed_columns(matrix[changed], cols)
+        frames['updates'] = updates.assign(**{
+            CHANGED: pandas.Series(changes, index=updates.index, dtype=object),
+            PREVIOUS: pandas.Series(
+                previous_values(
+                    _suffixed(shared[changed], cols, prev_suffix),
+                    changes
+                ),
+                index=updates.index,
+                dtype=object
+            ),
+        })
+    timings['collect'] = (
+        time.perf_counter() - started - timings['merge'] - timings['compare']
+    )
+
+    print(
+        ' '.join((
+            f'Diffed {len(merged)} rows in',
+            f'{sum(timings.values()):.3f}s',
+            f'(merge {timings["merge"]:.3f}s,',
+            f'compare {timings["compare"]:.3f}s,',
+            f'collect {timings["collect"]:.3f}s):',
+            f'found {counts["inserts"]} rows to insert,',
+            f'{counts["updates"]} to update,',
+            f'{counts["deletes"]} to delete',
+            f'and {counts["skips"]} to skip.',
+        ))
+    )
+    return DiffResult(frames, counts, schema, timings=timings)
+
+
+def _encode_column(
+    current: pandas.Series,
+    previous: pandas.Series
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Encode a compared column as numbers, the same way on both sides."""
+    if (
+        current.dtype == previous.dtype and
+        isinstance(current.values, numpy.ndarray) and
+        current.dtype.kind in 'iufbmM'
+    ):
+        return current.values, previous.values
+    if (
+        isinstance(current.dtype, pandas.CategoricalDtype) and
+        isinstance(previous.dtype, pandas.CategoricalDtype)
+    ):
+        categories = current.cat.categories.union(previous.cat.categories)
+        return (
+            current.cat.set_categories(categories).cat.codes.values,
+            previous.cat.set_categories(categories).cat.codes.values,
+        )
+    if (
+        pandas.api.types.is_numeric_dtype(current.dtype) and
+        pandas.api.types.is_numeric_dtype(previous.dtype) and
+        current.dtype != previous.dtype
+    ):
+        current = current.astype(numpy.float64)
+        previous = previous.astype(numpy.float64)
+    # Factorizing both sides together gives equal values equal codes, and
+    # every null the code -1, which is far cheaper to hash than the values.
+    codes, _ = pandas.factorize(
+        pandas.concat([current, previous], ignore_index=True)
+    )
+    return codes[:len(current)], codes[len(current):]
+
+
+def hash_rows(columns: typing.Iterable[numpy.ndarray]) -> numpy.ndarray:
+    """
+    Hash rows, given as column arrays, into a single 64 bit value each.
+
+    Nulls hash the same whichever null they are.
+    """
+    hashed = None
+    for values in columns:
+        column_hash = pandas.util.hash_array(values, categorize=False)
+        if hashed is None:
+            hashed = column_hash
+        else:
+            # Combining by multiplying first keeps the column order
+            # significant; the arithmetic wraps around.
+            hashed = hashed * HASH_MULTIPLIER ^ column_hash
+    return hashed
+
+
+def _fill_columns(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame
+) -> typing.Tuple[pandas.DataFrame, pandas.DataFrame]:
+    """Give a side without columns the columns of the other side."""
+    if current.columns.empty:
+        current = pandas.DataFrame(
+            index=current.index,
+            columns=previous.columns
+        )
+    elif previous.columns.empty:
+        previous = pandas.DataFrame(
+            index=previous.index,
+            columns=current.columns
+        )
+    return current, previous
+
+
+def _aligned_frames(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame,
+    shared: numpy.ndarray,
+    prev_rows: numpy.ndarray,
+    changed: numpy.ndarray,
+    cols: typing.List[str],
+    ignored: typing.Optional[typing.List[str]],
+    want: typing.Set[str],
+    matrix: typing.Optional[numpy.ndarray]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> typing.Tuple[typing.Dict[str, pandas.DataFrame], typing.Dict[str, int]]:
+    """
+    Collect the rows of each category, once the keys are lined up.
+
+    ``shared`` flags the current rows whose key is in ``previous``, at the
+    previous rows ``prev_rows``, and ``changed`` flags the shared rows that
+    differ. The change ``matrix`` of the shared rows is worked out for the
+    changed rows only when it isn't given.
+    """
+    curr_rows = numpy.flatnonzero(shared)
+    deleted = numpy.ones(len(previous), dtype=bool)
+    deleted[prev_rows] = False
+
+    counts = {
+        'inserts': int(len(shared) - len(curr_rows)),
+        'updates': int(changed.sum()),
+        'deletes': int(deleted.sum()),
+        'skips': int(len(changed) - changed.sum()),
+    }
+    frames = {}
+    if 'inserts' in want:
+        frames['inserts'] = current[~shared]
+    if 'deletes' in want:
+        frames['deletes'] = previous[deleted]
+    if 'skips' in want:
+        frames['skips'] = previous.iloc[prev_rows[~changed]]
+    if 'updates' in want:
+        if ignored:
+            updates = current.iloc[curr_rows[changed]][cols].join(
+                previous.iloc[prev_rows[changed]][ignored]
+            )
+        else:
+            updates = current.iloc[curr_rows[changed]]
+        if matrix is None:
+            # Only the changed rows are compared column by column.
+            matrix = _change_matrix(
+                current.iloc[curr_rows[changed]][cols],
+                previous.iloc[prev_rows[changed]][cols],
+                compare
+            )
+        else:
+            matrix = matrix[changed]
+        changes = changed_columns(matrix, cols)
+        frames['updates'] = updates.assign(**{
+            CHANGED: pandas.Series(changes, index=updates.index, dtype=object),
+            PREVIOUS: pandas.Series(
+                previous_values(
+                    previous.iloc[prev_rows[changed]][cols],
+                    changes
+                ),
+                index=updates.index,
+                dtype=object
+            ),
+        })
+    return frames, counts
+
+
+def hash_diff(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame,
+    ignored: typing.Optional[typing.List[str]]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> 'DiffResult':
+    """
+    Get the inserts/updates/deletes/skips by comparing row hashes.
+
+    Rather than merging the two dataframes, the compared columns of each row
+    are hashed once, and every key is classified in one pass over the key
+    and hash arrays: keys only in ``current`` are inserts, keys only in
+    ``previous`` are deletes, and shared keys are updates when their hashes
+    differ and skips when they match. The results are the same as those of
+    the merge engine, short of a 64 bit hash collision.
+
+    Args:
+        current (pandas.DataFrame): The current data, indexed by key.
+        previous (pandas.DataFrame): The previous data, indexed by key.
+        ignored (Optional[List[str]]): Columns left out of the comparison;
+            updates take their values from ``previous``.
+        schema (Optional[Mapping[str, str]]): The column types the results
+            are cast to, see :py:func:`df_to_columns`.
+        want (Optional[Iterable[str]]): The categories to keep the rows of.
+            Defaults to all of them; the others are only counted.
+        compare (Optional[Mapping[str, Policy]]): The compare policies of
+            the columns, see :py:func:`compare_policies`.
+
+    Returns:
+        DiffResult: The ``inserts``, ``updates``, ``deletes`` and ``skips``.
+    """
+    want = _wanted(want)
+    current, previous = _fill_columns(current, previous)
+    cols = [
+        col
+        for col in current.columns
+        if not ignored or col not in ignored
+    ]
+
+    positions = previous.index.get_indexer(current.index)
+    shared = positions >= 0
+
+    curr_rows = numpy.flatnonzero(shared)
+    prev_rows = positions[shared]
+    compare = compare_policies(compare)
+    # Values within a tolerance can hash apart, so those columns are
+    # compared directly instead.
+    hashed = [col for col in cols if not _tolerant(compare.get(col))]
+    if hashed:
+        encoded = [
+            _encode_column(
+                _normalize(current[col].iloc[curr_rows], compare.get(col)),
+                _normalize(previous[col].iloc[prev_rows], compare.get(col))
+            )
+            for col in hashed
+        ]
+        changed = (
+            hash_rows(curr for curr, _ in encoded) !=
+            hash_rows(prev for _, prev in encoded)
+        )
+    else:
+        changed = numpy.zeros(len(curr_rows), dtype=bool)
+    for col in cols:
+        if col not in hashed:
+            changed |= _column_changes(
+                current[col].iloc[curr_rows],
+                previous[col].iloc[prev_rows],
+                compare[col]
+            )
+
+    frames, counts = _aligned_frames(
+        current,
+        previous,
+        shared,
+        prev_rows,
+        changed,
+        cols,
+        ignored,
+        want,
+        compare=compare
+    )
+
+    print(
+        ' '.join((
+            f'Hashed {len(curr_rows)} rows to check:',
+            f'found {counts["inserts"]} rows to insert,',
+            f'{counts["updates"]} to update,',
+            f'{counts["deletes"]} to delete',
+            f'and {counts["skips"]} to skip.',
+        ))
+    )
+    return DiffResult(frames, counts, schema)
+
+
+def sorted_keys(
+    current: pandas.Index,
+    previous: pandas.Index
+) -> typing.Optional[typing.Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Encode the keys of both sides as integers that sort like the keys.
+
+    Only integer keys without nulls can be walked: single keys are used as
+    they are, and the levels of a composite key are offset by their minimum
+    and combined into one integer per key as the digits of a mixed-radix
+    number. Other keys would need a hash table (``factorize``) to encode,
+    which is the very cost the sorted walk is meant to avoid.
+
+    Args:
+        current (pandas.Index): The current keys.
+        previous (pandas.Index): The previous keys.
+
+    Returns:
+        Optional[Tuple[numpy.ndarray, numpy.ndarray]]: The encoded keys of
+        each side, or None if the key isn't made of integers or spans too
+        many values to fit a 64 bit integer.
+    """
+    levels = []
+    for level in range(current.nlevels):
+        curr_values = current.get_level_values(level)
+        prev_values = previous.get_level_values(level)
+        if (
+            curr_values.dtype.kind not in 'iu' or
+            prev_values.dtype.kind not in 'iu' or
+            curr_values.hasnans or
+            prev_values.hasnans
+        ):
+            return None
+        levels.append((
+            curr_values.to_numpy(dtype=numpy.int64),
+            prev_values.to_numpy(dtype=numpy.int64),
+        ))
+    if len(levels) == 1:
+        return levels[0]
+
+    curr_keys = numpy.zeros(len(current), dtype=numpy.int64)
+    prev_keys = numpy.zeros(len(previous), dtype=numpy.int64)
+    span = 1
+    for curr_values, prev_values in levels:
+        both = numpy.concatenate([curr_values, prev_values])
+        if not len(both):
+            break
+        low = int(both.min())
+        radix = int(both.max()) - low + 1
+        span *= radix
+        if span >= 2 ** 63:
+            return None
+        curr_keys = curr_keys * radix + (curr_values - low)
+        prev_keys = prev_keys * radix + (prev_values - low)
+    return curr_keys, prev_keys
+
+
+def walk_keys(
+    curr_keys: numpy.ndarray,
+    prev_keys: numpy.ndarray
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Pair up the shared keys of two strictly increasing key arrays.
+
+    Both sides are merged in one pass: a stable sort of the two runs laid
+    end to end is a timsort merge, which walks them with two pointers in
+    linear time. A shared key then shows up twice in a row, the current one
+    first.
+
+    Args:
+        curr_keys (numpy.ndarray): The increasing current keys.
+        prev_keys (numpy.ndarray): The increasing previous keys.
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: Whether each current key is
+        shared, and the previous position of each shared key, in order.
+    """
+    keys = numpy.concatenate([curr_keys, prev_keys])
+    order = numpy.argsort(keys, kind='stable')
+    pairs = numpy.flatnonzero(keys[order][1:] == keys[order][:-1])
+    shared = numpy.zeros(len(curr_keys), dtype=bool)
+    shared[order[pairs]] = True
+    return shared, order[pairs + 1] - len(curr_keys)
+
+
+def _ordered(
+    data: pandas.DataFrame,
+    keys: numpy.ndarray,
+    type_: str
+) -> typing.Tuple[pandas.DataFrame, numpy.ndarray]:
+    """Check the keys are strictly increasing, sorting them if needed."""
+    steps = numpy.diff(keys)
+    if (steps > 0).all():
+        return data, keys
+    if (steps < 0).any():
+        print(f'The {type_} keys are not sorted, sorting them first.')
+        order = numpy.argsort(keys, kind='stable')
+        data, keys = data.iloc[order], keys[order]
+    if not (numpy.diff(keys) > 0).all():
+        raise ValueError(f'The {type_} data has duplicate keys.')
+    return data, keys
+
+
+def sorted_diff(
+    current: pandas.DataFrame,
+    previous: pandas.DataFrame,
+    ignored: typing.Optional[typing.List[str]]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> DiffResult:
+    """
+    Get the inserts/updates/deletes/skips of data sorted by key.
+
+    The integer keys of both sides, see :py:func:`sorted_keys`, are checked
+    to be increasing and walked together in one linear merge pass, see
+    :py:func:`walk_keys`, rather than building the hash table of a merge;
+    the shared rows are compared column by column once. Data read in
+    primary key order, as the track readers of :py:mod:`playlist.sql.lib`
+    return it, needs no sorting at all. Unsorted data is sorted first, and
+    keys that aren't integers fall back to :py:func:`fused_diff`.
+
+    Args:
+        current (pandas.DataFrame): The current data, indexed by key.
+        previous (pandas.DataFrame): The previous data, indexed by key.
+        ignored (Optional[List[str]]): Columns left out of the comparison;
+            updates take their values from ``previous``.
+        schema (Optional[Mapping[str, str]]): The column types the results
+            are cast to, see :py:func:`df_to_columns`.
+        want (Optional[Iterable[str]]): The categories to keep the rows of.
+            Defaults to all of them; the others are only counted.
+        compare (Optional[Mapping[str, Policy]]): The compare policies of
+            the columns, see :py:func:`compare_policies`.
+
+    Returns:
+        DiffResult: The ``inserts``, ``updates``, ``deletes`` and ``skips``.
+
+    Raises:
+        ValueError: If either side has duplicate keys.
+    """
+    want = _wanted(want)
+    keys = sorted_keys(current.index, previous.index)
+    if keys is None:
+        print('The keys cannot be walked in order, merging them instead.')
+        return fused_diff(current, previous, ignored, schema, want, compare)
+
+    current, previous = _fill_columns(current, previous)
+    current, curr_keys = _ordered(current, keys[0], 'current')
+    previous, prev_keys = _ordered(previous, keys[1], 'previous')
+    cols = [
+        col
+        for col in current.columns
+        if not ignored or col not in ignored
+    ]
+
+    shared, prev_rows = walk_keys(curr_keys, prev_keys)
+    curr_rows = numpy.flatnonzero(shared)
+    matrix = _change_matrix(
+        current.iloc[curr_rows][cols],
+        previous.iloc[prev_rows][cols],
+        compare_policies(compare)
+    )
+    changed = matrix.any(axis=1)
+
+    frames, counts = _aligned_frames(
+        current,
+        previous,
+        shared,
+        prev_rows,
+        changed,
+        cols,
+        ignored,
+        want,
+        matrix
+    )
+
+    print(
+        ' '.join((
+            f'Walked {len(curr_keys)} + {len(prev_keys)} sorted keys:',
+            f'found {counts["inserts"]} rows to insert,',
+            f'{counts["updates"]} to update,',
+            f'{counts["deletes"]} to delete',
+            f'and {counts["skips"]} to skip.',
+        ))
+    )
+    return DiffResult(frames, counts, schema)
+
+
+def _partition_keys(
+    data: pandas.DataFrame,
+    index: typing.Union[str, typing.List[str]],
+    partitions: int
+) -> numpy.ndarray:
+    """Get the partition of each row, from a hash of its key."""
+    keys = data[index] if isinstance(index, str) else data[list(index)]
+    hashed = pandas.util.hash_pandas_object(keys, index=False).values
+    return hashed % numpy.uint64(partitions)
+
+
+def spill_partitions(
+    batches: typing.Iterable[DiffData],
+    index: typing.Union[str, typing.List[str]],
+    partitions: int,
+    path: pathlib.Path
+) -> typing.List[pathlib.Path]:
+    """
+    Hash-partition batches of records by key into spill files.
+
+    Each batch is split by a hash of its keys, and every part is appended to
+    the spill file of its partition, so only one batch is in memory at a
+    time. Rows with the same key always land in the same partition.
+
+    Args:
+        batches (Iterable[DiffData]): The data, in batches of any of the
+            forms :py:func:`to_frame` accepts.
+        index (Union[str, List[str]]): The key field(s).
+        partitions (int): The number of partitions.
+        path (pathlib.Path): The directory to write the spill files in.
+
+    Returns:
+        List[pathlib.Path]: The spill file of each partition.
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    paths = [path / f'part-{part:05d}.pkl' for part in range(partitions)]
+    rows = 0
+    with contextlib.ExitStack() as stack:
+        spills = [stack.enter_context(spill.open('wb')) for spill in paths]
+        for batch in batches:
+            batch = to_frame(batch)
+            if batch.empty:
+                continue
+            rows += len(batch)
+            parts = _partition_keys(batch, index, partitions)
+            for part, data in batch.groupby(parts, sort=False):
+                pickle.dump(
+                    data,
+                    spills[int(part)],
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+    print(f'Spilled {rows} rows into {partitions} partitions in {path}')
+    return paths
+
+
+def _read_partition(
+    path: pathlib.Path,
+    index: typing.Union[str, typing.List[str]],
+    schema: typing.Optional[typing.Mapping[str, str]]=None
+) -> pandas.DataFrame:
+    """Read a spill file back into one compact dataframe, indexed by key."""
+    frames = []
+    with path.open('rb') as inp:
+        with contextlib.suppress(EOFError):
+            while True:
+                frames.append(pickle.load(inp))
+    if not frames:
+        if isinstance(index, str):
+            return pandas.DataFrame(index=pandas.Index([], name=index))
+        return pandas.DataFrame(
+            index=pandas.MultiIndex.from_tuples([], names=index)
+        )
+    return compact_frame(
+        pandas.concat(frames, ignore_index=True).set_index(index),
+        schema
+    )
+
+
+def diff_partition(
+    current: pathlib.Path,
+    previous: pathlib.Path,
+    index: typing.Union[str, typing.List[str]],
+    ignored: typing.Optional[typing.List[str]]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> DiffResult:
+    """
+    Diff one partition of the current and previous data.
+
+    Args:
+        current (pathlib.Path): The spill file of the current data.
+        previous (pathlib.Path): The spill file of the previous data.
+        index (Union[str, List[str]]): The key field(s).
+        ignored (Optional[List[str]]): Fields left out of the comparison.
+        schema (Optional[Mapping[str, str]]): The types of the fields.
+        want (Optional[Iterable[str]]): The categories to keep the rows of.
+        compare (Optional[Mapping[str, Policy]]): The compare policies of
+            the fields.
+
+    Returns:
+        DiffResult: The ``inserts``, ``updates``, ``deletes`` and ``skips``
+        of the partition, see :py:func:`hash_diff`.
+    """
+    return hash_diff(
+        _read_partition(current, index, schema),
+        _read_partition(previous, index, schema),
+        ignored=ignored,
+        schema=schema,
+        want=want,
+        compare=compare,
+    )
+
+
+def iter_partitioned_diff(
+    current: typing.Iterable[DiffData],
+    previous: typing.Iterable[DiffData],
+    index: typing.Union[str, typing.List[str]],
+    partitions: int=PARTITIONS,
+    ignored: typing.Optional[typing.List[str]]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    workers: typing.Optional[int]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+) -> typing.Iterator[DiffResult]:
+    """
+    Diff data larger than memory, one partition at a time.
+
+    Both inputs are streamed into spill files, hash-partitioned by key, under
+    ``BasePath.CACHE / 'diff'``. Each pair of partitions is then diffed on
+    its own, in ``workers`` worker processes when given, and the spill files
+    are removed once done. Peak memory is bounded by the size of a batch
+    and of a partition, rather than of the data.
+
+    Args:
+        current (Iterable[DiffData]): The current data, in batches of any
+            of the forms :py:func:`to_frame` accepts, such as an Arrow
+            record batch reader.
+        previous (Iterable[DiffData]): The previous data, in batches.
+        index (Union[str, List[str]]): The key field(s).
+        partitions (int): The number of partitions.
+        ignored (Optional[List[str]]): Fields left out of the comparison.
+        schema (Optional[Mapping[str, str]]): The types of the fields.
+        workers (Optional[int]): The number of worker processes diffing
+            partitions, if more than one.
+        want (Optional[Iterable[str]]): The categories to keep the rows of.
+        compare (Optional[Mapping[str, Policy]]): The compare policies of
+            the fields.
+
+    Yields:
+        DiffResult: The ``inserts``, ``updates``, ``deletes`` and ``skips``
+        of each partition, in no particular order. The rows are only
+        converted to records once asked for, in the consuming process.
+    """
+    want = _wanted(want)
+    compare = compare_policies(compare)
+    cache = const.BasePath.CACHE.value / 'diff'
+    cache.mkdir(parents=True, exist_ok=True)
+    path = pathlib.Path(tempfile.mkdtemp(dir=str(cache)))
+    try:
+        spills = list(zip(
+            spill_partitions(current, index, partitions, path / 'current'),
+            spill_partitions(previous, index, partitions, path / 'previous'),
+        ))
+        if workers and workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                futures = [
+                    executor.submit(
+                        diff_partition,
+                        curr_spill,
+                        prev_spill,
+                        index,
+                        ignored,
+                        schema,
+                        want,
+                        compare
+                    )
+                    for curr_spill, prev_spill in spills
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    yield future.result()
+        else:
+            for curr_spill, prev_spill in spills:
+                yield diff_partition(
+                    curr_spill,
+                    prev_spill,
+                    index,
+                    ignored,
+                    schema,
+                    want,
+                    compare
+                )
+    finally:
+        shutil.rmtree(str(path), ignore_errors=True)
+
+
+@corelib.inject_loop
+async def get_ins_upd_del_partitioned(
+    data_name: str,
+    current: typing.Iterable[DiffData],
+    previous: typing.Iterable[DiffData],
+    index: typing.Union[str, typing.List[str]],
+    ignored: typing.Optional[typing.List[str]]=None,
+    partitions: int=PARTITIONS,
+    workers: typing.Optional[int]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+    *,
+    loop: asyncio.AbstractEventLoop,
+) -> typing.AsyncIterator[DiffResult]:
+    """
+    Partitioned, streaming form of :py:func:`get_ins_upd_del`.
+
+    The inputs are iterables of batches rather than complete lists, such as
+    :py:func:`playlist.sql.lib.iter_current_columns`, and the results are
+    yielded a partition at a time, see :py:func:`iter_partitioned_diff`.
+    The work is done in the loop's executor.
+
+    Yields:
+        DiffResult: The ``inserts``, ``updates``, ``deletes`` and ``skips``
+        of each partition.
+    """
+    results = iter_partitioned_diff(
+        current,
+        previous,
+        index,
+        partitions=partitions,
+        ignored=ignored,
+        schema=schema,
+        workers=workers,
+        want=want,
+        compare=compare,
+    )
+    done = object()
+    counts = dict.fromkeys(CATEGORIES, 0)
+    try:
+        while True:
+            part = await loop.run_in_executor(  # type: ignore
+                None,
+                next,
+                results,
+                done
+            )
+            if part is done:
+                break
+            for key, value in part.counts.items():
+                counts[key] += value
+            yield part
+    finally:
+        results.close()
+
+    print(
+        ' '.join((
+            f'{data_name} Processed:',
+            f'ins ({counts["inserts"]});',
+            f'upd ({counts["updates"]});',
+            f'del ({counts["deletes"]});',
+            f'skp ({counts["skips"]})',
+        ))
+    )
 
 
 @corelib.inject_loop
@@ -252,13 +1729,20 @@ async def get_update_skips(
     curr_cols: numpy.ndarray,
     prev_cols: numpy.ndarray,
     ignored: typing.Optional[typing.List[str]]=None,
+    skips: bool=True,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
     *,
     loop: asyncio.AbstractEventLoop,
 ) -> typing.Tuple[
     str,
-    typing.AsyncIterator[typing.Tuple[str, typing.List[dict]]]
+    typing.AsyncIterator[typing.Tuple[str, pandas.DataFrame]]
 ]:
-    """Retrieve the updates & skips for shared rows."""
+    """
+    Retrieve the updates & skips for shared rows.
+
+    The updates are always found, as the number of skips follows from them,
+    but the skips only when ``skips`` is set.
+    """
     checks = await loop.run_in_executor(  # type: ignore
         None,
         functools.partial(
@@ -299,29 +1783,38 @@ async def get_update_skips(
                 get_updates,
                 splits,
                 ignored=ignored,
+                compare=compare,
             )
         ),
-        loop.run_in_executor(  # type: ignore
-            None,
-            functools.partial(
-                get_skips,
-                splits,
-                ignored=ignored,
-            )
-        )
     )
+    if skips:
+        iterable += (
+            loop.run_in_executor(  # type: ignore
+                None,
+                functools.partial(
+                    get_skips,
+                    splits,
+                    ignored=ignored,
+                    compare=compare,
+                )
+            ),
+        )
     return 'checks', corelib.task_map(corelib.AsyncIterator, iterable)
 
 
 @corelib.inject_loop
 async def get_coro_data(
     type_: str,
-    data_coro: typing.Coroutine[None, None, typing.List[dict]],
+    data_coro: typing.Union[typing.Awaitable[DiffData], DiffData],
     index: typing.Union[str, typing.List[str]],
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
     *,
     loop: asyncio.AbstractEventLoop,
 ) -> typing.Tuple[str, pandas.DataFrame]:
-    collected = await data_coro
+    if inspect.isawaitable(data_coro):
+        collected = await data_coro
+    else:
+        collected = data_coro
     return type_, await loop.run_in_executor(  # type: ignore
         None,
         functools.partial(
@@ -329,6 +1822,7 @@ async def get_coro_data(
             collected,
             index=index,
             type_=type_,
+            schema=schema,
         )
     )
 
@@ -336,48 +1830,91 @@ async def get_coro_data(
 @corelib.inject_loop
 async def get_ins_upd_del(
     data_name: str,
-    curr_coro: typing.Coroutine[typing.List[dict], None, None],
-    prev_coro: typing.Coroutine[typing.List[dict], None, None],
+    curr_coro: typing.Union[typing.Awaitable[DiffData], DiffData],
+    prev_coro: typing.Union[typing.Awaitable[DiffData], DiffData],
     index: typing.Union[str, typing.List[str]],
     ignored: typing.Optional[typing.List[str]]=None,
+    engine: str='fused',
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
     *,
     loop: asyncio.AbstractEventLoop,
-) -> typing.Dict[str, typing.Union[typing.List[dict], typing.List[str], str]]:
+) -> DiffResult:
     """
     Universal tool for determining inserts/updates/deletes/skips.
 
     Results are determined from the current and previous inputs, which must
-    be lists of dicts that have the same keys in all dict entries in both
-    inputs. From those, it figures out what changes are necessary and returns
-    a dict containing the separate inserts/updates/deletes/skips groups.
+    have the same fields in both inputs. From those, it figures out what
+    changes are necessary and returns a dict containing the separate
+    inserts/updates/deletes/skips groups.
 
     * **inserts** are rows that exist in the *current* but not *previous* data.
     * **deletes** are rows that exist in the *previous* but not *current* data.
     * **updates** are rows that exist in both *current* and *previous* data,
-        and have changed.
+        and have changed. Each lists the fields that changed, as a tuple,
+        under ``'_changed'``, and their previous values, as a dict, under
+        ``'_previous'``.
     * **skips** are rows that exist in both *current* and *previous* data, and
         have not changed.
 
     Args:
-        current (List[dict]): The current data records to match against.
-        previous (List[dict]): The previous data records to match against.
+        curr_coro (Union[Awaitable[DiffData], DiffData]): The current data
+            to match against, or an awaitable returning it, in any of the
+            forms :py:func:`to_frame` accepts.
+        prev_coro (Union[Awaitable[DiffData], DiffData]): The previous data
+            to match against, likewise.
         index (str): The name of the field in the data to use as an index.
+        ignored (Optional[List[str]]): Fields left out of the comparison.
+        engine (str): How the rows are compared: ``'fused'`` classifies
+            every row in one merge and one comparison pass, in one executor
+            job, see :py:func:`fused_diff`. ``'merge'`` does the same in
+            separate jobs for each category, while ``'hash'`` compares a
+            hash of each row, see :py:func:`hash_diff`, which is lighter on
+            large inputs. ``'sorted'`` walks integer keys in one merge pass,
+            see :py:func:`sorted_diff`, for inputs already sorted by key.
+        schema (Optional[Mapping[str, str]]): The types the fields of the
+            results are cast to, by field name, such as the column types of
+            a table from :py:func:`playlist.sql.lib.table_schema`. Defaults
+            to the types the data itself implies.
+        want (Optional[Iterable[str]]): The categories to keep the rows of.
+            Defaults to all of them. The rest are only counted, which saves
+            the work of collecting their rows.
+        compare (Optional[Mapping[str, Policy]]): How fields are compared,
+            by field name, see :py:func:`compare_policies`, such as a
+            tolerance for float noise, such as the policies of a table from
+            :py:func:`playlist.sql.lib.table_compare`. Fields without a
+            policy change on any difference.
 
     Note:
-        `current` and `previous` are both *lists of dicts*, where the dicts
-        must contain exactly the same keys for this code to work correctly.
-        This is because the columns are matched up against each other for
-        comparison.
+        When `current` and `previous` are *lists of dicts*, the dicts must
+        contain exactly the same keys for this code to work correctly. This
+        is because the columns are matched up against each other for
+        comparison. Columnar data, such as DataFrames, structured arrays,
+        Arrow tables and dicts of columns, skips building a dict per row.
 
     Returns:
-        Dict[str, Union[List[dict]], List[str], str]: A dictionary containing
-        an entry for *`'inserts'`*, *`'updates'`*, *`'deletes'`*, *`'skips'`*,
-        and *`'index'`*. Each entry contains lists of dictionary records that
-        belong to that particular category of data.
+        DiffResult: A mapping with an entry for each of the categories kept,
+        *`'inserts'`*, *`'updates'`*, *`'deletes'`* and *`'skips'`*. Each
+        entry contains lists of dictionary records that belong to that
+        particular category of data, converted when first looked up, or a
+        batch at a time with :py:meth:`DiffResult.batches`. The number of
+        rows of every category is under :py:attr:`DiffResult.counts`.
+
+    Raises:
+        ValueError: If the engine is not one of :py:data:`ENGINES`, or a
+            wanted category is not one of :py:data:`CATEGORIES`.
     """
+    if engine not in ENGINES:
+        raise ValueError(
+            f'Unknown engine {engine!r}, expected one of {ENGINES}.'
+        )
+    want = _wanted(want)
+    compare = compare_policies(compare)
+
     iterable: typing.Tuple[asyncio.Future, ...] = (
-        get_coro_data('current', curr_coro, index=index),
-        get_coro_data('previous', prev_coro, index=index)
+        get_coro_data('current', curr_coro, index=index, schema=schema),
+        get_coro_data('previous', prev_coro, index=index, schema=schema)
     )
 
     collected = {}
@@ -392,6 +1929,56 @@ async def get_ins_upd_del(
         ))
     )
 
+    if engine == 'merge':
+        results = await _merge_diff(
+            collected,
+            ignored,
+            schema,
+            want,
+            compare
+        )
+    else:
+        results = await loop.run_in_executor(  # type: ignore
+            None,
+            functools.partial(
+                {
+                    'fused': fused_diff,
+                    'hash': hash_diff,
+                    'sorted': sorted_diff,
+                }[engine],
+                ignored=ignored,
+                schema=schema,
+                want=want,
+                compare=compare,
+                **collected
+            )
+        )
+
+    counts = results.counts
+    print(
+        ' '.join((
+            f'{data_name} Processed:',
+            f'ins ({counts["inserts"]});',
+            f'upd ({counts["updates"]});',
+            f'del ({counts["deletes"]});',
+            f'skp ({counts["skips"]})',
+        ))
+    )
+
+    return results
+
+
+@corelib.inject_loop
+async def _merge_diff(
+    collected: typing.Dict[str, pandas.DataFrame],
+    ignored: typing.Optional[typing.List[str]]=None,
+    schema: typing.Optional[typing.Mapping[str, str]]=None,
+    want: typing.Optional[typing.Iterable[str]]=None,
+    compare: typing.Optional[typing.Mapping[str, Policy]]=None,
+    *,
+    loop: asyncio.AbstractEventLoop,
+) -> DiffResult:
+    want = _wanted(want)
     merged, cols = await loop.run_in_executor(  # type: ignore
         None,
         functools.partial(
@@ -402,50 +1989,58 @@ async def get_ins_upd_del(
     current_cols = [col + '_x' for col in cols]
     previous_cols = [col + '_y' for col in cols]
 
-    iterable = (
-        loop.run_in_executor(  # type: ignore
-            None,
-            functools.partial(
-                get_inserts,
-                merged,
-                current_cols,
-                previous_cols,
-            )
-        ),
+    sides = {'inserts': get_inserts, 'deletes': get_deletes}
+    iterable = tuple(
         loop.run_in_executor(  # type: ignore
             None,
             functools.partial(
-                get_deletes,
+                getter,
                 merged,
                 current_cols,
                 previous_cols,
             )
-        ),
+        )
+        for key, getter in sides.items()
+        if key in want
+    ) + (
         get_update_skips(
             merged,
             current_cols,
             previous_cols,
             ignored=ignored,
-        )
+            skips='skips' in want,
+            compare=compare,
+        ),
     )
 
-    results = {}
+    frames = {}
 
     async for key, value in corelib.task_map(corelib.AsyncIterator, iterable):
         if key == 'checks':
             async for inner_key, inner_value in value:
-                results[inner_key] = inner_value
+                frames[inner_key] = inner_value
         else:
-            results[key] = value
+            frames[key] = value
 
-    print(
-        ' '.join((
-            f'{data_name} Processed:',
-            f'ins ({results["inserts"].__len__()});',
-            f'upd ({results["updates"].__len__()});',
-            f'del ({results["deletes"].__len__()});',
-            f'skp ({results["skips"].__len__()})',
-        ))
+    counts = {key: len(value) for key, value in frames.items()}
+    if not set(sides) <= want:
+        # Unwanted sides are only counted, never collected.
+        counts.update(
+            (key, value)
+            for key, value in count_sides(
+                merged,
+                current_cols,
+                previous_cols
+            ).items()
+            if key not in want
+        )
+    # Every merged row is an insert, a delete or a checked row.
+    counts.setdefault(
+        'skips',
+        len(merged) - counts['inserts'] - counts['deletes'] - counts['updates']
+    )
+    return DiffResult(
+        {key: value for key, value in frames.items() if key in want},
+        counts,
+        schema
     )
-
-    return results
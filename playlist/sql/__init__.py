@@ -9,4 +9,7 @@ __all__ = (
     'conn',
     'tables',
     'sqllib',
+    'arrow_lib',
+    'snapshot_lib',
+    'maintenance_lib',
 )
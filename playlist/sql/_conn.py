@@ -14,54 +14,435 @@ Module API
 
     DBConnection
     MainConnectionConfig
+    QueryDiagnostics
+    SessionMetrics
 """
 __all__ = (
     'DBConnection',
     'MainConnectionConfig',
+    'QueryDiagnostics',
+    'SessionMetrics',
 )
 
 import contextlib
+import copy
 import functools
 import inspect
 import logging
+import os
+import pathlib
+import re
+import sqlite3
 import threading
+import time
 import typing
 
 import sqlalchemy
+import sqlalchemy.event
 import sqlalchemy.orm
+import sqlalchemy.pool
 import sqlalchemy.ext.baked
 import sqlalchemy.ext.declarative
 
 from playlist.core import const, config, logger
 
+LOG = logging.getLogger(__name__)
 
-def get_connect_string() -> str:
+# Settings overridden at runtime, by database name, see
+# :py:meth:`DBConnection.configure`.
+_OVERRIDES: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+
+
+def get_db_names() -> typing.List[str]:
+    """
+    Get the names of the databases configured in the settings.
+
+    Returns:
+        List[str]: The names under ``db.databases``, always including
+        ``trackdb``.
+    """
+    names = ['trackdb']
+    with config.settings as settings:
+        with contextlib.suppress(AttributeError):
+            names.extend(
+                name
+                for name in copy.deepcopy(settings.db.databases)
+                if name not in names
+            )
+    return names
+
+
+def get_db_settings(name: str) -> typing.Dict[str, typing.Any]:
+    """
+    Get the settings of a database.
+
+    The ``db`` settings apply to every database, and the block for the
+    database under ``db.databases`` overrides them, one level deep, as do
+    any settings given to :py:meth:`DBConnection.configure` after that. A
+    database's ``file`` defaults to ``<name>.db``, and its ``tables`` (the
+    table definitions it uses) to the definitions of the same name.
+
+    Args:
+        name (str): The name of the database.
+
+    Returns:
+        Dict[str, Any]: The settings of the database.
+    """
+    with config.settings as settings:
+        db_settings = copy.deepcopy(settings.db)
+
+    databases = db_settings.pop('databases', None) or {}
+    for overrides in (databases.get(name), _OVERRIDES.get(name)):
+        for key, value in (overrides or {}).items():
+            if (
+                isinstance(value, dict) and
+                isinstance(db_settings.get(key), dict)
+            ):
+                db_settings[key].update(value)
+            else:
+                db_settings[key] = value
+
+    db_settings.setdefault('file', f'{name}.db')
+    db_settings.setdefault('tables', name)
+    return db_settings
+
+
+def get_db_path(name: str='trackdb') -> pathlib.Path:
+    """
+    Get the path of a database file.
+
+    Args:
+        name (str): The name of the database.
+
+    Returns:
+        pathlib.Path: The database file, in the data directory.
+    """
+    path = const.BasePath.DATA.value
+    path.mkdir(parents=True, exist_ok=True)
+    return path / get_db_settings(name)['file']
+
+
+def get_connect_string(name: str='trackdb') -> str:
     """
     Build the connection string for a database.
 
+    Args:
+        name (str): The name of the database.
+
     Returns:
         str: The connection string used by
         :py:func:`sqlalchemy.create_engine` to connect to the database.
 
     """
+    db_settings = get_db_settings(name)
+    db_path = get_db_path(name)
 
-    with config.settings as settings:
-        path = const.BasePath.DATA.value
-        path.mkdir(parents=True, exist_ok=True)
-        db_path = path / settings.db.file
-
-        connect_string = f'{settings.db.driver}{db_path.as_posix()}'
+    connect_string = f"{db_settings['driver']}{db_path.as_posix()}"
 
-        with contextlib.suppress(AttributeError):
-            if settings.db.params:
-                connect_string += '?' + '&'.join((
-                    '='.join((key, repr(value)))
-                    for key, value in settings.db.params.items()
-                ))
+    if db_settings.get('params'):
+        connect_string += '?' + '&'.join((
+            '='.join((key, repr(value)))
+            for key, value in db_settings['params'].items()
+        ))
 
     return connect_string
 
 
+class QueryDiagnostics:
+    """
+    Captures query plans and keeps the SQLite planner statistics current.
+
+    Once attached to an engine, the first execution of each distinct
+    statement has its ``EXPLAIN QUERY PLAN`` captured, and full scans of
+    large tables are logged as warnings. Rows written are tallied, so
+    ``ANALYZE`` and ``PRAGMA optimize`` can be run after bulk loads.
+
+    The behavior is controlled by the ``diagnostics`` block of the
+    connection's settings.
+    """
+
+    DEFAULTS = {
+        'explain': True,
+        'large_table_rows': 10000,
+        'analyze_after_rows': 5000,
+    }
+    PLANNED = frozenset({'SELECT', 'UPDATE', 'DELETE', 'WITH'})
+    WRITES = frozenset({'INSERT', 'UPDATE', 'DELETE', 'REPLACE'})
+    SCAN = re.compile(r'^SCAN (?:TABLE )?(?P<table>[^\s]+)')
+
+    def __init__(self, connection: 'DBConnection') -> None:
+        """
+        Initialize the QueryDiagnostics.
+
+        Args:
+            connection (DBConnection): The connection being diagnosed.
+        """
+        self.connection = connection
+        self.__lock = threading.RLock()
+        self.__plans: typing.Dict[str, typing.Tuple[str, ...]] = {}
+        self.__table_rows: typing.Dict[str, int] = {}
+        self.__rows_written = 0
+
+        self.settings = dict(self.DEFAULTS)
+        self.settings.update(connection.settings.get('diagnostics') or {})
+
+    @property
+    def plans(self) -> typing.Dict[str, typing.Tuple[str, ...]]:
+        """The captured query plans, keyed by SQL statement."""
+        with self.__lock:
+            return dict(self.__plans)
+
+    @property
+    def rows_written(self) -> int:
+        """The number of rows written since the last ``ANALYZE``."""
+        return self.__rows_written
+
+    @staticmethod
+    def _verb(statement: str) -> str:
+        return statement.lstrip().split(None, 1)[0].upper()
+
+    def attach(self, engine: sqlalchemy.engine.Engine) -> None:
+        """Listen for statements executed on the given engine."""
+        sqlalchemy.event.listen(
+            engine,
+            'before_cursor_execute',
+            self._before_cursor_execute
+        )
+        sqlalchemy.event.listen(
+            engine,
+            'after_cursor_execute',
+            self._after_cursor_execute
+        )
+
+    def _table_rows(self, dbapi_conn: typing.Any, table: str) -> int:
+        with self.__lock:
+            try:
+                return self.__table_rows[table]
+            except KeyError:
+                cursor = dbapi_conn.cursor()
+                try:
+                    cursor.execute(f'SELECT count(*) FROM "{table}"')
+                    self.__table_rows[table] = cursor.fetchone()[0]
+                finally:
+                    cursor.close()
+                return self.__table_rows[table]
+
+    def _before_cursor_execute(
+        self,
+        conn: sqlalchemy.engine.Connection,
+        cursor: typing.Any,
+        statement: str,
+        parameters: typing.Any,
+        context: typing.Any,
+        executemany: bool,
+    ) -> None:
+        if not self.settings['explain']:
+            return
+        if self._verb(statement) not in self.PLANNED:
+            return
+
+        with self.__lock:
+            if statement in self.__plans:
+                return
+            self.__plans[statement] = ()
+
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+
+        dbapi_conn = cursor.connection
+        plan_cursor = dbapi_conn.cursor()
+        try:
+            plan_cursor.execute(
+                f'EXPLAIN QUERY PLAN {statement}',
+                parameters or ()
+            )
+            plan = tuple(str(row[-1]) for row in plan_cursor.fetchall())
+        except Exception as e:
+            LOG.debug(f'Unable to capture query plan ({e}): {statement}')
+            return
+        finally:
+            plan_cursor.close()
+
+        with self.__lock:
+            self.__plans[statement] = plan
+
+        LOG.debug('\n'.join(('Query plan:', statement, *plan)))
+
+        for detail in plan:
+            match = self.SCAN.match(detail)
+            if not match:
+                continue
+            table = match.group('table')
+            with contextlib.suppress(Exception):
+                rows = self._table_rows(dbapi_conn, table)
+                if rows >= self.settings['large_table_rows']:
+                    LOG.warning(
+                        f'Full scan of {table} ({rows} rows) [{detail}]: '
+                        f'{statement}'
+                    )
+
+    def _after_cursor_execute(
+        self,
+        conn: sqlalchemy.engine.Connection,
+        cursor: typing.Any,
+        statement: str,
+        parameters: typing.Any,
+        context: typing.Any,
+        executemany: bool,
+    ) -> None:
+        if cursor.rowcount > 0 and self._verb(statement) in self.WRITES:
+            with self.__lock:
+                self.__rows_written += cursor.rowcount
+
+    def analyze(self, engine: sqlalchemy.engine.Engine) -> None:
+        """
+        Refresh the planner statistics.
+
+        The captured plans are discarded, since the new statistics may
+        change them; they are captured again on their next execution.
+        """
+        with self.__lock:
+            with engine.connect() as connection:
+                connection.execute('ANALYZE')
+                connection.execute('PRAGMA optimize')
+            self.__rows_written = 0
+            self.__table_rows.clear()
+            self.__plans.clear()
+        LOG.info(f'Analyzed the {self.connection.name} database.')
+
+    def maybe_analyze(self, engine: sqlalchemy.engine.Engine) -> bool:
+        """
+        Refresh the planner statistics after a bulk load.
+
+        Returns:
+            bool: True if ``ANALYZE`` was run.
+        """
+        threshold = self.settings['analyze_after_rows']
+        if threshold is None or self.__rows_written <= threshold:
+            return False
+
+        self.analyze(engine)
+        return True
+
+
+class SessionMetrics:
+    """
+    Collects timings for the sessions made by a connection.
+
+    Each session is broken down by a label, which for sessionized callables
+    is the qualified name of the callable. For every label this tracks:
+
+    * ``checkout``: the wait for a pooled connection when the session opens.
+    * ``transaction``: the time from the connection being checked out until
+      the transaction is committed or rolled back.
+    * ``commit``: the time spent committing.
+
+    along with the number of commits, rollbacks, and the sessions currently
+    open (and the most ever open at once).
+    """
+
+    TIMINGS = ('checkout', 'transaction', 'commit')
+    UNLABELED = '<session>'
+
+    def __init__(self) -> None:
+        """Initialize the SessionMetrics."""
+        self.__lock = threading.Lock()
+        self.__active = 0
+        self.__peak = 0
+        self.__labels: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+
+    def _stats(
+        self,
+        label: typing.Optional[str]
+    ) -> typing.Dict[str, typing.Any]:
+        label = label or self.UNLABELED
+        try:
+            return self.__labels[label]
+        except KeyError:
+            self.__labels[label] = {
+                'sessions': 0,
+                'commits': 0,
+                'rollbacks': 0,
+                'active': 0,
+                'peak': 0,
+                **{
+                    name: {'count': 0, 'total': 0.0, 'max': 0.0}
+                    for name in self.TIMINGS
+                },
+            }
+            return self.__labels[label]
+
+    def opened(self, label: typing.Optional[str]) -> None:
+        """Record a session being opened."""
+        with self.__lock:
+            stats = self._stats(label)
+            stats['sessions'] += 1
+            stats['active'] += 1
+            stats['peak'] = max(stats['peak'], stats['active'])
+            self.__active += 1
+            self.__peak = max(self.__peak, self.__active)
+
+    def timed(
+        self,
+        label: typing.Optional[str],
+        name: str,
+        seconds: float
+    ) -> None:
+        """Record how long one of the :py:attr:`TIMINGS` took."""
+        with self.__lock:
+            timing = self._stats(label)[name]
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    def closed(self, label: typing.Optional[str], committed: bool) -> None:
+        """Record a session being closed, by commit or by rollback."""
+        with self.__lock:
+            stats = self._stats(label)
+            stats['commits' if committed else 'rollbacks'] += 1
+            stats['active'] -= 1
+            self.__active -= 1
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """
+        Get a copy of the metrics collected so far.
+
+        Returns:
+            Dict[str, Any]: The overall ``active`` and ``peak`` session
+            counts, and the metrics of each label under ``sessions``. Each
+            timing has its ``count``, ``total``, ``mean`` and ``max`` in
+            seconds.
+        """
+        with self.__lock:
+            labels = copy.deepcopy(self.__labels)
+            active, peak = self.__active, self.__peak
+
+        for stats in labels.values():
+            for name in self.TIMINGS:
+                timing = stats[name]
+                timing['mean'] = (
+                    timing['total'] / timing['count']
+                    if timing['count']
+                    else 0.0
+                )
+
+        return {'active': active, 'peak': peak, 'sessions': labels}
+
+    def reset(self) -> None:
+        """Discard the collected metrics, except for the open sessions."""
+        with self.__lock:
+            self.__peak = self.__active
+            active = {
+                label: stats['active']
+                for label, stats in self.__labels.items()
+                if stats['active']
+            }
+            self.__labels.clear()
+            for label, count in active.items():
+                stats = self._stats(label)
+                stats['active'] = stats['peak'] = count
+
+
 class SQLSession:
     """
     Implements a context manager to handle SQLAlchemy sessions.
@@ -76,19 +457,23 @@ class SQLSession:
 
     def __init__(
         self,
-        connection: 'DBConnection'
+        connection: 'DBConnection',
+        label: typing.Optional[str]=None
     ) -> None:
         """
         Initialize the SQLSession object.
 
         Args:
-            sessionmaker (sqlalchemy.orm.session.sessionmaker): The
-                :py:class:`sqlalchemy.orm.session.Session` factory to produce
-                sessions with. This is expected to already be tied to a
-                particular engine.
+            connection (DBConnection): The connection to produce sessions
+                for. Its cached session factory is used to make the session.
+            label (Optional[str]): The name the session's metrics are
+                recorded under.
         """
         self.connection = connection
+        self.label = label
         self.__lock = threading.RLock()
+        self.__depth = 0
+        self.__failed = False
 
     @property
     def _engine_cm(self) -> 'DBEngine':
@@ -101,16 +486,43 @@ class SQLSession:
                 return self.__engine_cm
 
     def __enter__(self) -> sqlalchemy.orm.session.Session:
-        """Enter synchronous context manager."""
+        """
+        Enter synchronous context manager.
+
+        Re-entering an open SQLSession shares its session; the transaction
+        is only finished when the outermost block exits.
+        """
         with self.__lock:
             self.session: sqlalchemy.orm.session.Session
+            with contextlib.suppress(AttributeError):
+                session = self.session
+                self.__depth += 1
+                return session
+
+            start = time.perf_counter()
+            engine = self._engine_cm.__enter__()
             try:
-                return self.session
-            except AttributeError:
-                self.engine = self._engine_cm.__enter__()
-                sessionmaker = sqlalchemy.orm.sessionmaker(bind=self.engine)
-                self.session = sessionmaker()
-                return self.session
+                session = self.connection.sessionmaker(engine)()
+                try:
+                    # Check the connection out now, so the wait for it is
+                    # measured here instead of in the first query.
+                    session.connection()
+                except BaseException:
+                    session.close()
+                    raise
+            except BaseException as exc:
+                # A failed checkout never opened a session to count.
+                self._engine_cm.__exit__(type(exc), exc, exc.__traceback__)
+                raise
+
+            self.__opened = time.perf_counter()
+            metrics = self.connection.metrics
+            metrics.opened(self.label)
+            metrics.timed(self.label, 'checkout', self.__opened - start)
+            self.engine = engine
+            self.session = session
+            self.__depth += 1
+            return session
 
     @logger.logged
     def __exit__(
@@ -121,14 +533,47 @@ class SQLSession:
         *,
         log: logging.Logger,
     ) -> None:
-        """Exit synchronous context manager."""
+        """
+        Exit synchronous context manager.
+
+        An error raised in any nested block rolls back the whole transaction
+        when the outermost block exits, even if the error was handled.
+        """
         with self.__lock:
-            if exc_type is None:
-                self.session.commit()
-            else:
+            self.__depth -= 1
+            if exc_type is not None:
                 log.error(f'Error found: [{exc_type.__name__}] {exc_value}')
                 log.error(f'connection.Base = {self.connection.Base}')
-                self.session.rollback()
+                self.__failed = True
+
+            if self.__depth:
+                return
+
+            metrics = self.connection.metrics
+            committed = False
+            try:
+                if self.__failed:
+                    self.session.rollback()
+                else:
+                    start = time.perf_counter()
+                    self.session.commit()
+                    committed = True
+                    metrics.timed(
+                        self.label,
+                        'commit',
+                        time.perf_counter() - start
+                    )
+            finally:
+                metrics.timed(
+                    self.label,
+                    'transaction',
+                    time.perf_counter() - self.__opened
+                )
+                metrics.closed(self.label, committed)
+
+            if committed:
+                self.connection.diagnostics.maybe_analyze(self.engine)
+            self.__failed = False
             self._engine_cm.__exit__(exc_type, exc_value, tb)
             del self.session
             del self.engine
@@ -150,23 +595,22 @@ class SessionChecker:
 
     def __init__(
         self,
-        sessionmanager: SQLSession,
-        bargs: inspect.BoundArguments
+        sessionmanager: typing.Callable[[], SQLSession],
+        arguments: typing.MutableMapping[str, typing.Any]
     ) -> None:
         """
         Initialize the SessionChecker.
 
         Args:
-            sessionmanager (SQLSession): The SQLSession to produce a session
-                with when needed.
-            kwargs (Dict[str, Any]): The keyword arguments for the function
-                being sessionized.
-            keyword (str): The name of the keyword argument to check for the
-                session.
+            sessionmanager (Callable[[], SQLSession]): Produces the
+                SQLSession to make a session with when needed.
+            arguments (MutableMapping[str, Any]): The keyword arguments for
+                the function being sessionized. The session is injected as
+                the ``session`` entry.
 
         """
         self.sessionmanager = sessionmanager
-        self.arguments = bargs.arguments
+        self.arguments = arguments
 
     def __enter__(self) -> typing.MutableMapping[str, typing.Any]:
         """Enter synchronous context manager."""
@@ -205,7 +649,7 @@ def _get_bargs(
 
 
 def sessionizer(
-    sessionmanager: SQLSession,
+    sessionmanager: typing.Callable[[], SQLSession],
     func: typing.Callable
 ) -> typing.Callable:
     """
@@ -218,8 +662,8 @@ def sessionizer(
     :py:meth:`ConnectionConfig.sessionize` context manager.
 
     Args:
-        sessionmanager (SQLSession): The context manager that handles the
-            session gracefully.
+        sessionmanager (Callable[[], SQLSession]): Produces the context
+            manager that handles the session gracefully.
         func (Callable): The function/generator that is decorated so it can
             be sessionized.
         keyword (str): The name of the parameter to assign the session object
@@ -241,6 +685,27 @@ def sessionizer(
             for key, value in sig.parameters.items()
         ]
     )
+
+    # A keyword-only session can be found in the keyword arguments, so the
+    # signature only needs binding when the session could be positional.
+    session_param = sig.parameters.get('session')
+    if (
+        session_param is not None
+        and session_param.kind is inspect.Parameter.KEYWORD_ONLY
+    ):
+        def bind(
+            args: typing.Tuple[typing.Any, ...],
+            kwargs: typing.Dict[str, typing.Any]
+        ) -> typing.Tuple[tuple, typing.MutableMapping[str, typing.Any]]:
+            return args, kwargs
+
+    else:
+        def bind(
+            args: typing.Tuple[typing.Any, ...],
+            kwargs: typing.Dict[str, typing.Any]
+        ) -> typing.Tuple[tuple, typing.MutableMapping[str, typing.Any]]:
+            return (), _get_bargs(sig, args, kwargs).arguments
+
     if inspect.isasyncgenfunction(func):  # type: ignore
         raise ValueError('Cannot be used on Asynchronous Generators.')
     elif inspect.iscoroutinefunction(func):
@@ -250,11 +715,9 @@ def sessionizer(
             *args: typing.Tuple[typing.Any, ...],
             **kwargs: typing.Dict[str, typing.Any]
         ) -> typing.Any:
-            with SessionChecker(
-                sessionmanager,
-                _get_bargs(sig, args, kwargs)
-            ) as full_arguments:
-                func(**full_arguments)  # type: ignore
+            args, arguments = bind(args, kwargs)
+            with SessionChecker(sessionmanager, arguments) as full_arguments:
+                yield from func(*args, **full_arguments)  # type: ignore
 
         ret = gen_sql_wrapper
 
@@ -263,11 +726,9 @@ def sessionizer(
             *args: typing.Tuple[typing.Any, ...],
             **kwargs: typing.Dict[str, typing.Any]
         ) -> typing.Any:
-            with SessionChecker(
-                sessionmanager,
-                _get_bargs(sig, args, kwargs)
-            ) as full_arguments:
-                return func(**full_arguments)  # type: ignore
+            args, arguments = bind(args, kwargs)
+            with SessionChecker(sessionmanager, arguments) as full_arguments:
+                return func(*args, **full_arguments)  # type: ignore
 
         ret = func_sql_wrapper
 
@@ -277,15 +738,13 @@ def sessionizer(
 
 
 class DBEngine:
-    def __init__(self) -> None:
+    def __init__(self, connection: 'DBConnection') -> None:
+        self.connection = connection
         self.__lock = threading.RLock()
 
     def __verify_sqlite_exists(self):
 
-            with config.settings as settings:
-                path = const.BasePath.DATA.value
-                path.mkdir(parents=True, exist_ok=True)
-                dbcache = path / settings.db.file
+            dbcache = get_db_path(self.connection.name)
 
             if not dbcache.exists():
                 with contextlib.suppress(AttributeError):
@@ -311,11 +770,67 @@ class DBEngine:
                 self.__counter += 1
                 return self.__engine
             except AttributeError:
-                connect_string = get_connect_string()
+                db_path = get_db_path(self.connection.name)
+                connect_string = get_connect_string(self.connection.name)
                 self.__engine = sqlalchemy.create_engine(connect_string)
+                self.connection.diagnostics.attach(self.__engine)
+                # The auto_vacuum mode can only be chosen for a new database;
+                # an existing one keeps its mode until it is rebuilt.
+                if not db_path.exists() or not db_path.stat().st_size:
+                    with contextlib.suppress(KeyError, TypeError):
+                        sqlalchemy.event.listen(
+                            self.__engine,
+                            'connect',
+                            functools.partial(
+                                self.__set_auto_vacuum,
+                                self.connection.settings['vacuum'][
+                                    'auto_vacuum'
+                                ]
+                            ),
+                            once=True
+                        )
                 self.__counter = 1
                 return self.__engine
 
+    @staticmethod
+    def __set_auto_vacuum(
+        mode: str,
+        dbapi_conn: typing.Any,
+        connection_record: typing.Any
+    ) -> None:
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute(f'PRAGMA auto_vacuum={mode.upper()}')
+        finally:
+            cursor.close()
+
+    @property
+    def in_use(self) -> bool:
+        """Whether the engine is currently connected."""
+        with self.__lock:
+            try:
+                return bool(self.__counter)
+            except AttributeError:
+                return False
+
+    def replace_file(self, path: pathlib.Path) -> None:
+        """
+        Replace the database file with another, while it isn't in use.
+
+        Args:
+            path (pathlib.Path): The new database file. It is moved into
+                place.
+
+        Raises:
+            RuntimeError: If the engine is in use.
+        """
+        with self.__lock:
+            if self.in_use:
+                raise RuntimeError(
+                    f'The {self.connection.name} database is in use.'
+                )
+            os.replace(str(path), str(get_db_path(self.connection.name)))
+
     def __exit__(
         self,
         exc_type: typing.Optional[type],
@@ -334,17 +849,28 @@ class DBConnectionMeta(type):
     _lock = threading.RLock()
 
     def __call__(cls, name: str) -> 'DBConnection':  # type: ignore
-        cls.__instance: 'DBConnection'
+        cls.__instances: typing.Dict[str, 'DBConnection']
         with DBConnectionMeta._lock:
             try:
-                return cls.__instance
+                instances = cls.__instances
             except AttributeError:
-                cls.__instance = super().__call__(name)
-                return cls.__instance
+                instances = cls.__instances = {}
+
+            try:
+                return instances[name]
+            except KeyError:
+                instances[name] = super().__call__(name)
+                return instances[name]
 
 
 class DBConnection(metaclass=DBConnectionMeta):
-    """Class defined to manage a database connection."""
+    """
+    Class defined to manage a database connection.
+
+    There is one DBConnection per database name, each with its own engine,
+    declarative Base, and settings, so separate databases never share a
+    lock.
+    """
 
     def __init__(
         self,
@@ -352,6 +878,10 @@ class DBConnection(metaclass=DBConnectionMeta):
     ) -> None:
         """Initiaize the DBConnection."""
         self.__lock = threading.RLock()
+        self.__scope = threading.local()
+        self.__sessionmaker = sqlalchemy.orm.sessionmaker()
+        self.__staging_depth = 0
+        self.__staging_binds: typing.Dict[typing.Any, typing.Any] = {}
         self.name = name
 
     @property
@@ -365,9 +895,116 @@ class DBConnection(metaclass=DBConnectionMeta):
         try:
             return self.__engine
         except AttributeError:
-            self.__engine = DBEngine()
+            self.__engine = DBEngine(self)
             return self.__engine
 
+    @property
+    def settings(self) -> typing.Dict[str, typing.Any]:
+        """The settings of this database, see :py:func:`get_db_settings`."""
+        return get_db_settings(self.name)
+
+    @property
+    def path(self) -> pathlib.Path:
+        """The database file."""
+        return get_db_path(self.name)
+
+    def configure(self, **settings: typing.Any) -> None:
+        """
+        Override settings of this database for the rest of the process.
+
+        This is how a worker process points a database at another file,
+        e.g. ``conn.trackdb.configure(file='tracks-alice.db')``. Overrides
+        apply on top of the configured settings, one level deep, and
+        replace any overrides given before.
+
+        The tables resolved so far are forgotten, so they are created or
+        migrated in the new file when next used; a forked worker would
+        otherwise take the tables its parent resolved as existing.
+
+        Args:
+            **settings: The settings to override.
+
+        Raises:
+            RuntimeError: If the database is in use.
+        """
+        from playlist.sql import tables
+
+        with self.__lock:
+            if self.engine.in_use:
+                raise RuntimeError(f'The {self.name} database is in use.')
+            _OVERRIDES[self.name] = copy.deepcopy(settings)
+            if self.name in tables:
+                tables[self.name].reset()
+
+    def backup(
+        self,
+        target: pathlib.Path,
+        pages: int=256,
+        sleep: float=0.05,
+        progress: typing.Optional[typing.Callable[[int, int], None]]=None
+    ) -> None:
+        """
+        Copy the database to another file while it stays in use.
+
+        The SQLite online backup API copies ``pages`` pages at a time,
+        pausing ``sleep`` seconds between batches, so writers are only
+        blocked while a batch is copied. Where the sqlite3 module lacks the
+        backup API, ``VACUUM INTO`` is used instead, in a single step.
+
+        Args:
+            target (pathlib.Path): The file to write the copy to.
+            pages (int): The pages copied per batch.
+            sleep (float): Seconds to pause between batches.
+            progress (Optional[Callable[[int, int], None]]): Called after
+                each batch with the pages copied so far and the total.
+        """
+        with self.engine as engine:
+            raw = engine.raw_connection()
+            try:
+                source = raw.connection
+                try:
+                    source_backup = source.backup
+                except AttributeError:
+                    source.execute('VACUUM INTO ?', (str(target),))
+                    return
+
+                def report(status: int, remaining: int, total: int) -> None:
+                    if progress is not None:
+                        progress(total - remaining, total)
+
+                destination = sqlite3.connect(str(target))
+                try:
+                    source_backup(
+                        destination,
+                        pages=pages,
+                        progress=report,
+                        sleep=sleep
+                    )
+                finally:
+                    destination.close()
+            finally:
+                raw.close()
+
+    @property
+    def diagnostics(self) -> QueryDiagnostics:
+        """Query plan capture and planner statistics for this database."""
+        with self.__lock:
+            try:
+                return self.__diagnostics
+            except AttributeError:
+                self.__diagnostics = QueryDiagnostics(self)
+                return self.__diagnostics
+
+    @property
+    def metrics(self) -> SessionMetrics:
+        """Checkout, transaction and commit timings for this database."""
+        with self.__lock:
+            try:
+                return self.__metrics
+            except AttributeError:
+                self.__metrics = SessionMetrics()
+                return self.__metrics
+
     @property  # type: ignore
     def Base(self) -> 'sqlalchemy.ext.declarative.api.Base':
         """
@@ -383,7 +1020,112 @@ class DBConnection(metaclass=DBConnectionMeta):
                 self.__Base = sqlalchemy.ext.declarative.declarative_base()
                 return self.__Base
 
-    def session(self) -> SQLSession:
+    def sessionmaker(
+        self,
+        engine: sqlalchemy.engine.Engine
+    ) -> typing.Callable[[], sqlalchemy.orm.session.Session]:
+        """
+        Get the session factory for an engine.
+
+        The underlying :py:class:`sqlalchemy.orm.session.sessionmaker` is
+        only built once per connection, and survives the engine being
+        disposed and recreated; only the bind changes. Tables staged by
+        :py:meth:`staging` are bound to the staging engine instead.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine the sessions are
+                bound to.
+
+        Returns:
+            Callable[[], sqlalchemy.orm.session.Session]: The session
+            factory.
+        """
+        with self.__lock:
+            if self.__staging_binds:
+                return functools.partial(
+                    self.__sessionmaker,
+                    bind=engine,
+                    binds=dict(self.__staging_binds)
+                )
+        return functools.partial(self.__sessionmaker, bind=engine)
+
+    @contextlib.contextmanager
+    def staging(
+        self,
+        table_names: typing.Iterable[str]
+    ) -> typing.Iterator[sqlalchemy.engine.Engine]:
+        """
+        Stage tables in an in-memory database.
+
+        While the block is open, sessions from this connection read and
+        write the given tables in a private in-memory database instead of
+        the database file, so nothing written to them is journaled or
+        synced to disk. The staged tables start out empty, and their
+        contents are discarded when the outermost block exits.
+
+        The in-memory database lives on a single connection, so sessions
+        using the staged tables take turns with it: the connection is held
+        from its checkout until it is checked back in, however long that
+        takes, rather than for a pool timeout. Nested blocks share the same
+        staging database.
+
+        Example:
+            Import into a staged table::
+
+                with conn.trackdb.staging(['NewTracks']):
+                    sqllib.load_tracks(tracks)
+                    current = sqllib.get_current_tracks()
+
+        Args:
+            table_names (Iterable[str]): The table definitions to stage.
+
+        Yields:
+            sqlalchemy.engine.Engine: The engine of the staging database.
+        """
+        from playlist.sql import tables
+
+        staged = [tables[self.name][name] for name in table_names]
+
+        with self.__lock:
+            if not self.__staging_depth:
+                raw = sqlite3.connect(':memory:', check_same_thread=False)
+                self.__staging_engine = sqlalchemy.create_engine(
+                    'sqlite://',
+                    creator=lambda: raw,
+                    poolclass=sqlalchemy.pool.StaticPool,
+                )
+                # The pool hands the one connection to every checkout, so
+                # the checkouts are serialized here. A plain lock, as a
+                # checkout can be checked in by another thread.
+                turn = threading.Lock()
+                sqlalchemy.event.listen(
+                    self.__staging_engine,
+                    'checkout',
+                    lambda *args: turn.acquire()
+                )
+                sqlalchemy.event.listen(
+                    self.__staging_engine,
+                    'checkin',
+                    lambda *args: turn.release()
+                )
+            self.__staging_depth += 1
+            engine = self.__staging_engine
+            for table in staged:
+                if table not in self.__staging_binds:
+                    table.__table__.create(engine, checkfirst=True)
+                    self.__staging_binds[table] = engine
+
+        try:
+            yield engine
+        finally:
+            with self.__lock:
+                self.__staging_depth -= 1
+                if not self.__staging_depth:
+                    self.__staging_binds.clear()
+                    self.__staging_engine.dispose()
+                    del self.__staging_engine
+
+    def session(self, label: typing.Optional[str]=None) -> SQLSession:
         """
         Return the context manager to handle construction of a session.
 
@@ -398,11 +1140,67 @@ class DBConnection(metaclass=DBConnectionMeta):
         It also will close the session when the block is completed, returning
         the resources from the session back to the connection pool.
 
+        Inside a :py:meth:`unit_of_work` block, the unit of work's session
+        manager is returned instead, so the session is shared.
+
+        Args:
+            label (Optional[str]): The name the session's metrics are
+                recorded under.
+
         Returns:
             SQLSession: A SQLAlchemy session context manager.
 
         """
-        return SQLSession(self)
+        try:
+            return self.__scope.manager
+        except AttributeError:
+            return SQLSession(self, label)
+
+    @contextlib.contextmanager
+    def unit_of_work(
+        self,
+        label: str='unit_of_work'
+    ) -> typing.Iterator[sqlalchemy.orm.session.Session]:
+        """
+        Share one session and transaction across a logical operation.
+
+        Every session requested from this connection by the current thread
+        while the block is open -- including those made by sessionized
+        calls -- uses the same session, and the transaction is committed
+        (or rolled back) once, when the block exits. Nested units of work
+        join the outermost one.
+
+        Example:
+            Load and record in a single transaction::
+
+                with conn.trackdb.unit_of_work():
+                    sqllib.load_tracks(tracks)
+                    sqllib.record_play_history(updates)
+
+        Note:
+            The scope is thread-local, so calls handed off to an executor
+            run in their own sessions.
+
+        Args:
+            label (str): The name the shared session's metrics are recorded
+                under.
+
+        Yields:
+            sqlalchemy.orm.session.Session: The shared session.
+        """
+        try:
+            manager = self.__scope.manager
+            owner = False
+        except AttributeError:
+            manager = self.__scope.manager = SQLSession(self, label)
+            owner = True
+
+        try:
+            with manager as session:
+                yield session
+        finally:
+            if owner:
+                del self.__scope.manager
 
     def sessionize(
         self
@@ -439,7 +1237,10 @@ class DBConnection(metaclass=DBConnectionMeta):
             Callable: The decorated function, generator, or coroutine.
         """
         def sessionize_this(func: typing.Callable) -> typing.Callable:
-            return sessionizer(self.session, func)
+            return sessionizer(
+                functools.partial(self.session, label=func.__qualname__),
+                func
+            )
         return sessionize_this
 
     def __repr__(self) -> str:
@@ -451,7 +1252,12 @@ class MainConnectionConfig(config.Base):
     """Class designed to manage the database connectors for the system."""
 
     def __init__(self) -> None:
-        """Initialize the MainConnectionConfig."""
+        """
+        Initialize the MainConnectionConfig.
+
+        Every database named in the ``db.databases`` settings is available
+        as an attribute, as is any database added with :py:meth:`register`.
+        """
         super().__init__(
             attrs=(
                 {
@@ -459,6 +1265,15 @@ class MainConnectionConfig(config.Base):
                     'func': functools.partial(DBConnection, name='trackdb'),
                     'doc': 'The Track DB'
                 },
+                *(
+                    {
+                        'name': name,
+                        'func': functools.partial(DBConnection, name=name),
+                        'doc': f'The {name} database.',
+                    }
+                    for name in get_db_names()
+                    if name != 'trackdb'
+                ),
                 {
                     'name': 'bakery',
                     'func': sqlalchemy.ext.baked.bakery,
@@ -467,6 +1282,25 @@ class MainConnectionConfig(config.Base):
             )
         )
 
+    def register(self, name: str, doc: typing.Optional[str]=None) -> None:
+        """
+        Make another database available by name.
+
+        Its settings come from ``db.databases.<name>``, if present.
+
+        Args:
+            name (str): The name of the database.
+            doc (Optional[str]): The docstring for the database attribute.
+        """
+        if name in self:
+            return
+
+        self._set_attr(
+            name=name,
+            func=functools.partial(DBConnection, name=name),
+            doc=doc or f'The {name} database.'
+        )
+
     def __reduce__(self) -> typing.Tuple[
         type,
         typing.Tuple,
@@ -10,19 +10,27 @@ import typing
 import sqlalchemy  # NOQA
 
 from playlist.core import config, const, lib, logger
+from playlist.sql import _conn
+
+LOG = logging.getLogger(__name__)
 
 
 class DBTablesMeta(type):
     _lock = threading.RLock()
 
     def __call__(cls, name: str) -> 'DBTables':
-        cls.__instance: 'DBTables'
+        cls.__instances: typing.Dict[str, 'DBTables']
         with DBTablesMeta._lock:
             try:
-                return cls.__instance
+                instances = cls.__instances
             except AttributeError:
-                cls.__instance = super().__call__(name)
-                return cls.__instance
+                instances = cls.__instances = {}
+
+            try:
+                return instances[name]
+            except KeyError:
+                instances[name] = super().__call__(name)
+                return instances[name]
 
 
 class DBTables(metaclass=DBTablesMeta):
@@ -36,6 +44,11 @@ class DBTables(metaclass=DBTablesMeta):
         from playlist.sql import conn
         return conn[self.name]
 
+    @property
+    def definitions(self) -> typing.Any:
+        """The table definitions used by this database."""
+        return config.db[self.conn.settings['tables']]
+
     def gen_cols(
         self,
         columndefs: typing.Sequence[typing.Mapping[str, typing.Any]],
@@ -179,6 +192,25 @@ class DBTables(metaclass=DBTablesMeta):
                 f"sqlalchemy.orm.relationship({rel_args!r}, {kwargs})"
             ))
 
+    def gen_indexes(
+        self,
+        indexdefs: typing.Sequence[typing.Mapping[str, typing.Any]]
+    ) -> typing.Generator[str, None, None]:
+        for indexdef in indexdefs:
+            idx_args = [repr(indexdef['name'])]
+            idx_args.extend(repr(col) for col in indexdef['columns'])
+
+            with contextlib.suppress(KeyError):
+                idx_args.append(f"unique={indexdef['unique']!r}")
+
+            # Partial indexes only cover the rows matching a SQL condition.
+            with contextlib.suppress(KeyError):
+                idx_args.append(
+                    f"sqlite_where=sqlalchemy.text({indexdef['where']!r})"
+                )
+
+            yield f"sqlalchemy.Index({', '.join(idx_args)})"
+
     def gen_repr(
         self,
         attrs: typing.Iterator[str]
@@ -219,7 +251,14 @@ class DBTables(metaclass=DBTablesMeta):
         ))
         yield ''
         yield f"    __tablename__ = {tabledef['tablename']!r}"
-        yield "    __table_args__ = {'keep_existing': True}"
+        if tabledef.get('indexes'):
+            yield '    __table_args__ = ('
+            for index in self.gen_indexes(tabledef['indexes']):
+                yield f'        {index},'
+            yield "        {'keep_existing': True},"
+            yield '    )'
+        else:
+            yield "    __table_args__ = {'keep_existing': True}"
         yield f"    __module__ = '{module}'"
 
         yield ''
@@ -255,12 +294,14 @@ class DBTables(metaclass=DBTablesMeta):
         yield '    sqlalchemy.schema.MetaData(),'
         for col in self.gen_cols(tabledef['columns'], add_name=True):
             yield f'    {col},'
+        for index in self.gen_indexes(tabledef.get('indexes', ())):
+            yield f'    {index},'
         yield '    keep_existing=True,'
         yield ')'
 
     @logger.logged
     def _make_table(self, table_name: str, log: logging.Logger) -> typing.Any:
-        with config.db[self.name][table_name] as table_config:
+        with self.definitions[table_name] as table_config:
             tabledef = copy.deepcopy(table_config)
 
         try:
@@ -294,6 +335,140 @@ class DBTables(metaclass=DBTablesMeta):
 
         return table
 
+    def _create_indexes(
+        self,
+        table: typing.Any,
+        engine: sqlalchemy.engine.Engine
+    ) -> None:
+        # Tables that already existed before an index was added to their
+        # definition won't get it from create(), so add any missing ones.
+        # Promoted tables carry their indexes under generation suffixed
+        # names, <index>__<generation>, which count as the index too.
+        existing = {
+            index['name'].split('__')[0]
+            for index in sqlalchemy.inspect(engine).get_indexes(
+                table.__table__.name
+            )
+        }
+        for index in table.__table__.indexes:
+            if index.name not in existing:
+                index.create(engine)
+
+    def _set_aside(
+        self,
+        table_name: str,
+        table: typing.Any,
+        engine: sqlalchemy.engine.Engine
+    ) -> None:
+        # Columns can be added to an existing table, but its primary key
+        # can't change and required columns can't be added or left out, so
+        # those changes need the table rebuilt.
+        name = table.__table__.name
+        inspector = sqlalchemy.inspect(engine)
+        if name not in inspector.get_table_names():
+            return
+
+        existing = {
+            column['name']: column
+            for column in inspector.get_columns(name)
+        }
+        primary_key = set(
+            inspector.get_pk_constraint(name)['constrained_columns']
+        )
+        rebuild = (
+            primary_key != {
+                column.name
+                for column in table.__table__.primary_key.columns
+            }
+            or any(
+                not column.nullable
+                for column in table.__table__.c
+                if column.name not in existing
+            )
+            or any(
+                not column['nullable'] and column['default'] is None
+                for column in existing.values()
+                if column['name'] not in table.__table__.c
+            )
+        )
+        if not rebuild:
+            return
+
+        with self.definitions[table_name] as table_config:
+            transient = table_config.get('transient', False)
+
+        if transient:
+            engine.execute(f'DROP TABLE "{name}"')
+            return
+
+        # Anything else is kept as <tablename>__legacy for its data to be
+        # migrated. Index names are global, so its indexes are dropped.
+        legacy = f'{name}__legacy'
+        for index in inspector.get_indexes(name):
+            engine.execute(f'DROP INDEX "{index["name"]}"')
+        engine.execute(f'DROP TABLE IF EXISTS "{legacy}"')
+        engine.execute(f'ALTER TABLE "{name}" RENAME TO "{legacy}"')
+        LOG.warning(
+            f'Moved {name} to {legacy}, as it does not match its definition.'
+        )
+
+    def _add_columns(
+        self,
+        table: typing.Any,
+        engine: sqlalchemy.engine.Engine
+    ) -> None:
+        # Likewise, add columns that were added to the definition after the
+        # table was created. Only nullable columns can be added this way.
+        existing = {
+            column['name']
+            for column in sqlalchemy.inspect(engine).get_columns(
+                table.__table__.name
+            )
+        }
+        for column in table.__table__.c:
+            if column.name not in existing:
+                spec = sqlalchemy.schema.CreateColumn(column).compile(engine)
+                engine.execute(
+                    f'ALTER TABLE "{table.__table__.name}" ADD COLUMN {spec}'
+                )
+
+    def _create_views(
+        self,
+        table_name: str,
+        table: typing.Any,
+        engine: sqlalchemy.engine.Engine
+    ) -> None:
+        with self.definitions[table_name] as table_config:
+            dimdefs = copy.deepcopy(table_config.get('dimensions'))
+
+        if not dimdefs:
+            return
+
+        # The view presents the dimension keys as the names they stand for,
+        # in the shape the table had before it was normalized.
+        by_key = {dimdef['key']: dimdef for dimdef in dimdefs}
+        joined = table.__table__
+        columns = []
+        for column in table.__table__.c:
+            try:
+                dimdef = by_key[column.name]
+            except KeyError:
+                columns.append(column)
+                continue
+
+            dimension = self.__get_table(dimdef['table']).__table__.alias(
+                dimdef['name']
+            )
+            joined = joined.outerjoin(dimension, dimension.c.id == column)
+            columns.append(dimension.c.name.label(dimdef['name']))
+
+        view = f'{table.__table__.name}_full'
+        select = sqlalchemy.select(columns).select_from(joined)
+        engine.execute(f'DROP VIEW IF EXISTS "{view}"')
+        engine.execute(
+            f'CREATE VIEW "{view}" AS {select.compile(engine)}'
+        )
+
     def __get_table(self, name: str) -> typing.Any:
         with self._lock:
             try:
@@ -310,11 +485,15 @@ class DBTables(metaclass=DBTablesMeta):
                             table = self._make_table(name)
 
                         with self.conn.engine as engine:
+                            self._set_aside(name, table, engine)
                             if not engine.has_table(name):
                                 table.__table__.create(
                                     engine,
                                     checkfirst=True
                                 )
+                            self._add_columns(table, engine)
+                            self._create_indexes(table, engine)
+                            self._create_views(name, table, engine)
                         self.__tables[name] = table
                         break
 
@@ -322,6 +501,17 @@ class DBTables(metaclass=DBTablesMeta):
                 table.__table__.create(engine, checkfirst=True)
             return table
 
+    def reset(self) -> None:
+        """
+        Forget the tables resolved so far.
+
+        Resolving a table checks it against the database file, creating or
+        migrating it, so this is needed once the connection is pointed at
+        another file.
+        """
+        with self._lock:
+            self.__tables.clear()
+
     def __getattr__(self, name: str) -> typing.Any:
         return self.__get_table(name)
 
@@ -329,7 +519,7 @@ class DBTables(metaclass=DBTablesMeta):
         return self.__get_table(name)
 
     def __repr__(self) -> str:
-        name_iter = config.db[self.name].keys()
+        name_iter = self.definitions.keys()
 
         with self._lock:
             table_iter = (
@@ -351,13 +541,31 @@ class MainTablesConfig(config.Base):
         super().__init__(
             attrs=(
                 {
-                    'name': 'trackdb',
-                    'func': functools.partial(DBTables, name='trackdb'),
-                    'doc': 'The sqlite trackdb database tables.',
-                },
+                    'name': name,
+                    'func': functools.partial(DBTables, name=name),
+                    'doc': f'The sqlite {name} database tables.',
+                }
+                for name in _conn.get_db_names()
             )
         )
 
+    def register(self, name: str, doc: typing.Optional[str]=None) -> None:
+        """
+        Make the tables of another database available by name.
+
+        Args:
+            name (str): The name of the database.
+            doc (Optional[str]): The docstring for the tables attribute.
+        """
+        if name in self:
+            return
+
+        self._set_attr(
+            name=name,
+            func=functools.partial(DBTables, name=name),
+            doc=doc or f'The sqlite {name} database tables.'
+        )
+
     def __reduce__(self) -> typing.Tuple[
         type,
         typing.Tuple,
@@ -0,0 +1,267 @@
+"""
+Library of Arrow/Parquet functions to store the track library columnar.
+
+Tables are exported to a directory of Parquet files per table under
+``BasePath.DATA / 'parquet'``, kept apart for each database file, each file
+holding one partition of rows in primary key order. The Arrow schema of
+each table is derived from its YAML table definition, so the files keep the
+same column types as the database.
+Reading them back yields Arrow tables, which convert to pandas frames
+without copying the column buffers where the types allow it.
+
+**********
+Module API
+**********
+
+.. autosummary::
+    :nosignatures:
+
+    arrow_schema
+    get_parquet_path
+    export_table
+    export_library
+    read_table
+    read_frame
+"""
+__all__ = (
+    'arrow_schema',
+    'get_parquet_path',
+    'export_table',
+    'export_library',
+    'read_table',
+    'read_frame',
+)
+
+import copy
+import pathlib
+import shutil
+import typing
+
+import pandas
+import pyarrow
+import pyarrow.parquet
+import sqlalchemy
+
+from playlist.core import const
+from playlist.sql import conn, tables
+
+ARROW_TYPES = {
+    'Integer': pyarrow.int64(),
+    'String': pyarrow.string(),
+    'DateTime': pyarrow.timestamp('us'),
+    'Interval': pyarrow.duration('us'),
+    'Float': pyarrow.float64(),
+    'Boolean': pyarrow.bool_(),
+    'LargeBinary': pyarrow.binary(),
+}
+
+# The tables that make up the track library.
+LIBRARY = (
+    'Tracks',
+    'PlayHistory',
+    'PlayHistoryDaily',
+    'Artists',
+    'Albums',
+    'Genres',
+)
+
+ROWS_PER_FILE = 50_000
+
+
+def arrow_schema(table_name: str, db: str='trackdb') -> pyarrow.Schema:
+    """
+    Build the Arrow schema for a table from its YAML table definition.
+
+    Args:
+        table_name (str): The name of the table definition.
+        db (str): The database the table belongs to.
+
+    Returns:
+        pyarrow.Schema: The schema, with the SQL table name in its metadata.
+    """
+    with tables[db].definitions[table_name] as table_config:
+        tabledef = copy.deepcopy(table_config)
+
+    return pyarrow.schema(
+        [
+            pyarrow.field(
+                coldef['name'],
+                ARROW_TYPES[coldef['type']],
+                nullable=coldef.get(
+                    'nullable',
+                    not coldef.get('primary_key', False)
+                )
+            )
+            for coldef in tabledef['columns']
+        ],
+        metadata={'tablename': tabledef['tablename']}
+    )
+
+
+def _column_array(
+    values: typing.Sequence[typing.Any],
+    field: pyarrow.Field
+) -> pyarrow.Array:
+    if pyarrow.types.is_string(field.type):
+        # A column that was numeric in an older database keeps the numbers
+        # SQLite stored in it as numbers.
+        values = [
+            value if value is None or isinstance(value, str) else str(value)
+            for value in values
+        ]
+    try:
+        return pyarrow.array(values, type=field.type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as exc:
+        raise ValueError(
+            f'The {field.name} column has values that are not {field.type}: '
+            f'{exc}'
+        ) from exc
+
+
+def _write_part(
+    rows: typing.Sequence[typing.Sequence[typing.Any]],
+    schema: pyarrow.Schema,
+    filepath: pathlib.Path
+) -> None:
+    columns = zip(*rows) if rows else ([] for _ in schema)
+    data = pyarrow.Table.from_arrays(
+        [
+            _column_array(values, field)
+            for values, field in zip(columns, schema)
+        ],
+        schema=schema
+    )
+    pyarrow.parquet.write_table(data, str(filepath))
+
+
+def get_parquet_path(table_name: str) -> pathlib.Path:
+    """
+    Get the directory holding the Parquet files for a table.
+
+    Exports are kept apart for each database file, like snapshots.
+    """
+    return (
+        const.BasePath.DATA.value / 'parquet' / conn.trackdb.path.stem /
+        table_name
+    )
+
+
+@conn.trackdb.sessionize()
+def export_table(
+    table_name: str,
+    rows_per_file: int=ROWS_PER_FILE,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> pathlib.Path:
+    """
+    Export a table to a directory of Parquet files.
+
+    Rows are streamed out of the database in primary key order, one file
+    per ``rows_per_file`` rows. The new files are written beside the old
+    export and swapped in once complete, so readers never see a partial
+    export.
+
+    Args:
+        table_name (str): The name of the table definition to export.
+        rows_per_file (int): The number of rows in each partition file.
+
+    Returns:
+        pathlib.Path: The directory the table was exported to.
+
+    Raises:
+        ValueError: If a column has values that don't convert to its type,
+            such as text in an Integer column; the previous export is kept.
+    """
+    table = tables.trackdb[table_name].__table__
+    schema = arrow_schema(table_name)
+
+    path = get_parquet_path(table_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = path.with_name(f'{path.name}.tmp')
+    shutil.rmtree(str(staging), ignore_errors=True)
+    staging.mkdir()
+
+    query = sqlalchemy.select(
+        [table.c[name] for name in schema.names]
+    ).order_by(*table.primary_key.columns)
+    result = session.execute(query)
+
+    part = 0
+    for rows in iter(lambda: result.fetchmany(rows_per_file), []):
+        _write_part(rows, schema, staging / f'part-{part:05d}.parquet')
+        part += 1
+
+    if not part:
+        # Keep the schema around even when the table is empty.
+        _write_part([], schema, staging / 'part-00000.parquet')
+
+    previous = path.with_name(f'{path.name}.old')
+    if path.exists():
+        path.rename(previous)
+    staging.rename(path)
+    shutil.rmtree(str(previous), ignore_errors=True)
+
+    print(f'Exported {table_name} to {part} Parquet file(s) in {path}')
+    return path
+
+
+def export_library(
+    rows_per_file: int=ROWS_PER_FILE
+) -> typing.Dict[str, pathlib.Path]:
+    """
+    Export all of the track library tables to Parquet.
+
+    Returns:
+        Dict[str, pathlib.Path]: The export directory of each table.
+    """
+    return {
+        table_name: export_table(table_name, rows_per_file)
+        for table_name in LIBRARY
+    }
+
+
+def read_table(
+    table_name: str,
+    columns: typing.Optional[typing.Sequence[str]]=None
+) -> pyarrow.Table:
+    """
+    Read an exported table back as an Arrow table.
+
+    The files are memory-mapped rather than read into buffers.
+
+    Args:
+        table_name (str): The name of the table definition to read.
+        columns (Optional[Sequence[str]]): Only read these columns.
+
+    Returns:
+        pyarrow.Table: The table data.
+    """
+    return pyarrow.parquet.read_table(
+        str(get_parquet_path(table_name)),
+        columns=columns,
+        memory_map=True
+    )
+
+
+def read_frame(
+    table_name: str,
+    columns: typing.Optional[typing.Sequence[str]]=None
+) -> pandas.DataFrame:
+    """
+    Read an exported table back as a pandas DataFrame.
+
+    Each column becomes its own block, so numeric columns without nulls
+    are handed to pandas without copying, and the Arrow buffers are
+    released as they are converted.
+
+    Args:
+        table_name (str): The name of the table definition to read.
+        columns (Optional[Sequence[str]]): Only read these columns.
+
+    Returns:
+        pandas.DataFrame: The table data.
+    """
+    return read_table(table_name, columns).to_pandas(
+        split_blocks=True,
+        self_destruct=True
+    )
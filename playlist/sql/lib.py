@@ -1,11 +1,178 @@
 """Library of SQL functions to operate on the database."""
 
+import asyncio
+import collections
+import contextlib
+import copy
+import datetime
+import itertools
+import threading
 import typing
+import uuid
 
+import arrow
 import sqlalchemy
 
+from playlist.core import lib as corelib
 from playlist.sql import conn, tables
 
+# Columns whose changes are recorded as play events.
+HISTORY_COLUMNS = ('playCount', 'recentTimestamp')
+
+# The field of a diff update listing the columns that changed, see
+# playlist.pd.lib.get_ins_upd_del.
+CHANGED = '_changed'
+
+# The field of a diff update holding the previous values of the columns
+# that changed.
+PREVIOUS = '_previous'
+
+# Stay well under SQLite's limit on the number of bound parameters.
+CHUNK_SIZE = 500
+
+# Generations of the tracks table kept around the live one by promotion.
+TRACKS = 'tracks'
+NEXT_TRACKS = 'tracks__next'
+PREVIOUS_TRACKS = 'tracks__prev'
+PROMOTE_BATCH_SIZE = 10_000
+
+# Tracks read per batch when streaming them out of the database.
+READ_BATCH_SIZE = 5_000
+
+# Loads intern names in the database file, which takes a single writer, so
+# concurrent loads take turns rather than wait on its lock.
+_LOAD_LOCK = threading.Lock()
+
+TOMBSTONE_DEFAULTS = {
+    'retention_days': 90,
+    'batch_size': 500,
+    'pause': 0.1,
+}
+
+STAGING_DEFAULTS = {
+    'mode': 'auto',
+    'tables': ['NewTracks'],
+    'memory_budget_mb': 256,
+    'row_bytes': 2048,
+}
+
+
+def _chunks(
+    iterable: typing.Iterable[typing.Any],
+    size: int=CHUNK_SIZE
+) -> typing.Generator[typing.List[typing.Any], None, None]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@conn.trackdb.sessionize()
+def count_tracks(*, session: sqlalchemy.orm.session.Session) -> int:
+    """Count the tracks in the library."""
+    return session.query(
+        sqlalchemy.func.count()
+    ).select_from(tables.trackdb.Tracks).scalar()
+
+
+@contextlib.contextmanager
+def staging() -> typing.Iterator[bool]:
+    """
+    Stage the tables refilled by an import, in memory if they fit.
+
+    The ``db.staging`` settings choose where the tables are staged. In
+    ``auto`` mode the library size is estimated from the number of tracks
+    already stored, and the tables are staged in memory when that fits
+    within ``memory_budget_mb``.
+
+    Yields:
+        bool: True if the tables are staged in memory.
+    """
+    staging_settings = dict(STAGING_DEFAULTS)
+    staging_settings.update(conn.trackdb.settings.get('staging') or {})
+
+    mode = staging_settings['mode']
+    if mode == 'auto':
+        estimate = count_tracks() * staging_settings['row_bytes']
+        in_memory = estimate <= staging_settings['memory_budget_mb'] << 20
+    else:
+        in_memory = mode == 'memory'
+
+    if not in_memory:
+        print('Staging the import in the database file.')
+        yield False
+        return
+
+    print('Staging the import in memory.')
+    with conn.trackdb.staging(staging_settings['tables']):
+        yield True
+
+
+@conn.trackdb.sessionize()
+def migrate_track_keys(*, session: sqlalchemy.orm.session.Session) -> None:
+    """
+    Move the data of tables keyed by track id over to track keys.
+
+    Tables that predate track keys no longer match their definitions, and
+    are set aside as ``<tablename>__legacy`` when first used. This interns
+    their track ids and copies their rows into the new tables.
+    """
+    # Resolve every table up front, as the migration writes to the database.
+    TrackKeys = tables.trackdb.TrackKeys.__table__
+    migrations = (
+        (tables.trackdb.Tracks.__table__, 'id'),
+        (tables.trackdb.PlayHistory.__table__, 'trackId'),
+        (tables.trackdb.PlayHistoryDaily.__table__, 'trackId'),
+    )
+
+    inspector = sqlalchemy.inspect(session.connection())
+    existing = set(inspector.get_table_names())
+    for table, id_column in migrations:
+        legacy_name = f'{table.name}__legacy'
+        if legacy_name not in existing:
+            continue
+
+        legacy_columns = {
+            column['name']
+            for column in inspector.get_columns(legacy_name)
+        }
+        columns = [
+            column.name
+            for column in table.c
+            if column.name in legacy_columns and column.name != 'trackKey'
+        ]
+        legacy = sqlalchemy.table(
+            legacy_name,
+            *(sqlalchemy.column(name) for name in legacy_columns)
+        )
+        track_id = legacy.c[id_column]
+
+        session.execute(
+            TrackKeys.insert().prefix_with('OR IGNORE').from_select(
+                ['id'],
+                sqlalchemy.select([track_id]).where(
+                    track_id.isnot(None)
+                ).distinct()
+            )
+        )
+        track_key = sqlalchemy.select([TrackKeys.c.trackKey]).where(
+            TrackKeys.c.id == track_id
+        ).as_scalar()
+        result = session.execute(
+            table.insert().from_select(
+                columns + ['trackKey'],
+                sqlalchemy.select(
+                    [legacy.c[name] for name in columns] + [track_key]
+                ).where(track_id.isnot(None))
+            )
+        )
+        session.execute(f'DROP TABLE "{legacy_name}"')
+        print(
+            f'Migrated {result.rowcount} rows of {table.name} to track keys.'
+        )
+
 
 @conn.trackdb.sessionize()
 def erase_new_tracks(*, session: sqlalchemy.orm.session.Session):
@@ -13,20 +180,164 @@ def erase_new_tracks(*, session: sqlalchemy.orm.session.Session):
     session.query(tables.trackdb.NewTracks).delete()
 
 
+def get_dimensions(table_name: str) -> typing.List[typing.Dict[str, str]]:
+    """
+    Get the dimension columns of a table definition.
+
+    Each dimension has the ``name`` of the free-text column it replaces,
+    the ``key`` column holding the surrogate key, and the dimension
+    ``table`` definition the key refers to.
+    """
+    with tables.trackdb.definitions[table_name] as table_config:
+        return copy.deepcopy(table_config.get('dimensions')) or []
+
+
+def table_schema(table_name: str) -> typing.Dict[str, str]:
+    """
+    Get the YAML column types of a table definition, by column name.
+
+    These are the types :py:func:`playlist.pd.lib.get_ins_upd_del` casts
+    the diff results of the table's data to.
+    """
+    with tables.trackdb.definitions[table_name] as table_config:
+        return {
+            coldef['name']: coldef['type']
+            for coldef in table_config['columns']
+        }
+
+
+def table_compare(
+    table_name: str
+) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """
+    Get the compare policies of a table definition, by column name.
+
+    The policies are set by the ``compare`` key of the columns, see
+    :py:func:`playlist.pd.lib.compare_policies`; columns without one are
+    left out.
+    """
+    with tables.trackdb.definitions[table_name] as table_config:
+        return {
+            coldef['name']: copy.deepcopy(coldef['compare'])
+            for coldef in table_config['columns']
+            if coldef.get('compare')
+        }
+
+
+@conn.trackdb.sessionize()
+def intern_names(
+    table_name: str,
+    names: typing.Iterable[typing.Optional[str]],
+    name_column: str='name',
+    key_column: str='id',
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Dict[str, int]:
+    """
+    Get the surrogate keys of names in a dimension table, adding new ones.
+
+    Args:
+        table_name (str): The dimension table definition.
+        names (Iterable[Optional[str]]): The names to intern. ``None`` is
+            skipped.
+        name_column (str): The column holding the names.
+        key_column (str): The column holding the surrogate keys.
+
+    Returns:
+        Dict[str, int]: The key of each name.
+    """
+    Dimension = tables.trackdb[table_name]
+    names_col = getattr(Dimension, name_column)
+    keys_col = getattr(Dimension, key_column)
+    wanted = {name for name in names if name is not None}
+
+    keys: typing.Dict[str, int] = {}
+    if not wanted:
+        return keys
+
+    session.execute(
+        Dimension.__table__.insert().prefix_with('OR IGNORE'),
+        [{name_column: name} for name in wanted]
+    )
+    for chunk in _chunks(wanted):
+        query = session.query(names_col, keys_col).filter(
+            names_col.in_(chunk)
+        )
+        keys.update(query)
+
+    return keys
+
+
+def _intern_tracks(
+    tracks: typing.List[typing.Dict[str, typing.Any]],
+    dimdefs: typing.List[typing.Dict[str, str]],
+    session: sqlalchemy.orm.session.Session
+) -> None:
+    by_table: typing.Dict[str, typing.List[typing.Dict[str, str]]] = {}
+    for dimdef in dimdefs:
+        by_table.setdefault(dimdef['table'], []).append(dimdef)
+
+    for table_name, table_dimdefs in by_table.items():
+        keys = intern_names(
+            table_name,
+            (
+                track.get(dimdef['name'])
+                for track in tracks
+                for dimdef in table_dimdefs
+            ),
+            session=session
+        )
+        for track in tracks:
+            for dimdef in table_dimdefs:
+                name = track.pop(dimdef['name'], None)
+                track[dimdef['key']] = keys.get(name)
+
+
+def load_tracks(tracks: typing.List[typing.Dict[str, typing.Any]]) -> None:
+    """
+    Load tracks into table in the database.
+
+    The track ids and the names in the dimension columns are interned
+    first, so the tracks are stored with their surrogate keys. Loads run
+    one at a time, each committed before the next starts.
+    """
+    with _LOAD_LOCK:
+        _load_tracks(tracks)
+
+
 @conn.trackdb.sessionize()
-def load_tracks(
+def _load_tracks(
     tracks: typing.List[typing.Dict[str, typing.Any]],
     *,
     session: sqlalchemy.orm.session.Session
 ) -> None:
-    """Load tracks into table in the database."""
+    """Intern and insert a batch of tracks, see load_tracks."""
+    # Resolve every table up front, as the interning writes to the database.
+    NewTracks = tables.trackdb.NewTracks
+    tables.trackdb.TrackKeys
+    dimdefs = get_dimensions('NewTracks')
+    for dimdef in dimdefs:
+        tables.trackdb[dimdef['table']]
+
+    tracks = [dict(track) for track in tracks]
+    track_keys = intern_names(
+        'TrackKeys',
+        (track['id'] for track in tracks),
+        name_column='id',
+        key_column='trackKey',
+        session=session
+    )
+    for track in tracks:
+        track['trackKey'] = track_keys[track['id']]
+    _intern_tracks(tracks, dimdefs, session)
+
     inserts = (
         {
             key: value
             if key not in {
                 'creationTimestamp',
                 'lastModifiedTimestamp',
-                'recentTimestamp',
+                'lastRatingChangeTimestamp',
                 'recentTimestamp'
             }
             else value.datetime
@@ -34,46 +345,221 @@ def load_tracks(
         }
         for track in tracks
     )
-    session.bulk_insert_mappings(tables.trackdb.NewTracks, inserts)
+    session.bulk_insert_mappings(NewTracks, inserts)
+
+
+def _select_tracks(
+    table: sqlalchemy.Table,
+    *criteria: typing.Any
+) -> sqlalchemy.sql.Select:
+    """
+    Select the columns of a tracks table that the import fills in.
+
+    The tracks come in primary key order, which costs nothing as the key is
+    the rowid, and lets the sorted diff engine skip sorting them.
+    """
+    names = tables.trackdb.NewTracks.__table__.c.keys()
+    return sqlalchemy.select(
+        [table.c[name] for name in names if name in table.c]
+    ).where(
+        sqlalchemy.and_(*criteria)
+    ).order_by(*table.primary_key.columns)
+
+
+@conn.trackdb.sessionize()
+def iter_current_tracks(
+    batch_size: int=READ_BATCH_SIZE,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Iterator[typing.List[typing.Dict[str, typing.Any]]]:
+    """
+    Stream the tracks of the current import, in batches.
+
+    Args:
+        batch_size (int): The number of tracks in each batch.
+
+    Yields:
+        List[Dict[str, Any]]: A batch of tracks.
+    """
+    result = session.execute(
+        _select_tracks(tables.trackdb.NewTracks.__table__)
+    )
+    for rows in iter(lambda: result.fetchmany(batch_size), []):
+        yield [dict(row) for row in rows]
+
+
+@conn.trackdb.sessionize()
+def iter_previous_tracks(
+    batch_size: int=READ_BATCH_SIZE,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Iterator[typing.List[typing.Dict[str, typing.Any]]]:
+    """
+    Stream the live tracks of the previous import, in batches.
+
+    Args:
+        batch_size (int): The number of tracks in each batch.
+
+    Yields:
+        List[Dict[str, Any]]: A batch of tracks.
+    """
+    Tracks = tables.trackdb.Tracks.__table__
+    result = session.execute(
+        _select_tracks(Tracks, Tracks.c.deletedTimestamp.is_(None))
+    )
+    for rows in iter(lambda: result.fetchmany(batch_size), []):
+        yield [dict(row) for row in rows]
+
+
+def _fetch_columns(
+    result: sqlalchemy.engine.ResultProxy,
+    batch_size: int
+) -> typing.Iterator[typing.Dict[str, typing.List[typing.Any]]]:
+    """Fetch the rows of a result in batches, transposed into columns."""
+    names = result.keys()
+    for rows in iter(lambda: result.fetchmany(batch_size), []):
+        yield dict(zip(names, map(list, zip(*rows))))
+
+
+def _concat_columns(
+    batches: typing.Iterable[typing.Dict[str, typing.List[typing.Any]]],
+    names: typing.Sequence[str]
+) -> typing.Dict[str, typing.List[typing.Any]]:
+    """Concatenate batches of columns, keeping the columns if empty."""
+    columns = {name: [] for name in names}
+    for batch in batches:
+        for name, values in batch.items():
+            columns[name].extend(values)
+    return columns
+
+
+@conn.trackdb.sessionize()
+def iter_current_columns(
+    batch_size: int=READ_BATCH_SIZE,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Iterator[typing.Dict[str, typing.List[typing.Any]]]:
+    """
+    Stream the tracks of the current import, in batches of columns.
+
+    Unlike :py:func:`iter_current_tracks`, no dict is built per track, so
+    the batches go into :py:func:`playlist.pd.lib.get_ins_upd_del_partitioned`
+    without being taken apart again.
+
+    Args:
+        batch_size (int): The number of tracks in each batch.
+
+    Yields:
+        Dict[str, List[Any]]: The values of each column in a batch.
+    """
+    result = session.execute(
+        _select_tracks(tables.trackdb.NewTracks.__table__)
+    )
+    yield from _fetch_columns(result, batch_size)
+
+
+@conn.trackdb.sessionize()
+def iter_previous_columns(
+    batch_size: int=READ_BATCH_SIZE,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Iterator[typing.Dict[str, typing.List[typing.Any]]]:
+    """
+    Stream the live tracks of the previous import, in batches of columns.
+
+    Args:
+        batch_size (int): The number of tracks in each batch.
+
+    Yields:
+        Dict[str, List[Any]]: The values of each column in a batch.
+    """
+    Tracks = tables.trackdb.Tracks.__table__
+    result = session.execute(
+        _select_tracks(Tracks, Tracks.c.deletedTimestamp.is_(None))
+    )
+    yield from _fetch_columns(result, batch_size)
+
+
+@conn.trackdb.sessionize()
+def get_current_columns(
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Dict[str, typing.List[typing.Any]]:
+    """
+    Get the tracks of the current import as columns.
+
+    The columns are there even when there are no tracks, so the diff still
+    knows the key field.
+    """
+    names = _select_tracks(tables.trackdb.NewTracks.__table__).c.keys()
+    return _concat_columns(iter_current_columns(session=session), names)
+
+
+@conn.trackdb.sessionize()
+def get_previous_columns(
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.Dict[str, typing.List[typing.Any]]:
+    """Get the live tracks of the previous import as columns."""
+    names = _select_tracks(tables.trackdb.Tracks.__table__).c.keys()
+    return _concat_columns(iter_previous_columns(session=session), names)
 
 
 @conn.trackdb.sessionize()
 def get_current_tracks(*, session: sqlalchemy.orm.session.Session):
-    query = conn.bakery(lambda s: s.query(tables.trackdb.NewTracks))
-    return [
-        {
-            key: value
-            for key, value in row.__dict__.items()
-            if key in {
-                col.name
-                for col in tables.trackdb.NewTracks.__table__.c
-            }
-        }
-        for row in query(session)
-    ]
+    return list(itertools.chain.from_iterable(
+        iter_current_tracks(session=session)
+    ))
 
 
 @conn.trackdb.sessionize()
 def get_previous_tracks(*, session: sqlalchemy.orm.session.Session):
-    query = conn.bakery(lambda s: s.query(tables.trackdb.Tracks))
-    return [
-        {
-            key: value
-            for key, value in row.__dict__.items()
-            if key in {
-                col.name
-                for col in tables.trackdb.NewTracks.__table__.c
-            }
-        }
-        for row in query(session)
-    ]
+    return list(itertools.chain.from_iterable(
+        iter_previous_tracks(session=session)
+    ))
 
 
 @conn.trackdb.sessionize()
-def set_password(username: str, password: str, *, session):
-    creds = tables.trackdb.Credentials(username=username, password=password)
+def set_password(
+    username: str,
+    password: str,
+    database: typing.Optional[str]=None,
+    *,
+    session
+):
+    creds = tables.trackdb.Credentials(
+        username=username,
+        password=password,
+        database=database
+    )
     print(creds)
-    session.add(creds)
+    session.merge(creds)
+
+
+@conn.trackdb.sessionize()
+def list_accounts(
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Get the accounts with stored credentials.
+
+    Returns:
+        List[Dict[str, Any]]: The ``username``, encrypted ``password`` and
+        ``database`` file of each account, by username. The ``database`` is
+        None for accounts using the default trackdb file.
+    """
+    Credentials = tables.trackdb.Credentials
+    return [
+        {
+            'username': creds.username,
+            'password': creds.password,
+            'database': creds.database,
+        }
+        for creds in session.query(Credentials).order_by(
+            Credentials.username
+        )
+    ]
 
 
 @conn.trackdb.sessionize()
@@ -81,3 +567,398 @@ def get_password(username: str, *, session) -> str:
     query = conn.bakery(lambda s: s.query(tables.trackdb.Credentials))
     query += lambda q: q.filter(username == sqlalchemy.bindparam('username'))
     return query(session).params(username=username).one().password
+
+
+@conn.trackdb.sessionize()
+def _build_next_tracks(*, session: sqlalchemy.orm.session.Session) -> int:
+    Tracks = tables.trackdb.Tracks
+    NewTracks = tables.trackdb.NewTracks
+
+    next_table = Tracks.__table__.tometadata(
+        sqlalchemy.MetaData(),
+        name=NEXT_TRACKS
+    )
+    session.execute(f'DROP TABLE IF EXISTS "{NEXT_TRACKS}"')
+    session.execute(sqlalchemy.schema.CreateTable(next_table))
+
+    columns = [
+        col.name
+        for col in Tracks.__table__.c
+        if col.name in NewTracks.__table__.c
+    ]
+    select = sqlalchemy.select(
+        [NewTracks.__table__.c[name] for name in columns]
+    )
+
+    if session.get_bind(NewTracks) is session.get_bind(Tracks):
+        session.execute(next_table.insert().from_select(columns, select))
+
+    else:
+        # The new tracks are staged in another database, so stream them
+        # across, converted by the column types on the way.
+        insert = next_table.insert()
+        result = session.execute(select)
+        for rows in iter(lambda: result.fetchmany(PROMOTE_BATCH_SIZE), []):
+            session.execute(insert, [dict(zip(columns, row)) for row in rows])
+
+    # Tracks that are no longer in the library carry over as tombstones.
+    tombstoned = {
+        'deleted': sqlalchemy.true(),
+        'deletedTimestamp': sqlalchemy.func.coalesce(
+            Tracks.deletedTimestamp,
+            sqlalchemy.literal(arrow.utcnow().datetime, sqlalchemy.DateTime)
+        ),
+    }
+    session.execute(
+        next_table.insert().from_select(
+            [col.name for col in Tracks.__table__.c],
+            sqlalchemy.select([
+                tombstoned.get(col.name, col)
+                for col in Tracks.__table__.c
+            ]).where(
+                Tracks.trackKey.notin_(
+                    sqlalchemy.select([next_table.c.trackKey])
+                )
+            )
+        )
+    )
+
+    # Index names are global, so each generation's indexes get a name of
+    # their own. They are built after the bulk load, before the swap, and
+    # follow the table through its renames.
+    generation = uuid.uuid4().hex[:8]
+    for index in Tracks.__table__.indexes:
+        session.execute(sqlalchemy.schema.CreateIndex(
+            sqlalchemy.Index(
+                f'{index.name}__{generation}',
+                *(next_table.c[col.name] for col in index.columns),
+                unique=index.unique,
+                **index.dialect_kwargs
+            )
+        ))
+
+    return session.query(
+        sqlalchemy.func.count()
+    ).select_from(next_table).filter(
+        next_table.c.deletedTimestamp.is_(None)
+    ).scalar()
+
+
+def _swap_tracks(
+    renames: typing.Sequence[typing.Tuple[str, str]],
+    drop: str
+) -> None:
+    with conn.trackdb.engine as engine:
+        # Dropping the table also drops its indexes, which is done before
+        # the swap, to keep the write lock for the renames alone.
+        with engine.connect() as connection:
+            connection.execute(f'DROP TABLE IF EXISTS "{drop}"')
+
+        raw = engine.raw_connection()
+        try:
+            dbapi_conn = raw.connection
+            isolation_level = dbapi_conn.isolation_level
+            # Take over the transaction handling, since the sqlite3 module
+            # would otherwise run the DDL outside of any transaction.
+            dbapi_conn.isolation_level = None
+            cursor = dbapi_conn.cursor()
+            try:
+                # Keep views that refer to tracks pointed at the live table,
+                # instead of following it to its new name.
+                cursor.execute('PRAGMA legacy_alter_table=ON')
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    for old_name, new_name in renames:
+                        cursor.execute(
+                            f'ALTER TABLE "{old_name}" RENAME TO "{new_name}"'
+                        )
+
+                except BaseException:
+                    cursor.execute('ROLLBACK')
+                    raise
+
+                cursor.execute('COMMIT')
+
+            finally:
+                cursor.execute('PRAGMA legacy_alter_table=OFF')
+                cursor.close()
+                dbapi_conn.isolation_level = isolation_level
+
+        finally:
+            raw.close()
+
+
+def promote_new_tracks() -> int:
+    """
+    Replace the tracks table with the new tracks, atomically.
+
+    The new tracks are bulk copied into a fresh table, which is then
+    swapped in for the tracks table in a single transaction, so readers
+    see either the whole old library or the whole new one. Tracks missing
+    from the new tracks are carried over as tombstones. The replaced
+    table is kept as the previous generation for
+    :py:func:`rollback_tracks`.
+
+    Note:
+        The swap needs the database write lock, so this must not be called
+        from inside an open session or unit of work.
+
+    Returns:
+        int: The number of tracks promoted.
+    """
+    # Resolve the tables before the swap takes the database lock.
+    tables.trackdb.Tracks
+    tables.trackdb.NewTracks
+
+    count = _build_next_tracks()
+    _swap_tracks(
+        ((TRACKS, PREVIOUS_TRACKS), (NEXT_TRACKS, TRACKS)),
+        drop=PREVIOUS_TRACKS
+    )
+    print(f'Promoted {count} new tracks.')
+    return count
+
+
+def rollback_tracks() -> None:
+    """
+    Restore the previous generation of the tracks table.
+
+    The generation being replaced becomes the previous one, so a rollback
+    can itself be undone by rolling back again.
+
+    Raises:
+        RuntimeError: If there is no previous generation to restore.
+    """
+    with conn.trackdb.engine as engine:
+        if not engine.has_table(PREVIOUS_TRACKS):
+            raise RuntimeError('There is no previous tracks table to restore.')
+
+    _swap_tracks(
+        (
+            (TRACKS, NEXT_TRACKS),
+            (PREVIOUS_TRACKS, TRACKS),
+            (NEXT_TRACKS, PREVIOUS_TRACKS),
+        ),
+        drop=NEXT_TRACKS
+    )
+    print('Restored the previous tracks.')
+
+
+@conn.trackdb.sessionize()
+def apply_updates(
+    updates: typing.List[typing.Dict[str, typing.Any]],
+    table_name: str='Tracks',
+    key: str='trackKey',
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> int:
+    """
+    Write the updates from a diff, only setting the columns that changed.
+
+    Updates are grouped by the columns that changed, as listed under
+    ``_changed``, and each group is written as one executemany of an
+    ``UPDATE`` setting just those columns. Updates without the list set
+    every column they have.
+
+    Args:
+        updates (List[Dict[str, Any]]): The updates.
+        table_name (str): The table to update.
+        key (str): The column the updates are matched up by.
+
+    Returns:
+        int: The number of rows updated.
+    """
+    table = tables.trackdb[table_name].__table__
+
+    groups: typing.Dict[
+        typing.Tuple[str, ...],
+        typing.List[typing.Dict[str, typing.Any]]
+    ] = collections.defaultdict(list)
+    for update in updates:
+        cols = tuple(
+            col
+            for col in update.get(CHANGED, update)
+            if col in table.c and col != key
+        )
+        if cols:
+            groups[cols].append({
+                'b_key': update[key],
+                **{f'b_{col}': update[col] for col in cols},
+            })
+
+    count = 0
+    for cols, params in groups.items():
+        # The bound parameters can't share the names of the columns set.
+        statement = table.update().where(
+            table.c[key] == sqlalchemy.bindparam('b_key')
+        ).values({col: sqlalchemy.bindparam(f'b_{col}') for col in cols})
+        count += session.execute(statement, params).rowcount
+
+    print(f'Updated {count} rows in {len(groups)} groups of columns.')
+    return count
+
+
+@conn.trackdb.sessionize()
+def purge_tombstones(
+    before: arrow.Arrow,
+    limit: int,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> int:
+    """
+    Remove up to ``limit`` tracks tombstoned before a point in time.
+
+    Returns:
+        int: The number of tombstones removed.
+    """
+    Tracks = tables.trackdb.Tracks
+    expired = sqlalchemy.select([Tracks.trackKey]).where(
+        Tracks.deletedTimestamp < before.datetime
+    ).limit(limit)
+
+    return session.query(Tracks).filter(
+        Tracks.trackKey.in_(expired)
+    ).delete(synchronize_session=False)
+
+
+@corelib.inject_loop
+async def compact_tombstones(*, loop: asyncio.AbstractEventLoop) -> int:
+    """
+    Remove tombstones older than the retention window.
+
+    The tombstones are removed in small batches, each in its own
+    transaction, pausing between batches so the compaction never holds the
+    database for long. The ``db.tombstones`` settings control the
+    retention window, batch size, and pause.
+
+    Returns:
+        int: The number of tombstones removed.
+    """
+    tombstone_settings = dict(TOMBSTONE_DEFAULTS)
+    tombstone_settings.update(conn.trackdb.settings.get('tombstones') or {})
+
+    before = arrow.utcnow().shift(days=-tombstone_settings['retention_days'])
+    batch_size = tombstone_settings['batch_size']
+
+    total = 0
+    while True:
+        count = await loop.run_in_executor(
+            None,
+            purge_tombstones,
+            before,
+            batch_size
+        )
+        total += count
+        if count < batch_size:
+            break
+        await asyncio.sleep(tombstone_settings['pause'])
+
+    print(f'Compacted {total} tombstones.')
+    return total
+
+
+def _play_count(value: typing.Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _play_time(timestamp: typing.Any) -> typing.Optional[datetime.datetime]:
+    if timestamp is None:
+        return None
+    try:
+        return arrow.get(timestamp).to('utc').datetime
+    except (TypeError, ValueError, arrow.parser.ParserError):
+        return None
+
+
+def _play_day(timestamp: typing.Any, default: arrow.Arrow) -> str:
+    try:
+        return arrow.get(timestamp).format('YYYY-MM-DD')
+    except (TypeError, ValueError, arrow.parser.ParserError):
+        return default.format('YYYY-MM-DD')
+
+
+@conn.trackdb.sessionize()
+def record_play_history(
+    updates: typing.List[typing.Dict[str, typing.Any]],
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> int:
+    """
+    Append play events for updated tracks to the play history.
+
+    Every track whose ``playCount`` or ``recentTimestamp`` changed in the
+    updates from a diff gets a ``play_history`` row plus a bump to its
+    ``play_history_daily`` rollup. The play deltas are worked out from the
+    previous values the updates carry, so the tracks are not read back.
+    The updates are matched up by their ``trackKey``, and those whose
+    changed columns are listed skip the history columns unless they changed.
+
+    Returns:
+        int: The number of play events recorded.
+    """
+    by_key = {
+        update['trackKey']: update
+        for update in updates
+        if any(
+            col in update.get(CHANGED, update)
+            for col in HISTORY_COLUMNS
+        )
+    }
+    if not by_key:
+        return 0
+
+    # Resolve every table up front: lazily creating one after the session
+    # has started writing would deadlock on the database lock.
+    History = tables.trackdb.PlayHistory
+    Daily = tables.trackdb.PlayHistoryDaily
+
+    now = arrow.utcnow()
+    events = []
+    for track_key, update in by_key.items():
+        play_count = _play_count(update.get('playCount'))
+        recent = update.get('recentTimestamp')
+        # Only the changed columns have previous values.
+        prev_count = _play_count(
+            update.get(PREVIOUS, {}).get('playCount', play_count)
+        )
+
+        events.append({
+            'trackKey': track_key,
+            'playCount': play_count,
+            'playDelta': play_count - prev_count,
+            'recentTimestamp': _play_time(recent),
+            'recordedTimestamp': now.datetime,
+        })
+
+    session.bulk_insert_mappings(History, events)
+
+    rollups: typing.Dict[typing.Tuple[str, int], typing.Dict] = {}
+    for event in events:
+        key = (_play_day(event['recentTimestamp'], now), event['trackKey'])
+        rollup = rollups.setdefault(key, {
+            'day': key[0],
+            'trackKey': key[1],
+            'plays': 0,
+            'lastTimestamp': None,
+        })
+        rollup['plays'] += max(event['playDelta'], 0)
+        rollup['lastTimestamp'] = event['recentTimestamp']
+
+    days = {day for day, _ in rollups}
+    for track_keys in _chunks(sorted({key for _, key in rollups})):
+        existing = session.query(Daily).filter(
+            Daily.day.in_(days),
+            Daily.trackKey.in_(track_keys)
+        )
+        for row in existing:
+            with contextlib.suppress(KeyError):
+                rollup = rollups.pop((row.day, row.trackKey))
+                row.plays += rollup['plays']
+                row.lastTimestamp = rollup['lastTimestamp']
+
+    session.bulk_insert_mappings(Daily, rollups.values())
+
+    return len(events)
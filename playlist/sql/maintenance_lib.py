@@ -0,0 +1,291 @@
+"""
+Library of functions to keep the database file compact and backed up.
+
+Reloading the library every day frees and reallocates a lot of pages, which
+leaves the database file larger and more fragmented over time. With
+``auto_vacuum=INCREMENTAL`` the free pages can be handed back to the file
+system a few at a time, and a full rebuild defragments the file. The
+``vacuum`` settings of the database control both.
+
+Backups are taken while the database stays in use, into a directory of
+``BasePath.DATA / 'backup'`` for each database file, as controlled by the
+``backup`` settings of the database.
+
+**********
+Module API
+**********
+
+.. autosummary::
+    :nosignatures:
+
+    free_page_ratio
+    incremental_vacuum
+    rebuild_database
+    get_backup_path
+    backup_database
+    scheduled_backup
+"""
+__all__ = (
+    'free_page_ratio',
+    'incremental_vacuum',
+    'rebuild_database',
+    'get_backup_path',
+    'backup_database',
+    'scheduled_backup',
+)
+
+import contextlib
+import gzip
+import pathlib
+import shutil
+import typing
+
+import arrow
+import sqlalchemy
+
+from playlist.core import const
+from playlist.sql import conn
+
+VACUUM_DEFAULTS = {
+    'auto_vacuum': 'incremental',
+    'free_page_ratio': 0.1,
+    'step_pages': 1024,
+    'max_steps': 16,
+}
+
+BACKUP_DEFAULTS = {
+    'pages': 256,
+    'sleep': 0.05,
+    'compress': True,
+    'interval_hours': 24,
+    'keep': 7,
+}
+
+# The values PRAGMA auto_vacuum reports for each mode.
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+BACKUP_TIME_FORMAT = 'YYYYMMDDTHHmmss'
+
+
+def _settings(
+    name: str,
+    defaults: typing.Mapping[str, typing.Any]
+) -> typing.Dict[str, typing.Any]:
+    section = dict(defaults)
+    section.update(conn.trackdb.settings.get(name) or {})
+    return section
+
+
+def _pragma(engine: sqlalchemy.engine.Engine, name: str) -> int:
+    with engine.connect() as connection:
+        return connection.execute(f'PRAGMA {name}').scalar()
+
+
+def free_page_ratio() -> float:
+    """
+    Get the fraction of the database pages that are free.
+
+    Returns:
+        float: The free pages, as a fraction of all the pages in the file.
+    """
+    with conn.trackdb.engine as engine:
+        pages = _pragma(engine, 'page_count')
+        free = _pragma(engine, 'freelist_count')
+    return free / pages if pages else 0.0
+
+
+def incremental_vacuum(force: bool=False) -> int:
+    """
+    Hand free pages back to the file system, in bounded steps.
+
+    Nothing is done until the free page ratio reaches the ``free_page_ratio``
+    setting, so this is cheap to call after every large delete. Each step
+    frees at most ``step_pages`` pages in its own transaction, and at most
+    ``max_steps`` steps are taken.
+
+    Args:
+        force (bool): Vacuum regardless of the free page ratio.
+
+    Returns:
+        int: The number of pages handed back.
+    """
+    vacuum_settings = _settings('vacuum', VACUUM_DEFAULTS)
+
+    with conn.trackdb.engine as engine:
+        mode = AUTO_VACUUM_MODES.get(_pragma(engine, 'auto_vacuum'))
+        if mode != 'incremental':
+            print(
+                f'Database auto_vacuum is {mode}, not incremental; '
+                'rebuild it to change that.'
+            )
+            return 0
+
+        start = _pragma(engine, 'freelist_count')
+        if not force:
+            pages = _pragma(engine, 'page_count')
+            if not pages or start / pages < vacuum_settings['free_page_ratio']:
+                return 0
+
+        step = f"PRAGMA incremental_vacuum({vacuum_settings['step_pages']})"
+        free = start
+        for _ in range(vacuum_settings['max_steps']):
+            if not free:
+                break
+            raw = engine.raw_connection()
+            try:
+                # The pragma frees one page per step of the statement, and
+                # only a script runs it to completion.
+                raw.connection.executescript(step)
+            finally:
+                raw.close()
+            free = _pragma(engine, 'freelist_count')
+
+    print(f'Vacuumed {start - free} free pages.')
+    return start - free
+
+
+def rebuild_database() -> pathlib.Path:
+    """
+    Rebuild the database file, defragmenting it.
+
+    The database is copied with ``VACUUM INTO``, which doesn't block
+    readers, and applies the ``auto_vacuum`` setting to the copy. The copy
+    then replaces the database file once the database is not in use.
+
+    Returns:
+        pathlib.Path: The database file.
+
+    Raises:
+        RuntimeError: If the database was in use when the copy was ready.
+            The copy is left beside the database file.
+    """
+    vacuum_settings = _settings('vacuum', VACUUM_DEFAULTS)
+    path = conn.trackdb.path
+    rebuilt = path.with_name(f'{path.name}.rebuild')
+    with contextlib.suppress(FileNotFoundError):
+        rebuilt.unlink()
+
+    with conn.trackdb.engine as engine:
+        before = path.stat().st_size
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.connection.cursor()
+            try:
+                cursor.execute(
+                    f"PRAGMA auto_vacuum={vacuum_settings['auto_vacuum']}"
+                )
+                cursor.execute('VACUUM INTO ?', (str(rebuilt),))
+            finally:
+                cursor.close()
+        finally:
+            raw.close()
+
+    conn.trackdb.engine.replace_file(rebuilt)
+
+    print(
+        f'Rebuilt {path}: {before} bytes before, '
+        f'{path.stat().st_size} bytes after.'
+    )
+    return path
+
+
+def get_backup_path() -> pathlib.Path:
+    """
+    Get the directory the backups are written to.
+
+    Backups are kept apart for each database file, like snapshots, so the
+    backups of one account are never counted or pruned as another's.
+    """
+    return const.BasePath.DATA.value / 'backup' / conn.trackdb.path.stem
+
+
+def _report_progress(copied: int, total: int) -> None:
+    print(f'Backed up {copied} of {total} pages ({copied / total:.0%}).')
+
+
+def backup_database(
+    compress: typing.Optional[bool]=None
+) -> pathlib.Path:
+    """
+    Back up the database while it stays in use.
+
+    The backup is copied in batches of pages through
+    :py:meth:`~playlist.sql._conn.DBConnection.backup`, reporting its
+    progress, and is named after the database file and the time it was
+    taken.
+
+    Args:
+        compress (Optional[bool]): Gzip the backup. Defaults to the
+            ``compress`` setting.
+
+    Returns:
+        pathlib.Path: The backup file.
+    """
+    backup_settings = _settings('backup', BACKUP_DEFAULTS)
+    if compress is None:
+        compress = backup_settings['compress']
+
+    path = conn.trackdb.path
+    backup_dir = get_backup_path()
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stamp = arrow.utcnow().format(BACKUP_TIME_FORMAT)
+    target = backup_dir / f'{path.stem}-{stamp}{path.suffix}'
+    partial = target.with_name(f'{target.name}.tmp')
+    with contextlib.suppress(FileNotFoundError):
+        partial.unlink()
+
+    conn.trackdb.backup(
+        partial,
+        pages=backup_settings['pages'],
+        sleep=backup_settings['sleep'],
+        progress=_report_progress
+    )
+
+    if compress:
+        target = target.with_name(f'{target.name}.gz')
+        with partial.open('rb') as inp, gzip.open(str(target), 'wb') as out:
+            shutil.copyfileobj(inp, out)
+        partial.unlink()
+    else:
+        partial.rename(target)
+
+    print(f'Backed up {path} to {target}')
+    return target
+
+
+def _backups() -> typing.List[pathlib.Path]:
+    path = conn.trackdb.path
+    return sorted(
+        backup
+        for pattern in (f'{path.stem}-*{path.suffix}', f'{path.stem}-*.gz')
+        for backup in get_backup_path().glob(pattern)
+    )
+
+
+def scheduled_backup() -> typing.Optional[pathlib.Path]:
+    """
+    Back up the database if the last backup is old enough.
+
+    A backup is taken once ``interval_hours`` have passed since the last
+    one, and then only the newest ``keep`` backups are kept, or all of them
+    if ``keep`` is zero or less.
+
+    Returns:
+        Optional[pathlib.Path]: The backup file, if one was taken.
+    """
+    backup_settings = _settings('backup', BACKUP_DEFAULTS)
+    due = arrow.utcnow().shift(hours=-backup_settings['interval_hours'])
+
+    backups = _backups()
+    if backups and arrow.get(backups[-1].stat().st_mtime) > due:
+        return None
+
+    target = backup_database()
+
+    keep = backup_settings['keep']
+    if keep > 0:
+        for old in _backups()[:-keep]:
+            old.unlink()
+            print(f'Removed old backup {old}')
+
+    return target
@@ -0,0 +1,414 @@
+"""
+Library of functions for memory-mapped binary snapshots of a table.
+
+A snapshot is a single file that any process can ``mmap`` to get NumPy
+views over the columns of a table, with nothing to deserialize. Every
+process mapping the same snapshot shares one copy in the page cache.
+
+*************
+File Layout
+*************
+
+All values are little-endian, and every buffer starts on a 64-byte
+boundary.
+
+====== ======== ==========================================================
+Offset Size     Contents
+====== ======== ==========================================================
+0      8        Magic bytes, ``b'GPMSNAP\\x01'``.
+8      8        Length of the JSON header, as an unsigned integer.
+16     32       SHA-256 checksum of everything from offset 48 onwards.
+48     variable JSON header describing the table and its column buffers.
+====== ======== ==========================================================
+
+Integer, Float, Boolean, DateTime and Interval columns are stored as
+fixed-width arrays with a separate validity mask. String and LargeBinary
+columns are dictionary-encoded: an ``int32`` code per row (``-1`` for
+null) plus the distinct values as one byte buffer with ``int64`` offsets.
+A fixed-width column with values that don't convert to its type is
+dictionary-encoded instead; the ``kind`` of each column in the header says
+how it is stored.
+
+**********
+Module API
+**********
+
+.. autosummary::
+    :nosignatures:
+
+    get_snapshot_path
+    write_snapshot
+    Snapshot
+"""
+__all__ = (
+    'get_snapshot_path',
+    'write_snapshot',
+    'Snapshot',
+)
+
+import contextlib
+import copy
+import hashlib
+import json
+import mmap
+import os
+import pathlib
+import struct
+import typing
+
+import arrow
+import numpy
+import sqlalchemy
+
+from playlist.core import const
+from playlist.sql import conn, tables
+
+MAGIC = b'GPMSNAP\x01'
+PREFIX = struct.Struct('<8sQ32s')
+ALIGNMENT = 64
+
+# Fixed-width NumPy dtypes for the YAML column types.
+DTYPES = {
+    'Integer': numpy.dtype('<i8'),
+    'Float': numpy.dtype('<f8'),
+    'Boolean': numpy.dtype('|b1'),
+    'DateTime': numpy.dtype('<M8[us]'),
+    'Interval': numpy.dtype('<m8[us]'),
+}
+CODES = numpy.dtype('<i4')
+OFFSETS = numpy.dtype('<i8')
+
+
+def get_snapshot_path(table_name: str) -> pathlib.Path:
+    """
+    Get the path of the snapshot file for a table.
+
+    Snapshots are kept apart for each database file, so accounts with
+    their own database don't overwrite each other's snapshots.
+    """
+    return (
+        const.BasePath.DATA.value / 'snapshot' / conn.trackdb.path.stem /
+        table_name
+    ).with_suffix('.snap')
+
+
+def _padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def _fixed_column(
+    values: typing.Sequence[typing.Any],
+    type_: str
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    valid = numpy.array([value is not None for value in values], dtype=bool)
+    if type_ == 'Integer':
+        data = [int(value) if value is not None else 0 for value in values]
+    elif type_ == 'Float':
+        data = [
+            float(value) if value is not None else numpy.nan
+            for value in values
+        ]
+    elif type_ == 'Boolean':
+        data = [bool(value) for value in values]
+    elif type_ == 'DateTime':
+        data = [
+            numpy.datetime64(arrow.get(value).naive, 'us')
+            if value is not None
+            else numpy.datetime64('NaT', 'us')
+            for value in values
+        ]
+    else:
+        data = [
+            numpy.timedelta64(value, 'us')
+            if value is not None
+            else numpy.timedelta64('NaT', 'us')
+            for value in values
+        ]
+    return numpy.array(data, dtype=DTYPES[type_]), valid
+
+
+def _dictionary_column(
+    values: typing.Sequence[typing.Any],
+    type_: str
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    lookup: typing.Dict[bytes, int] = {}
+    codes = numpy.empty(len(values), dtype=CODES)
+    for row, value in enumerate(values):
+        if value is None:
+            codes[row] = -1
+            continue
+        if type_ != 'LargeBinary':
+            value = str(value).encode(const.ENCODING)
+        codes[row] = lookup.setdefault(bytes(value), len(lookup))
+
+    entries = list(lookup)
+    offsets = numpy.zeros(len(entries) + 1, dtype=OFFSETS)
+    numpy.cumsum([len(entry) for entry in entries], out=offsets[1:])
+    data = numpy.frombuffer(b''.join(entries), dtype=numpy.uint8)
+    return codes, offsets, data
+
+
+@conn.trackdb.sessionize()
+def write_snapshot(
+    table_name: str='Tracks',
+    path: typing.Optional[pathlib.Path]=None,
+    *,
+    session: sqlalchemy.orm.session.Session
+) -> pathlib.Path:
+    """
+    Write a snapshot of a table.
+
+    The snapshot is written to a temporary file and renamed into place, so
+    processes that already mapped the previous snapshot keep a consistent
+    view of it.
+
+    Args:
+        table_name (str): The name of the table definition to snapshot.
+        path (Optional[pathlib.Path]): Where to write the snapshot. Defaults
+            to :py:func:`get_snapshot_path` for the table.
+
+    Returns:
+        pathlib.Path: The path of the snapshot.
+    """
+    if path is None:
+        path = get_snapshot_path(table_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tables.trackdb.definitions[table_name] as table_config:
+        tabledef = copy.deepcopy(table_config)
+
+    table = tables.trackdb[table_name].__table__
+    coldefs = tabledef['columns']
+    query = sqlalchemy.select(
+        [table.c[coldef['name']] for coldef in coldefs]
+    ).order_by(*table.primary_key.columns)
+    rows = session.execute(query).fetchall()
+    columns = list(zip(*rows)) if rows else [() for _ in coldefs]
+
+    buffers: typing.List[numpy.ndarray] = []
+    position = 0
+
+    def add(array: numpy.ndarray) -> typing.Dict[str, int]:
+        nonlocal position
+        entry = {'offset': position, 'nbytes': array.nbytes}
+        buffers.append(array)
+        position += array.nbytes + _padding(array.nbytes)
+        return entry
+
+    header_columns = []
+    for coldef, values in zip(coldefs, columns):
+        entry = {'name': coldef['name'], 'type': coldef['type']}
+        fixed = None
+        if coldef['type'] in DTYPES:
+            # SQLite keeps values that don't fit a column's type as they
+            # are, such as text in an INTEGER column of an older database.
+            with contextlib.suppress(TypeError, ValueError, OverflowError):
+                fixed = _fixed_column(values, coldef['type'])
+        if fixed is not None:
+            data, valid = fixed
+            entry.update(
+                kind='fixed',
+                dtype=data.dtype.str,
+                data=add(data),
+                valid=add(valid),
+            )
+        else:
+            codes, offsets, data = _dictionary_column(values, coldef['type'])
+            entry.update(
+                kind='dictionary',
+                dtype=codes.dtype.str,
+                data=add(codes),
+                offsets=add(offsets),
+                values=add(data),
+            )
+        header_columns.append(entry)
+
+    header = json.dumps({
+        'table': tabledef['tablename'],
+        'rows': len(rows),
+        'created': arrow.utcnow().isoformat(),
+        'columns': header_columns,
+    }).encode(const.ENCODING)
+    # Buffer offsets in the header are relative to the end of the header,
+    # which is padded so the first buffer starts aligned.
+    header += b' ' * _padding(PREFIX.size + len(header))
+
+    digest = hashlib.sha256(header)
+    temp_path = path.with_name(f'{path.name}.tmp')
+    with temp_path.open('wb') as out:
+        out.write(PREFIX.pack(MAGIC, len(header), bytes(32)))
+        out.write(header)
+        for array in buffers:
+            chunk = array.tobytes() + bytes(_padding(array.nbytes))
+            digest.update(chunk)
+            out.write(chunk)
+        out.seek(0)
+        out.write(PREFIX.pack(MAGIC, len(header), digest.digest()))
+
+    os.replace(str(temp_path), str(path))
+
+    print(f'Wrote {len(rows)} row snapshot of {table_name} to {path}')
+    return path
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped view of a table snapshot.
+
+    Column accessors return NumPy arrays that view the mapped file
+    directly. Those arrays must be released before the snapshot can be
+    closed.
+
+    Example:
+        Summing play counts without touching the database::
+
+            with Snapshot(get_snapshot_path('Tracks')) as snapshot:
+                total = snapshot.column('playCount').sum()
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        verify: bool=False
+    ) -> None:
+        """
+        Map a snapshot file.
+
+        Args:
+            path (pathlib.Path): The snapshot file.
+            verify (bool): Check the content checksum while opening.
+
+        Raises:
+            ValueError: If the file is not a snapshot, or ``verify`` is set
+                and the checksum does not match.
+        """
+        self.path = pathlib.Path(path)
+        with self.path.open('rb') as inp:
+            self._mmap = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_size, self._checksum = PREFIX.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{self.path} is not a track snapshot.')
+
+        self._data_start = PREFIX.size + header_size
+        self.header = json.loads(
+            bytes(self._mmap[PREFIX.size:self._data_start]).decode(
+                const.ENCODING
+            )
+        )
+        self._columns = {
+            entry['name']: entry
+            for entry in self.header['columns']
+        }
+        self._dictionaries: typing.Dict[str, typing.List[typing.Any]] = {}
+
+        if verify:
+            self.verify()
+
+    @property
+    def checksum(self) -> str:
+        """The SHA-256 content checksum recorded in the header."""
+        return self._checksum.hex()
+
+    @property
+    def rows(self) -> int:
+        """The number of rows in the snapshot."""
+        return self.header['rows']
+
+    @property
+    def columns(self) -> typing.Tuple[str, ...]:
+        """The names of the columns in the snapshot."""
+        return tuple(self._columns)
+
+    def verify(self) -> None:
+        """
+        Check the content checksum.
+
+        Raises:
+            ValueError: If the checksum does not match the content.
+        """
+        digest = hashlib.sha256(memoryview(self._mmap)[PREFIX.size:])
+        if digest.digest() != self._checksum:
+            raise ValueError(f'{self.path} failed its checksum.')
+
+    def _view(
+        self,
+        buffer: typing.Mapping[str, int],
+        dtype: numpy.dtype
+    ) -> numpy.ndarray:
+        dtype = numpy.dtype(dtype)
+        return numpy.frombuffer(
+            self._mmap,
+            dtype=dtype,
+            count=buffer['nbytes'] // dtype.itemsize,
+            offset=self._data_start + buffer['offset'],
+        )
+
+    def column(self, name: str) -> numpy.ndarray:
+        """
+        Get a column's values.
+
+        For dictionary-encoded columns these are the codes into
+        :py:meth:`dictionary`, with ``-1`` marking nulls.
+        """
+        entry = self._columns[name]
+        return self._view(entry['data'], entry['dtype'])
+
+    def valid(self, name: str) -> numpy.ndarray:
+        """Get a boolean mask of the rows where a column is not null."""
+        entry = self._columns[name]
+        if entry['kind'] == 'fixed':
+            return self._view(entry['valid'], '|b1')
+        return self.column(name) >= 0
+
+    def dictionary(self, name: str) -> typing.List[typing.Any]:
+        """Get the distinct values of a dictionary-encoded column."""
+        with contextlib.suppress(KeyError):
+            return self._dictionaries[name]
+
+        entry = self._columns[name]
+        offsets = self._view(entry['offsets'], OFFSETS)
+        data = self._mmap[
+            self._data_start + entry['values']['offset']:
+            self._data_start + entry['values']['offset']
+            + entry['values']['nbytes']
+        ]
+        values = [
+            data[start:end]
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        if entry['type'] != 'LargeBinary':
+            values = [value.decode(const.ENCODING) for value in values]
+        self._dictionaries[name] = values
+        return values
+
+    def decode(self, name: str) -> numpy.ndarray:
+        """Materialize a dictionary-encoded column as an object array."""
+        codes = self.column(name)
+        values = numpy.array(self.dictionary(name) + [None], dtype=object)
+        return values[codes]
+
+    def close(self) -> None:
+        """Unmap the snapshot."""
+        self._mmap.close()
+
+    def __enter__(self) -> 'Snapshot':
+        """Enter synchronous context manager."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: typing.Optional[type],
+        exc_value: typing.Optional[BaseException],
+        tb: typing.Any
+    ) -> None:
+        """Exit synchronous context manager."""
+        self.close()
+
+    def __repr__(self) -> str:
+        """String representation of the Snapshot object."""
+        return ' '.join((
+            f'<Snapshot(path={str(self.path)!r}),',
+            f'rows={self.rows}, checksum={self.checksum[:12]}>',
+        ))
@@ -0,0 +1,60 @@
+"""Shared fixtures for the gpm-playlist tests."""
+import os
+import tempfile
+
+# The data and settings directories are worked out from the home directory
+# when playlist is first imported, so point them somewhere disposable first.
+os.environ['HOME'] = tempfile.mkdtemp(prefix='gpm-playlist-tests-')
+for var in ('XDG_DATA_HOME', 'XDG_CONFIG_HOME', 'XDG_CACHE_HOME'):
+    os.environ.pop(var, None)
+
+import pytest  # NOQA: E402
+
+
+@pytest.fixture
+def trackdb(tmp_path):
+    """Point the trackdb at a database file of the test's own."""
+    from playlist.sql import conn
+
+    conn.trackdb.configure(file=str(tmp_path / f'{tmp_path.name}.db'))
+    yield conn.trackdb
+    conn.trackdb.configure()
+
+
+@pytest.fixture
+def make_tracks():
+    """Build tracks the way playlist.main.load_batch hands them over."""
+    import arrow
+
+    def make_tracks(start, stop, **fields):
+        stamp = arrow.get(1_500_000_000)
+        return [
+            dict(
+                {
+                    'id': f'track-{index}',
+                    'title': f'Title {index}',
+                    'album': f'Album {index % 5}',
+                    'albumId': f'B{index % 5}',
+                    'albumArtist': f'Artist {index % 7}',
+                    'artist': f'Artist {index % 7}',
+                    'artistId': f'A{index % 7}',
+                    'composer': '',
+                    'genre': 'Rock',
+                    'trackNumber': index % 12 + 1,
+                    'year': 2000 + index % 20,
+                    'kind': 'sj#track',
+                    'durationMillis': 180_000 + index,
+                    'estimatedSize': 7_000_000 + index,
+                    'playCount': index % 4,
+                    'creationTimestamp': stamp,
+                    'lastModifiedTimestamp': stamp,
+                    'lastRatingChangeTimestamp': stamp,
+                    'recentTimestamp': stamp,
+                    'deleted': False,
+                },
+                **fields
+            )
+            for index in range(start, stop)
+        ]
+
+    return make_tracks
@@ -0,0 +1,63 @@
+"""Tests for the Parquet exports of gpm-playlist."""
+import datetime
+
+import pandas
+import pytest
+
+from playlist.sql import arrow_lib, tables
+
+STAMP = datetime.datetime(2017, 7, 14, 2, 40)
+
+
+def insert_tracks(trackdb, *tracks):
+    """Insert tracks straight into the tracks table."""
+    defaults = dict.fromkeys(tables.trackdb.Tracks.__table__.c.keys())
+    with trackdb.engine as engine:
+        engine.execute(
+            tables.trackdb.Tracks.__table__.insert(),
+            [dict(defaults, **track) for track in tracks]
+        )
+
+
+def test_export_round_trip(trackdb):
+    """An exported table reads back with the types of its definition."""
+    insert_tracks(
+        trackdb,
+        {
+            'trackKey': 1,
+            'id': 'track-1',
+            'albumId': 'B0',
+            'playCount': 5,
+            'creationTimestamp': STAMP,
+        },
+        {'trackKey': 2, 'id': 'track-2', 'albumId': None, 'playCount': None},
+        {'trackKey': 3, 'id': 'track-3', 'albumId': 'B1', 'playCount': 0},
+    )
+
+    path = arrow_lib.export_table('Tracks', rows_per_file=2)
+    frame = arrow_lib.read_frame(
+        'Tracks', ['trackKey', 'albumId', 'playCount', 'creationTimestamp']
+    )
+
+    assert len(list(path.glob('*.parquet'))) == 2
+    assert arrow_lib.read_table('Tracks').schema.equals(
+        arrow_lib.arrow_schema('Tracks'), check_metadata=False
+    )
+    assert frame['trackKey'].tolist() == [1, 2, 3]
+    assert arrow_lib.read_table('Tracks', ['albumId']).column(
+        'albumId'
+    ).to_pylist() == ['B0', None, 'B1']
+    assert frame['playCount'].isna().tolist() == [False, True, False]
+    assert frame['creationTimestamp'][0] == pandas.Timestamp(STAMP)
+
+
+def test_export_names_the_column_that_does_not_convert(trackdb):
+    """Text left in a numeric column fails the export by name."""
+    insert_tracks(trackdb, {'trackKey': 1, 'id': 'track-1'})
+    path = arrow_lib.export_table('Tracks')
+    insert_tracks(trackdb, {'trackKey': 2, 'id': 'track-2', 'year': 'B2'})
+
+    with pytest.raises(ValueError, match='year'):
+        arrow_lib.export_table('Tracks')
+    assert arrow_lib.read_table('Tracks').num_rows == 1
+    assert path.exists()
@@ -0,0 +1,194 @@
+"""Tests for the database connections of gpm-playlist."""
+import threading
+
+import pytest
+import sqlalchemy
+
+from playlist.sql import _conn, conn, lib as sqllib, tables
+
+
+def test_configure_sets_tables_up_in_the_new_file(trackdb, tmp_path):
+    """Tables resolved before pointing at another file are set up there."""
+    tables.trackdb.Tracks
+
+    trackdb.configure(file=str(tmp_path / 'other.db'))
+    tables.trackdb.Tracks
+
+    with trackdb.engine as engine:
+        views = sqlalchemy.inspect(engine).get_view_names()
+    assert 'tracks_full' in views
+    assert sqllib.count_tracks() == 0
+
+
+def test_failed_checkout_is_not_counted_as_open(trackdb, tmp_path):
+    """A session whose connection can't be checked out isn't left open."""
+    trackdb.configure(file=str(tmp_path / 'missing' / 'tracks.db'))
+    trackdb.metrics.reset()
+
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        with trackdb.session('checkout'):
+            pass
+
+    metrics = trackdb.metrics.snapshot()
+    assert metrics['active'] == 0
+    assert 'checkout' not in metrics['sessions']
+    assert not trackdb.engine.in_use
+
+
+def test_session_metrics_count_commits_and_rollbacks(trackdb):
+    """Sessions are timed by label, and counted once closed."""
+    tables.trackdb.Credentials
+    trackdb.metrics.reset()
+
+    with trackdb.session('metrics'):
+        pass
+    with pytest.raises(RuntimeError):
+        with trackdb.session('metrics'):
+            raise RuntimeError('roll back')
+
+    metrics = trackdb.metrics.snapshot()
+    stats = metrics['sessions']['metrics']
+    assert metrics['active'] == 0
+    assert (stats['sessions'], stats['commits'], stats['rollbacks']) == (
+        2, 1, 1
+    )
+    assert stats['checkout']['count'] == 2
+    assert stats['commit']['count'] == 1
+    assert stats['transaction']['count'] == 2
+
+
+def test_diagnostics_capture_plans_and_flag_full_scans(
+    trackdb, monkeypatch, caplog
+):
+    """Each statement's plan is captured once, and full scans are logged."""
+    monkeypatch.setitem(trackdb.diagnostics.settings, 'large_table_rows', 1)
+    tables.trackdb.Credentials
+    with trackdb.engine as engine:
+        engine.execute(
+            "INSERT INTO credentials (username, password) VALUES ('a', 'b')"
+        )
+        with caplog.at_level('WARNING', logger='playlist.sql._conn'):
+            engine.execute('SELECT password FROM credentials')
+
+    plan = trackdb.diagnostics.plans['SELECT password FROM credentials']
+    assert any(detail.startswith('SCAN') for detail in plan)
+    assert 'Full scan of credentials (1 rows)' in caplog.text
+
+
+def test_diagnostics_analyze_after_bulk_writes(trackdb, monkeypatch):
+    """Sessions that write enough rows refresh the planner statistics."""
+    monkeypatch.setitem(trackdb.diagnostics.settings, 'analyze_after_rows', 3)
+    Credentials = tables.trackdb.Credentials
+    with trackdb.engine as engine:
+        trackdb.diagnostics.analyze(engine)
+
+    with trackdb.session('bulk') as session:
+        session.bulk_insert_mappings(Credentials, [
+            {'username': f'user-{index}', 'password': 'secret'}
+            for index in range(5)
+        ])
+
+    assert trackdb.diagnostics.rows_written == 0
+    assert trackdb.diagnostics.plans == {}
+    with trackdb.engine as engine:
+        assert engine.execute('SELECT count(*) FROM sqlite_stat1').scalar()
+
+
+@conn.trackdb.sessionize()
+def add_user(username, *, session):
+    """Add a user, returning the session it was added in."""
+    session.add(tables.trackdb.Credentials(username=username, password=''))
+    return session
+
+
+@conn.trackdb.sessionize()
+def usernames(*, session):
+    """Get the usernames, in order."""
+    Credentials = tables.trackdb.Credentials
+    return [
+        username
+        for username, in session.query(Credentials.username).order_by(
+            Credentials.username
+        )
+    ]
+
+
+def test_unit_of_work_shares_one_session(trackdb):
+    """Sessionized calls in a unit of work share its transaction."""
+    tables.trackdb.Credentials
+    trackdb.metrics.reset()
+
+    with trackdb.unit_of_work() as session:
+        assert add_user('a') is session
+        with trackdb.unit_of_work() as nested:
+            assert add_user('b') is nested is session
+        assert usernames() == ['a', 'b']
+
+    with pytest.raises(RuntimeError):
+        with trackdb.unit_of_work():
+            add_user('c')
+            raise RuntimeError('roll back')
+
+    assert usernames() == ['a', 'b']
+    stats = trackdb.metrics.snapshot()['sessions']['unit_of_work']
+    assert (stats['commits'], stats['rollbacks']) == (1, 1)
+
+
+def test_unit_of_work_is_thread_local(trackdb):
+    """Other threads keep their own sessions during a unit of work."""
+    tables.trackdb.Credentials
+    sessions = []
+
+    with trackdb.unit_of_work() as session:
+        worker = threading.Thread(
+            target=lambda: sessions.append(add_user('other'))
+        )
+        worker.start()
+        worker.join()
+
+    other, = sessions
+    assert other is not session
+    assert usernames() == ['other']
+
+
+def test_sessionmaker_is_built_once(trackdb):
+    """The session factory is shared, only its bind follows the engine."""
+    with trackdb.engine as engine:
+        first = trackdb.sessionmaker(engine)
+        second = trackdb.sessionmaker(engine)
+    assert first.func is second.func
+    assert first.keywords['bind'] is engine
+
+
+def test_registered_databases_are_kept_apart(trackdb, tmp_path):
+    """Each database name has one connection and tables of its own."""
+    conn.register('archive')
+    tables.register('archive')
+    assert conn.archive is conn['archive'] is _conn.DBConnection('archive')
+    assert conn.archive.settings['file'] == 'archive.db'
+
+    conn.archive.configure(file=str(tmp_path / 'archive.db'), tables='trackdb')
+    try:
+        with conn.archive.session() as session:
+            session.add(
+                tables.archive.Credentials(username='archived', password='')
+            )
+        with conn.archive.session() as session:
+            archived = session.query(tables.archive.Credentials).count()
+
+        assert conn.archive.path == tmp_path / 'archive.db'
+        assert tables.archive.Credentials is not tables.trackdb.Credentials
+        assert archived == 1
+        assert usernames() == []
+    finally:
+        conn.archive.configure()
+
+
+def test_configure_overrides_settings_one_level_deep(trackdb, tmp_path):
+    """Overridden blocks of settings keep the keys they don't set."""
+    vacuum = dict(trackdb.settings['vacuum'])
+
+    trackdb.configure(file=str(tmp_path / 'other.db'), vacuum={'max_steps': 1})
+
+    assert trackdb.settings['vacuum'] == dict(vacuum, max_steps=1)
+    assert trackdb.path == tmp_path / 'other.db'
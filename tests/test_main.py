@@ -0,0 +1,45 @@
+"""Tests for the import steps of gpm-playlist."""
+import asyncio
+
+import arrow
+import pytest
+
+pytest.importorskip('gmusicapi')
+
+from playlist import main  # NOQA: E402
+
+
+def test_load_batch_converts_gpm_fields(monkeypatch):
+    """The GPM timestamps and numbers are converted before loading."""
+    loaded = []
+    monkeypatch.setattr(main.sqllib, 'load_tracks', loaded.extend)
+    stamp = str(1_500_000_000 * 1_000_000)
+    song = {
+        'id': 'track-0',
+        'artistId': ['A0'],
+        'durationMillis': '180000',
+        'estimatedSize': '7000000',
+        'creationTimestamp': stamp,
+        'lastModifiedTimestamp': stamp,
+        'lastRatingChangeTimestamp': stamp,
+        'recentTimestamp': stamp,
+        'albumArtRef': [{'url': 'http://example.com/art'}],
+    }
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main.load_batch([song], loop=loop))
+    finally:
+        loop.close()
+
+    track, = loaded
+    assert 'albumArtRef' not in track
+    assert track['artistId'] == 'A0'
+    assert track['durationMillis'] == 180_000
+    for key in (
+        'creationTimestamp',
+        'lastModifiedTimestamp',
+        'lastRatingChangeTimestamp',
+        'recentTimestamp',
+    ):
+        assert track[key] == arrow.get(1_500_000_000)
@@ -0,0 +1,80 @@
+"""Tests for the database maintenance of gpm-playlist."""
+import os
+
+import pytest
+
+from playlist.sql import maintenance_lib, tables
+
+
+@pytest.fixture
+def old_backups(trackdb):
+    """Make three backups older than the backup interval."""
+    backup_dir = maintenance_lib.get_backup_path()
+    backup_dir.mkdir(parents=True)
+    backups = []
+    for day in range(1, 4):
+        backup = backup_dir / f'{trackdb.path.stem}-2017010{day}T000000.db.gz'
+        backup.touch()
+        os.utime(str(backup), (day * 86400, day * 86400))
+        backups.append(backup)
+    return backups
+
+
+@pytest.mark.parametrize('keep, kept', [(2, 2), (0, 4), (-1, 4)])
+def test_scheduled_backup_keeps_the_newest(trackdb, old_backups, keep, kept):
+    """Only the newest backups are kept, or every one for keep <= 0."""
+    trackdb.configure(
+        file=str(trackdb.path), backup={'keep': keep, 'compress': False}
+    )
+    tables.trackdb.Tracks
+
+    target = maintenance_lib.scheduled_backup()
+
+    backups = sorted(maintenance_lib.get_backup_path().iterdir())
+    assert len(backups) == kept
+    assert backups[-1] == target
+    assert target.stat().st_size > 0
+    assert maintenance_lib.scheduled_backup() is None
+
+
+def fill_and_empty(trackdb):
+    """Write a few hundred pages of credentials, then delete them."""
+    Credentials = tables.trackdb.Credentials.__table__
+    with trackdb.engine as engine:
+        engine.execute(Credentials.insert(), [
+            {'username': f'user-{index}', 'password': 'x' * 2000}
+            for index in range(500)
+        ])
+        engine.execute(
+            Credentials.delete().where(Credentials.c.username != 'user-0')
+        )
+
+
+def test_incremental_vacuum_hands_free_pages_back(trackdb):
+    """A new database can hand its free pages back a step at a time."""
+    fill_and_empty(trackdb)
+    assert maintenance_lib.free_page_ratio() > 0.5
+
+    assert maintenance_lib.incremental_vacuum() > 0
+    assert maintenance_lib.free_page_ratio() == 0
+    assert maintenance_lib.incremental_vacuum(force=True) == 0
+
+
+def test_rebuild_database_changes_the_auto_vacuum_mode(trackdb, tmp_path):
+    """Rebuilding a database applies the auto_vacuum setting to it."""
+    path = str(tmp_path / 'rebuild.db')
+    trackdb.configure(file=path, vacuum={'auto_vacuum': 'none'})
+    fill_and_empty(trackdb)
+    assert maintenance_lib.incremental_vacuum(force=True) == 0
+    size = trackdb.path.stat().st_size
+
+    trackdb.configure(file=path)
+    maintenance_lib.rebuild_database()
+
+    assert trackdb.path.stat().st_size < size
+    assert maintenance_lib.free_page_ratio() == 0
+    with trackdb.engine as engine:
+        assert engine.execute('PRAGMA auto_vacuum').scalar() == 2
+        assert engine.execute(
+            'SELECT username FROM credentials'
+        ).fetchall() == [('user-0',)]
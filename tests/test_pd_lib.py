@@ -0,0 +1,509 @@
+"""Tests for the pandas diff code of gpm-playlist."""
+import asyncio
+import subprocess
+import sys
+
+import numpy
+import pandas
+import pyarrow
+import pytest
+
+from playlist.core import const
+from playlist.pd import lib as pdlib
+
+SCHEMA = {
+    'trackKey': 'Integer',
+    'title': 'String',
+    'nid': 'String',
+    'clientId': 'String',
+}
+
+
+@pytest.mark.parametrize('engine', ['fused', 'hash', 'sorted'])
+def test_first_run_with_all_null_string_column(engine):
+    """An all-null string column diffs against an empty previous import."""
+    current = pdlib.dict_to_df(
+        [
+            {
+                'trackKey': key,
+                'title': f'T{key}',
+                'nid': None,
+                'clientId': None,
+            }
+            for key in range(10)
+        ],
+        'trackKey',
+        'current',
+        SCHEMA
+    )
+    previous = pdlib.dict_to_df(
+        {col: [] for col in SCHEMA},
+        'trackKey',
+        'previous',
+        SCHEMA
+    )
+    diff = {
+        'fused': pdlib.fused_diff,
+        'hash': pdlib.hash_diff,
+        'sorted': pdlib.sorted_diff,
+    }[engine]
+
+    results = diff(current, previous, schema=SCHEMA)
+
+    assert results.counts == {
+        'inserts': 10,
+        'updates': 0,
+        'deletes': 0,
+        'skips': 0,
+    }
+    assert results['inserts'][0] == {
+        'trackKey': 0,
+        'title': 'T0',
+        'nid': None,
+        'clientId': None,
+    }
+
+
+def test_numbers_are_not_silently_made_null():
+    """Integer columns with values that aren't numbers fail to convert."""
+    data = pdlib.to_frame({'trackKey': [0, 1], 'albumId': ['7', 'B0']})
+
+    with pytest.raises(ValueError, match="albumId.*'B0'"):
+        pdlib.compact_frame(data, {'albumId': 'Integer'})
+    with pytest.raises(ValueError, match="albumId.*'B0'"):
+        pdlib.df_to_columns(data, {'albumId': 'Integer'})
+
+    compact = pdlib.compact_frame(data, {'trackKey': 'Integer'})
+    assert compact['trackKey'].dtype == 'Int64'
+
+
+
+def test_pd_does_not_load_the_sql_stack():
+    """The diff code stands alone; callers pass in the table's schema."""
+    code = (
+        'import sys, playlist.pd.lib; '
+        'assert not any(name.startswith("playlist.sql") for name in '
+        'sys.modules), sorted(sys.modules)'
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+LIBRARY_SCHEMA = {
+    'trackKey': 'Integer',
+    'title': 'String',
+    'playCount': 'Integer',
+    'rating': 'Float',
+}
+
+
+def library_rows():
+    """Get previous and current rows with one change of every kind."""
+    previous = [
+        {
+            'trackKey': key,
+            'title': f'T{key}',
+            'playCount': key,
+            'rating': None if key == 4 else key / 2,
+        }
+        for key in range(6)
+    ]
+    current = [dict(row) for row in previous[1:]]
+    current.append({
+        'trackKey': 6, 'title': 'T6', 'playCount': 0, 'rating': None,
+    })
+    current[1]['title'] = 'Renamed'
+    current[2]['playCount'] = 10
+    return current, previous
+
+
+def library_frames():
+    """Get previous and current frames with one change of every kind."""
+    return tuple(
+        pdlib.dict_to_df(rows, 'trackKey', type_, LIBRARY_SCHEMA)
+        for rows, type_ in zip(library_rows(), ('current', 'previous'))
+    )
+
+
+EXPECTED = {
+    'inserts': [
+        {'trackKey': 6, 'title': 'T6', 'playCount': 0, 'rating': None},
+    ],
+    'updates': [
+        {
+            'trackKey': 2,
+            'title': 'Renamed',
+            'playCount': 2,
+            'rating': 1.0,
+            pdlib.CHANGED: ('title',),
+            pdlib.PREVIOUS: {'title': 'T2'},
+        },
+        {
+            'trackKey': 3,
+            'title': 'T3',
+            'playCount': 10,
+            'rating': 1.5,
+            pdlib.CHANGED: ('playCount',),
+            pdlib.PREVIOUS: {'playCount': 3},
+        },
+    ],
+    'deletes': [
+        {'trackKey': 0, 'title': 'T0', 'playCount': 0, 'rating': 0.0},
+    ],
+    'skips': [
+        {'trackKey': 1, 'title': 'T1', 'playCount': 1, 'rating': 0.5},
+        {'trackKey': 4, 'title': 'T4', 'playCount': 4, 'rating': None},
+        {'trackKey': 5, 'title': 'T5', 'playCount': 5, 'rating': 2.5},
+    ],
+}
+
+
+def test_hash_diff_classifies_every_row():
+    """Row hashes tell updates from skips, nulls hashing alike."""
+    current, previous = library_frames()
+
+    results = pdlib.hash_diff(current, previous, schema=LIBRARY_SCHEMA)
+
+    assert dict(results) == EXPECTED
+
+
+def test_hash_diff_leaves_ignored_columns_out():
+    """Changes to ignored columns don't make a row an update."""
+    current, previous = library_frames()
+
+    results = pdlib.hash_diff(
+        current, previous, ignored=['title'], schema=LIBRARY_SCHEMA
+    )
+
+    assert results.counts == {
+        'inserts': 1, 'updates': 1, 'deletes': 1, 'skips': 4,
+    }
+    assert results['updates'][0]['trackKey'] == 3
+    assert results['updates'][0][pdlib.CHANGED] == ('playCount',)
+
+
+def test_hash_rows_depend_on_every_value():
+    """Equal rows hash alike, and any differing value changes the hash."""
+    titles = numpy.array(['a', 'b', 'a', None], dtype=object)
+    counts = numpy.array([1, 1, 1, 1])
+    hashes = pdlib.hash_rows([titles, counts])
+
+    assert hashes[0] == hashes[2]
+    assert len(set(hashes.tolist())) == 3
+    assert (pdlib.hash_rows([counts, titles]) != hashes).any()
+
+
+def batched(rows, size=2):
+    """Split rows into batches of columns, as the track readers give them."""
+    for start in range(0, len(rows), size):
+        batch = rows[start:start + size]
+        yield {col: [row[col] for row in batch] for col in batch[0]}
+
+
+def combined(results):
+    """Put the records of partitioned results back together, by key."""
+    return {
+        category: sorted(
+            (
+                record
+                for result in results
+                for record in result[category]
+            ),
+            key=lambda record: record['trackKey']
+        )
+        for category in pdlib.CATEGORIES
+    }
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_partitioned_diff_matches_the_whole_diff(workers):
+    """Diffing the partitions gives the rows diffing everything would."""
+    current, previous = library_rows()
+
+    results = list(pdlib.iter_partitioned_diff(
+        batched(current),
+        batched(previous),
+        'trackKey',
+        partitions=3,
+        schema=LIBRARY_SCHEMA,
+        workers=workers,
+    ))
+
+    assert len(results) == 3
+    assert combined(results) == EXPECTED
+    assert not list((const.BasePath.CACHE.value / 'diff').iterdir())
+
+
+def test_partitioned_diff_streams_results_to_the_loop():
+    """The asynchronous form yields every partition, counting only."""
+    current, previous = library_rows()
+
+    async def diff():
+        return [
+            part async for part in pdlib.get_ins_upd_del_partitioned(
+                'Tracks',
+                batched(current),
+                batched(previous),
+                'trackKey',
+                partitions=4,
+                schema=LIBRARY_SCHEMA,
+                want=('updates',),
+            )
+        ]
+
+    loop = asyncio.new_event_loop()
+    try:
+        parts = loop.run_until_complete(diff())
+    finally:
+        loop.close()
+
+    assert sum(part.counts['skips'] for part in parts) == 3
+    assert all(set(part) == {'updates'} for part in parts)
+    assert sorted(
+        update['trackKey'] for part in parts for update in part['updates']
+    ) == [2, 3]
+
+
+def test_diff_result_keeps_only_the_wanted_rows():
+    """Unwanted categories are counted, but their rows aren't kept."""
+    current, previous = library_frames()
+
+    results = pdlib.fused_diff(
+        current, previous, schema=LIBRARY_SCHEMA, want=('updates',)
+    )
+
+    assert list(results) == ['updates']
+    assert results.counts == {
+        'inserts': 1, 'updates': 2, 'deletes': 1, 'skips': 3,
+    }
+    with pytest.raises(KeyError, match='skips'):
+        results['skips']
+    with pytest.raises(ValueError, match='unknown'):
+        pdlib.fused_diff(current, previous, want=('unknown',))
+
+
+def test_diff_result_converts_records_lazily_in_batches():
+    """Records are converted a batch at a time, or all at once, once."""
+    current, previous = library_frames()
+    results = pdlib.fused_diff(current, previous, schema=LIBRARY_SCHEMA)
+
+    assert list(results.iter_batches('skips', batch_size=2)) == [
+        EXPECTED['skips'][:2], EXPECTED['skips'][2:],
+    ]
+
+    async def batches():
+        return [batch async for batch in results.batches('skips', 2)]
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(batches()) == [
+            EXPECTED['skips'][:2], EXPECTED['skips'][2:],
+        ]
+    finally:
+        loop.close()
+
+    assert results['skips'] is results['skips']
+    assert 'skips=3' in repr(results)
+
+
+def columnar_forms(rows):
+    """Get rows in each of the forms a diff takes, by name."""
+    columns = {col: [row[col] for row in rows] for col in rows[0]}
+    frame = pandas.DataFrame(columns)
+    return {
+        'records': rows,
+        'columns': columns,
+        'frame': frame,
+        'indexed frame': frame.set_index('trackKey'),
+        'arrow table': pyarrow.Table.from_pydict(columns),
+        'arrow batch': pyarrow.RecordBatch.from_pandas(frame),
+        'structured array': frame.to_records(index=False),
+    }
+
+
+@pytest.mark.parametrize('form', [
+    'records',
+    'columns',
+    'frame',
+    'indexed frame',
+    'arrow table',
+    'arrow batch',
+    'structured array',
+])
+def test_columnar_inputs_diff_like_records(form):
+    """Every input form gives the diff of the same records."""
+    current, previous = library_rows()
+    current, previous = (
+        pdlib.dict_to_df(
+            columnar_forms(rows)[form], 'trackKey', type_, LIBRARY_SCHEMA
+        )
+        for rows, type_ in ((current, 'current'), (previous, 'previous'))
+    )
+
+    results = pdlib.fused_diff(current, previous, schema=LIBRARY_SCHEMA)
+
+    assert dict(results) == EXPECTED
+
+
+def test_unstructured_arrays_are_refused():
+    """Plain arrays have no field names to diff by."""
+    with pytest.raises(TypeError, match='structured'):
+        pdlib.to_frame(numpy.zeros((2, 2)))
+
+
+def test_fused_diff_classifies_every_row_in_one_pass():
+    """The fused engine finds every category, timing each step."""
+    current, previous = library_frames()
+
+    results = pdlib.fused_diff(current, previous, schema=LIBRARY_SCHEMA)
+
+    assert dict(results) == EXPECTED
+    assert set(results.timings) >= {'merge', 'compare', 'collect'}
+
+
+def test_fused_diff_takes_ignored_columns_from_previous():
+    """Updates carry the previous values of the ignored columns."""
+    current, previous = library_rows()
+    current[2]['rating'] = 9.0
+    current, previous = (
+        pdlib.dict_to_df(rows, 'trackKey', type_, LIBRARY_SCHEMA)
+        for rows, type_ in ((current, 'current'), (previous, 'previous'))
+    )
+
+    results = pdlib.fused_diff(
+        current, previous, ignored=['rating'], schema=LIBRARY_SCHEMA
+    )
+
+    assert results['updates'][1] == EXPECTED['updates'][1]
+
+
+def test_walk_keys_pairs_up_the_shared_keys():
+    """Shared keys are found with their previous positions, in order."""
+    shared, prev_rows = pdlib.walk_keys(
+        numpy.array([1, 3, 4, 7]), numpy.array([0, 3, 5, 7, 9])
+    )
+
+    assert shared.tolist() == [False, True, False, True]
+    assert prev_rows.tolist() == [1, 3]
+
+
+def test_sorted_keys_encode_composite_integer_keys():
+    """Composite integer keys become integers that sort like them."""
+    current = pandas.MultiIndex.from_tuples([(1, 5), (2, 0)])
+    previous = pandas.MultiIndex.from_tuples([(1, 9), (2, 0)])
+
+    curr_keys, prev_keys = pdlib.sorted_keys(current, previous)
+
+    assert curr_keys[1] == prev_keys[1]
+    assert curr_keys[0] < prev_keys[0] < curr_keys[1]
+    assert pdlib.sorted_keys(
+        pandas.Index(['a']), pandas.Index(['b'])
+    ) is None
+
+
+def test_sorted_diff_walks_keys_in_any_order():
+    """Unsorted keys are sorted first, and give the same results."""
+    current, previous = library_frames()
+
+    results = pdlib.sorted_diff(
+        current.iloc[::-1], previous, schema=LIBRARY_SCHEMA
+    )
+
+    assert dict(results) == EXPECTED
+
+
+def test_sorted_diff_refuses_duplicate_keys():
+    """Keys that aren't unique can't be walked."""
+    current, previous = library_frames()
+
+    with pytest.raises(ValueError, match='duplicate'):
+        pdlib.sorted_diff(
+            pandas.concat([current, current.iloc[:1]]), previous
+        )
+
+
+def test_sorted_diff_falls_back_for_other_keys():
+    """Keys that aren't integers are merged instead."""
+    current, previous = (
+        frame.set_index(frame.index.astype(str))
+        for frame in library_frames()
+    )
+
+    results = pdlib.sorted_diff(current, previous)
+
+    assert results.counts == {
+        'inserts': 1, 'updates': 2, 'deletes': 1, 'skips': 3,
+    }
+
+
+POLICY_SCHEMA = {
+    'trackKey': 'Integer',
+    'rating': 'Float',
+    'playCount': 'Integer',
+    'stamp': 'DateTime',
+    'comment': 'String',
+}
+
+POLICIES = {
+    'rating': {'abs_tol': 1e-6},
+    # Integers are always compared exactly, whatever the tolerance.
+    'playCount': {'abs_tol': 5},
+    'stamp': {'granularity': 's'},
+    'comment': {'null_values': ['']},
+}
+
+
+def test_compare_policies_are_checked_and_normalized():
+    """Granularities become periods, and unknown settings are refused."""
+    policies = pdlib.compare_policies({
+        'stamp': {'granularity': 'min'},
+        'other': {'granularity': 2, 'null_values': ('',)},
+    })
+
+    assert policies['stamp']['granularity'] == pandas.Timedelta(minutes=1)
+    assert policies['other'] == {
+        'granularity': pandas.Timedelta(seconds=2), 'null_values': [''],
+    }
+    with pytest.raises(ValueError, match='tolerance'):
+        pdlib.compare_policies({'rating': {'tolerance': 1}})
+
+
+@pytest.mark.parametrize('engine', ['fused', 'hash', 'sorted'])
+def test_compare_policies_suppress_noise(engine):
+    """Changes within a column's policy are not updates."""
+    stamp = pandas.Timestamp('2017-07-14 02:40:00', tz='UTC')
+    previous = [
+        {
+            'trackKey': key,
+            'rating': 0.1 * key,
+            'playCount': key,
+            'stamp': stamp,
+            'comment': None,
+        }
+        for key in range(4)
+    ]
+    current = [dict(row) for row in previous]
+    current[0]['rating'] += 1e-9
+    current[0]['stamp'] += pandas.Timedelta(milliseconds=300)
+    current[0]['comment'] = ''
+    current[1]['rating'] += 0.5
+    current[2]['stamp'] += pandas.Timedelta(seconds=2)
+    current[3]['playCount'] += 1
+    current, previous = (
+        pdlib.dict_to_df(rows, 'trackKey', type_, POLICY_SCHEMA)
+        for rows, type_ in ((current, 'current'), (previous, 'previous'))
+    )
+    diff = {
+        'fused': pdlib.fused_diff,
+        'hash': pdlib.hash_diff,
+        'sorted': pdlib.sorted_diff,
+    }[engine]
+
+    results = diff(
+        current, previous, schema=POLICY_SCHEMA, compare=POLICIES
+    )
+
+    assert {
+        update['trackKey']: update[pdlib.CHANGED]
+        for update in results['updates']
+    } == {1: ('rating',), 2: ('stamp',), 3: ('playCount',)}
+    assert results.counts['skips'] == 1
@@ -0,0 +1,48 @@
+"""Tests for the table snapshots of gpm-playlist."""
+import datetime
+
+import numpy
+
+from playlist.sql import snapshot_lib, tables
+
+
+def test_snapshot_round_trip(trackdb, tmp_path):
+    """A snapshot gives back the values of the table it was written from."""
+    table = tables.trackdb.Tracks.__table__
+    stamp = datetime.datetime(2017, 7, 14, 2, 40)
+    with trackdb.engine as engine:
+        engine.execute(table.insert(), [
+            {
+                'trackKey': 1,
+                'id': 'track-1',
+                'albumId': 'B0',
+                'trackNumber': 3,
+                'playCount': 5,
+                'creationTimestamp': stamp,
+            },
+            {
+                'trackKey': 2,
+                'id': 'track-2',
+                'albumId': None,
+                # Text SQLite kept in an INTEGER column as it is.
+                'trackNumber': 'B2',
+                'playCount': None,
+                'creationTimestamp': None,
+            },
+        ])
+
+    path = snapshot_lib.write_snapshot(path=tmp_path / 'tracks.snap')
+
+    with snapshot_lib.Snapshot(path, verify=True) as snapshot:
+        assert snapshot.rows == 2
+        assert snapshot.decode('id').tolist() == ['track-1', 'track-2']
+        assert snapshot.decode('albumId').tolist() == ['B0', None]
+        assert snapshot.column('playCount')[0] == 5
+        assert snapshot.valid('playCount').tolist() == [True, False]
+        assert snapshot.column('creationTimestamp')[0] == numpy.datetime64(
+            stamp, 'us'
+        )
+        assert snapshot.header['columns'][
+            snapshot.columns.index('trackNumber')
+        ]['kind'] == 'dictionary'
+        assert snapshot.decode('trackNumber').tolist() == ['3', 'B2']
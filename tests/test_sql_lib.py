@@ -0,0 +1,344 @@
+"""Tests for the SQL library of gpm-playlist."""
+import asyncio
+import datetime
+import sqlite3
+import threading
+
+import arrow
+import pandas
+import pytest
+import sqlalchemy
+
+from playlist.pd import lib as pdlib
+from playlist.sql import lib as sqllib, tables
+
+
+def test_concurrent_loads_into_memory_staging(trackdb, tmp_path, make_tracks):
+    """Loads from several threads all land in the in-memory staging."""
+    trackdb.configure(
+        file=str(tmp_path / 'staged.db'), staging={'mode': 'memory'}
+    )
+    errors = []
+
+    def load(batch):
+        try:
+            sqllib.load_tracks(make_tracks(batch * 100, batch * 100 + 100))
+        except Exception as exc:  # NOQA: B902
+            errors.append(exc)
+
+    with sqllib.staging() as in_memory:
+        assert in_memory
+        threads = [
+            threading.Thread(target=load, args=(batch,)) for batch in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        assert len(sqllib.get_current_columns()['trackKey']) == 600
+
+    with trackdb.engine as engine:
+        staged = engine.execute(
+            sqlalchemy.select([sqlalchemy.func.count()]).select_from(
+                tables.trackdb.NewTracks.__table__
+            )
+        ).scalar()
+    assert staged == 0
+
+
+def test_loaded_tracks_diff_against_tracks(trackdb, make_tracks):
+    """Tracks loaded from GPM rows are diffed with their timestamps."""
+    sqllib.load_tracks(make_tracks(0, 10))
+
+    schema = sqllib.table_schema('Tracks')
+    current = pdlib.dict_to_df(
+        sqllib.get_current_columns(), 'trackKey', 'current', schema
+    )
+    previous = pdlib.dict_to_df(
+        sqllib.get_previous_columns(), 'trackKey', 'previous', schema
+    )
+    results = pdlib.fused_diff(current, previous, schema=schema)
+
+    assert results.counts['inserts'] == 10
+    assert (
+        current['lastRatingChangeTimestamp'] ==
+        pandas.Timestamp(1_500_000_000, unit='s', tz='UTC')
+    ).all()
+
+
+@pytest.mark.parametrize('mode', ['disk', 'memory'])
+def test_promote_rollback_and_tombstones(trackdb, tmp_path, make_tracks, mode):
+    """Promoted tracks keep their types, and missing ones are tombstoned."""
+    trackdb.configure(
+        file=str(tmp_path / 'promote.db'), staging={'mode': mode}
+    )
+    with sqllib.staging():
+        sqllib.load_tracks(make_tracks(0, 5))
+        current = sqllib.get_current_columns()
+        assert set(current['creationTimestamp']) == {
+            datetime.datetime(2017, 7, 14, 2, 40)
+        }
+        assert sorted(current['durationMillis']) == list(
+            range(180_000, 180_005)
+        )
+        assert sqllib.promote_new_tracks() == 5
+
+        sqllib.erase_new_tracks()
+        sqllib.load_tracks(make_tracks(1, 5, playCount=9))
+        assert sqllib.promote_new_tracks() == 4
+
+    Tracks = tables.trackdb.Tracks
+    with trackdb.session('test') as session:
+        tracks = {track.id: track for track in session.query(Tracks)}
+        assert sorted(tracks) == [f'track-{index}' for index in range(5)]
+        assert tracks['track-0'].deleted
+        assert tracks['track-0'].deletedTimestamp is not None
+        assert tracks['track-0'].playCount == 0
+        assert tracks['track-1'].deletedTimestamp is None
+        assert tracks['track-1'].playCount == 9
+        assert tracks['track-1'].durationMillis == 180_001
+        assert tracks['track-1'].creationTimestamp == datetime.datetime(
+            2017, 7, 14, 2, 40
+        )
+
+    sqllib.rollback_tracks()
+    previous = sqllib.get_previous_columns()
+    assert dict(zip(previous['id'], previous['playCount'])) == {
+        f'track-{index}': index % 4 for index in range(5)
+    }
+
+    sqllib.rollback_tracks()
+    assert sqllib.purge_tombstones(arrow.utcnow().shift(days=1), 10) == 1
+    assert len(sqllib.get_previous_columns()['trackKey']) == 4
+
+
+def test_apply_updates_sets_only_the_changed_columns(trackdb, make_tracks):
+    """Updates write the columns they list as changed, and no others."""
+    sqllib.load_tracks(make_tracks(0, 3))
+    sqllib.promote_new_tracks()
+    previous = sqllib.get_previous_columns()
+    keys = dict(zip(previous['id'], previous['trackKey']))
+
+    count = sqllib.apply_updates([
+        {
+            'trackKey': keys['track-0'],
+            'playCount': 7,
+            'title': 'Not written',
+            sqllib.CHANGED: ['playCount'],
+        },
+        {
+            'trackKey': keys['track-1'],
+            'playCount': 8,
+            'title': 'Renamed',
+            'unknown': 'Not a column',
+            sqllib.CHANGED: ['playCount', 'title', 'unknown'],
+        },
+        {'trackKey': keys['track-2'], 'title': 'Every field'},
+    ])
+
+    assert count == 3
+    previous = sqllib.get_previous_columns()
+    tracks = {
+        track_id: (play_count, title)
+        for track_id, play_count, title in zip(
+            previous['id'], previous['playCount'], previous['title']
+        )
+    }
+    assert tracks == {
+        'track-0': (7, 'Title 0'),
+        'track-1': (8, 'Renamed'),
+        'track-2': (2, 'Every field'),
+    }
+
+
+def test_gpm_ids_are_kept_as_strings():
+    """The GPM ids that look like numbers are typed as strings."""
+    schema = sqllib.table_schema('Tracks')
+    columns = pdlib.df_to_columns(
+        pdlib.compact_frame(
+            pdlib.to_frame({
+                'trackKey': [0, 1],
+                'albumId': ['B0', None],
+                'albumArtId': ['B1', '2'],
+                'artistArtId': [None, 'B2'],
+            }),
+            schema
+        ),
+        schema
+    )
+
+    assert columns['albumId'] == ['B0', None]
+    assert columns['albumArtId'] == ['B1', '2']
+    assert columns['artistArtId'] == [None, 'B2']
+
+
+def test_table_compare_reads_the_policies_of_a_table():
+    """The compare policies of a table definition are valid policies."""
+    compare = sqllib.table_compare('Tracks')
+
+    assert compare
+    assert set(compare) < set(sqllib.table_schema('Tracks'))
+    assert set(pdlib.compare_policies(compare)) == set(compare)
+    assert sqllib.table_compare('TrackKeys') == {}
+
+
+def test_record_play_history(trackdb):
+    """Play count changes are recorded as events and rolled up by day."""
+    def update(track_key, play_count, previous, recent):
+        return {
+            'trackKey': track_key,
+            'playCount': play_count,
+            'recentTimestamp': recent,
+            sqllib.CHANGED: ['playCount', 'recentTimestamp'],
+            sqllib.PREVIOUS: {'playCount': previous},
+        }
+
+    assert sqllib.record_play_history([
+        update(1, 5, 3, '2017-07-14 02:40:00+00:00'),
+        update(2, 1, 0, '2017-07-14 09:00:00+00:00'),
+        {'trackKey': 3, 'title': 'Renamed', sqllib.CHANGED: ['title']},
+    ]) == 2
+    assert sqllib.record_play_history([
+        update(1, 6, 5, '2017-07-14 03:00:00+00:00'),
+    ]) == 1
+
+    History = tables.trackdb.PlayHistory
+    Daily = tables.trackdb.PlayHistoryDaily
+    with trackdb.session('test') as session:
+        history = [
+            (row.trackKey, row.playDelta, row.recentTimestamp)
+            for row in session.query(History).order_by(History.id)
+        ]
+        daily = {
+            row.trackKey: (row.day, row.plays, row.lastTimestamp)
+            for row in session.query(Daily)
+        }
+
+    assert history == [
+        (1, 2, datetime.datetime(2017, 7, 14, 2, 40)),
+        (2, 1, datetime.datetime(2017, 7, 14, 9, 0)),
+        (1, 1, datetime.datetime(2017, 7, 14, 3, 0)),
+    ]
+    assert daily == {
+        1: ('2017-07-14', 3, datetime.datetime(2017, 7, 14, 3, 0)),
+        2: ('2017-07-14', 1, datetime.datetime(2017, 7, 14, 9, 0)),
+    }
+
+
+def test_intern_names_keeps_the_keys_it_gave(trackdb):
+    """Names keep their surrogate keys, and new names get new ones."""
+    first = sqllib.intern_names('Artists', ['Artist A', None, 'Artist B'])
+    second = sqllib.intern_names('Artists', ['Artist B', 'Artist C'])
+
+    assert set(first) == {'Artist A', 'Artist B'}
+    assert second['Artist B'] == first['Artist B']
+    assert second['Artist C'] not in first.values()
+    assert sqllib.intern_names('Artists', [None]) == {}
+
+
+def test_tracks_full_shows_the_dimension_names(trackdb, make_tracks):
+    """Tracks store dimension keys, and the full view shows the names."""
+    sqllib.load_tracks(make_tracks(0, 3, albumArtist='Artist 1'))
+    sqllib.promote_new_tracks()
+
+    Tracks = tables.trackdb.Tracks
+    with trackdb.session('test') as session:
+        stored = session.query(
+            Tracks.artistKey, Tracks.albumArtistKey
+        ).filter(Tracks.id == 'track-1').one()
+        full = {
+            row.id: row
+            for row in session.execute(
+                'SELECT id, artist, albumArtist, album, genre '
+                'FROM tracks_full'
+            )
+        }
+
+    assert stored.artistKey == stored.albumArtistKey
+    assert {
+        track_id: (row.artist, row.album) for track_id, row in full.items()
+    } == {
+        'track-0': ('Artist 0', 'Album 0'),
+        'track-1': ('Artist 1', 'Album 1'),
+        'track-2': ('Artist 2', 'Album 2'),
+    }
+    assert {row.albumArtist for row in full.values()} == {'Artist 1'}
+    assert {row.genre for row in full.values()} == {'Rock'}
+
+
+def test_migrate_track_keys(trackdb):
+    """Tables keyed by track id are moved over to track keys."""
+    with sqlite3.connect(str(trackdb.path)) as legacy:
+        legacy.executescript("""
+            CREATE TABLE tracks (
+                id VARCHAR PRIMARY KEY, title VARCHAR, "playCount" INTEGER
+            );
+            INSERT INTO tracks VALUES ('track-a', 'A', 3), ('track-b', 'B', 1);
+            CREATE TABLE play_history (
+                id INTEGER PRIMARY KEY,
+                "trackId" VARCHAR,
+                "playDelta" INTEGER,
+                "recordedTimestamp" DATETIME NOT NULL
+            );
+            INSERT INTO play_history VALUES
+                (1, 'track-b', 1, '2017-07-14 02:40:00.000000'),
+                (2, NULL, 1, '2017-07-14 02:40:00.000000');
+        """)
+    legacy.close()
+
+    sqllib.migrate_track_keys()
+
+    with trackdb.engine as engine:
+        names = sqlalchemy.inspect(engine).get_table_names()
+        tracks = dict(engine.execute(
+            'SELECT id, "trackKey" FROM tracks'
+        ).fetchall())
+        history = engine.execute(
+            'SELECT "trackKey", "playDelta" FROM play_history'
+        ).fetchall()
+    keys = sqllib.intern_names(
+        'TrackKeys', ['track-a', 'track-b'], 'id', 'trackKey'
+    )
+
+    assert not [name for name in names if name.endswith('__legacy')]
+    assert tracks == keys
+    assert history == [(keys['track-b'], 1)]
+
+
+def test_compact_tombstones_removes_expired_ones_in_batches(trackdb, tmp_path):
+    """Tombstones past the retention window are removed, batch by batch."""
+    trackdb.configure(
+        file=str(tmp_path / 'tombstones.db'),
+        tombstones={'retention_days': 30, 'batch_size': 2, 'pause': 0},
+    )
+    now = datetime.datetime.utcnow()
+    expired = now - datetime.timedelta(days=31)
+    recent = now - datetime.timedelta(days=1)
+    Tracks = tables.trackdb.Tracks
+    with trackdb.engine as engine:
+        engine.execute(Tracks.__table__.insert(), [
+            {
+                'trackKey': key,
+                'id': f'track-{key}',
+                'deleted': deleted is not None,
+                'deletedTimestamp': deleted,
+            }
+            for key, deleted in enumerate([expired] * 5 + [recent, None])
+        ])
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(
+            sqllib.compact_tombstones(loop=loop)
+        ) == 5
+    finally:
+        loop.close()
+
+    with trackdb.session('test') as session:
+        kept = [
+            (track.trackKey, track.deleted)
+            for track in session.query(Tracks).order_by(Tracks.trackKey)
+        ]
+    assert kept == [(5, True), (6, False)]